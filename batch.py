@@ -0,0 +1,145 @@
+"""Renders many drawings to PNG or SVG at once, with no display needed.
+
+    python batch.py DRAWING|DIRECTORY... [--format png|svg] [--out-dir DIR]
+                    [--size W H] [--background COLOR] [--jobs N] [--json PATH]
+
+Directories are searched for *.hpaint files. Each drawing is rendered by
+export.py in a pool of worker processes, one per core unless --jobs says
+otherwise, and a line is printed for every file as soon as it is done, so
+the output can be followed while a big batch runs. Outputs go next to the
+drawings, or into --out-dir, named after them. --size scales every picture
+to fit W x H pixels (thumbnails); --background replaces the background each
+drawing was saved with. A timing summary ends the run; --json also writes
+the per-file results. The exit status is 1 when any file failed.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import export
+from raster import parse_color
+
+SUFFIX = ".hpaint"
+SLOWEST = 5  # files listed in the summary
+
+
+def find_drawings(paths):
+    """The drawing files named by paths, directories expanded to the drawings in them."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, dirs, files in os.walk(path):
+                dirs.sort()
+                found += [os.path.join(folder, name) for name in sorted(files) if name.endswith(SUFFIX)]
+        else:
+            found.append(path)
+    return found
+
+
+def output_path(path, fmt, out_dir=None):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(out_dir or os.path.dirname(path), f"{stem}.{fmt}")
+
+
+def render(path, out_path, size=None, background=None):
+    """Runs in a worker: renders one drawing and says how it went, as a dict."""
+    start = time.perf_counter()
+    result = {"drawing": path, "output": out_path}
+    try:
+        result["items"] = export.export(path, out_path, background=background, size=size)
+        result["bytes"] = os.path.getsize(out_path)
+    except (OSError, ValueError) as e:
+        message = str(e)  # a FormatError's already starts with the path
+        result["error"] = message if message.startswith(path) else f"{path}: {message}"
+    except Exception as e:
+        # whatever else goes wrong with one file, the rest of the batch goes on
+        result["error"] = f"{path}: {type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def run(paths, fmt="png", out_dir=None, size=None, background=None, jobs=None, report=None):
+    """Renders the drawings in a process pool; returns the results in the order they finished.
+
+    report, if given, is called with each result as soon as it is there.
+    """
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = {pool.submit(render, path, output_path(path, fmt, out_dir), size, background): path
+                   for path in paths}
+        for future in as_completed(pending):
+            try:
+                result = future.result()
+            except Exception as e:  # the worker died, e.g. out of memory
+                path = pending[future]
+                result = {"drawing": path, "output": output_path(path, fmt, out_dir),
+                          "error": f"{path}: {type(e).__name__}: {e}", "seconds": 0.0}
+            results.append(result)
+            if report:
+                report(result)
+    return results
+
+
+def print_result(result):
+    if "error" in result:
+        print(f"error {result['error']}", flush=True)  # the message names the file
+    else:
+        print(f"{result['seconds'] * 1000:9.1f} ms  {result['items']:>8} items  "
+              f"{result['drawing']} -> {result['output']}", flush=True)
+
+
+def print_summary(results, wall):
+    done = [result for result in results if "error" not in result]
+    failed = len(results) - len(done)
+    busy = sum(result["seconds"] for result in results)
+    print(f"{len(done)} rendered, {failed} failed in {wall:.2f} s "
+          f"({busy:.2f} s of work, {busy / wall if wall else 0:.1f}x parallel)")
+    if done:
+        times = sorted(result["seconds"] for result in done)
+        print(f"per file: mean {sum(times) / len(times) * 1000:.1f} ms, "
+              f"median {times[len(times) // 2] * 1000:.1f} ms, max {times[-1] * 1000:.1f} ms")
+        print("slowest:")
+        for result in sorted(done, key=lambda result: -result["seconds"])[:SLOWEST]:
+            print(f"{result['seconds'] * 1000:9.1f} ms  {result['drawing']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render Humming Paint drawings to PNG or SVG.")
+    parser.add_argument("drawings", nargs="+", metavar="DRAWING", help="drawing files or directories")
+    parser.add_argument("--format", choices=export.FORMATS, default="png")
+    parser.add_argument("--out-dir", help="write the outputs here instead of next to the drawings")
+    parser.add_argument("--size", nargs=2, type=int, metavar=("W", "H"), help="scale to fit W x H pixels")
+    parser.add_argument("--background", help="background color (default: each drawing's own)")
+    parser.add_argument("--jobs", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--json", metavar="PATH", help="also write the per-file results as JSON")
+    args = parser.parse_args(argv)
+    if args.size and min(args.size) < 1:
+        parser.error("--size must be positive")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be positive")
+    if args.background:
+        try:
+            parse_color(args.background)
+        except ValueError as e:
+            parser.error(f"--background: {e}")
+
+    paths = find_drawings(args.drawings)
+    if not paths:
+        print("error no drawings found", file=sys.stderr)
+        return 1
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    start = time.perf_counter()
+    results = run(paths, args.format, args.out_dir, args.size, args.background, args.jobs, print_result)
+    print_summary(results, time.perf_counter() - start)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 1 if any("error" in result for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
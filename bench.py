@@ -0,0 +1,322 @@
+"""Benchmarks the drawing handlers on synthetic workloads.
+
+    python bench.py [--target scene|tk|both] [--scale N] [--runs N]
+                    [--save-baseline | --check] [--baseline PATH]
+
+The workloads run one after the other on the same, growing drawing: long
+pencil strokes, rubber-band shape drags, bulk text placement, then eraser
+scribbles over all of it. The "tk" target drives code.py's own start_draw,
+draw and stop_draw on a real canvas (under Xvfb when there is no display);
+the "scene" target runs the same input pipeline (controller.py) against a
+bare Scene. Motion points are flushed every FRAME_EVENTS events rather than
+by a timer, so every run does the same work.
+
+For each workload it reports events per second, p50/p99 handler latency,
+the scene and canvas item counts and the process RSS afterwards: the median
+timings of --runs runs, or with --check the best ones, so a regression has
+to show in every run. --check compares against the baseline written by
+--save-baseline (bench_baseline.json holds one for the scene target) and
+exits with 1 when events/s dropped or p99 latency rose by more than
+--tolerance, or when there is no baseline.
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+from controller import SHAPE_TOOLS, Controller
+from scene import Scene
+
+FRAME_EVENTS = 4  # motion events per frame flush
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+TARGETS = ("scene", "tk")
+P99_SLACK = 20e-6  # seconds a p99 may rise whatever the tolerance: a few microseconds are noise
+
+
+def pencil_strokes(scale):
+    """Long wavy strokes across the canvas."""
+    yield "mode", "pencil"
+    for stroke in range(10 * scale):
+        y0 = 20 + (stroke * 37) % 700
+        yield "start_draw", 10, y0
+        for i in range(1, 1500):
+            yield "draw", 10 + i * 0.6, y0 + 40 * math.sin(i / 25 + stroke)
+        yield "stop_draw", 10 + 1499 * 0.6, y0 + 40 * math.sin(1499 / 25 + stroke)
+
+
+def shape_drags(scale):
+    """Rubber-band drags of rectangles and ovals."""
+    for shape in range(1000 * scale):
+        yield "mode", "square" if shape % 2 else "circle"
+        x, y = (shape * 53) % 900, (shape * 29) % 700
+        yield "start_draw", x, y
+        for i in range(1, 11):
+            yield "draw", x + 6 * i, y + 4 * i
+        yield "stop_draw", x + 60, y + 40
+
+
+def text_placement(scale):
+    yield "mode", "text"
+    for i in range(500 * scale):
+        yield "start_draw", (i * 71) % 900, (i * 43) % 700
+        yield "stop_draw", (i * 71) % 900, (i * 43) % 700
+
+
+def eraser_scribbles(scale):
+    """Zig-zags over the drawing left by the other workloads."""
+    yield "mode", "eraser"
+    for scribble in range(10 * scale):
+        x0, y0 = (scribble * 97) % 800, (scribble * 61) % 600
+        yield "start_draw", x0, y0
+        for i in range(1, 400):
+            yield "draw", x0 + 30 * math.sin(i / 3), y0 + i * 0.5
+        yield "stop_draw", x0, y0 + 200
+
+
+WORKLOADS = {"pencil": pencil_strokes, "shapes": shape_drags,
+             "text": text_placement, "eraser": eraser_scribbles}
+
+
+class SceneTarget:
+    """code.py's input handlers without Tk: its Controller on a bare Scene."""
+
+    name = "scene"
+
+    def __init__(self):
+        self.scene = Scene()
+        self.controller = Controller(self.scene)
+        self.mode = "pencil"
+        self.width = 1
+        self.shape_start = None
+
+    def activate_mode(self, mode):
+        self.mode = mode
+
+    def start_draw(self, event):
+        x, y = event.x, event.y
+        if self.mode in ("pencil", "eraser"):
+            self.controller.start_stroke(self.mode, x, y, "black", self.width)
+        elif self.mode in SHAPE_TOOLS:
+            self.shape_start = (x, y)
+        elif self.mode == "text":
+            self.controller.add_text(x, y, "benchmark text", "black", "Arial", 12)
+
+    def draw(self, event):
+        if self.mode in ("pencil", "eraser"):
+            self.controller.move(event.x, event.y)
+
+    def flush_points(self):
+        self.controller.flush()
+
+    def stop_draw(self, event):
+        if self.mode in ("pencil", "eraser"):
+            self.controller.stop_stroke()
+        elif self.shape_start:
+            self.controller.add_shape(SHAPE_TOOLS[self.mode], *self.shape_start, event.x, event.y,
+                                      "black", self.width)
+            self.shape_start = None
+
+    def after_event(self):
+        pass
+
+    def canvas_items(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+class TkTarget:
+    """The real app: code.py loaded as a module, drawing on its canvas."""
+
+    name = "tk"
+
+    def __init__(self):
+        import replay
+        self.display = None
+        if not os.environ.get("DISPLAY"):
+            self.display = start_virtual_display()
+        self.app = replay.load_app()
+        self.app.simpledialog = types.SimpleNamespace(askstring=lambda *args, **kwargs: "benchmark text")
+        self.scene = self.app.scene
+        self.app.root.update()
+
+    def __getattr__(self, name):
+        # start_draw, draw, stop_draw, flush_points, activate_mode
+        return getattr(self.app, name)
+
+    def after_event(self):
+        app = self.app
+        if app.frame_job is not None:
+            app.canvas.after_cancel(app.frame_job)  # flushed by the benchmark instead
+        app.root.update_idletasks()
+
+    def canvas_items(self):
+        return len(self.app.canvas.find_all())
+
+    def close(self):
+        self.app.root.destroy()
+        if self.display:
+            self.display.terminate()
+            self.display.wait()
+
+
+def start_virtual_display():
+    xvfb = shutil.which("Xvfb")
+    if not xvfb:
+        raise RuntimeError("the tk target needs a display or Xvfb")
+    display = ":%d" % (90 + os.getpid() % 100)
+    process = subprocess.Popen([xvfb, display, "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ["DISPLAY"] = display
+    time.sleep(0.5)
+    return process
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def run_workload(target, workload, scale):
+    latencies = []
+    motion = 0
+    clock = time.perf_counter
+    start = clock()
+    for handler, *args in workload(scale):
+        if handler == "mode":
+            target.activate_mode(args[0])
+            continue
+        event = types.SimpleNamespace(x=args[0], y=args[1])
+        began = clock()
+        getattr(target, handler)(event)
+        if handler == "draw":
+            motion += 1
+            if motion % FRAME_EVENTS == 0:
+                target.flush_points()
+        target.after_event()
+        latencies.append(clock() - began)
+    elapsed = clock() - start
+    return {
+        "events": len(latencies),
+        "events_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+        "items": len(target.scene),
+        "canvas_items": target.canvas_items(),
+        "rss": rss_bytes(),
+    }
+
+
+def run(targets, scale):
+    results = {}
+    for name in targets:
+        target = SceneTarget() if name == "scene" else TkTarget()
+        try:
+            for workload_name, workload in WORKLOADS.items():
+                results[f"{name}/{workload_name}"] = run_workload(target, workload, scale)
+        finally:
+            target.close()
+    return results
+
+
+def combine(runs, best=False):
+    """One result per benchmark from several runs: the median of each timing, or the best one."""
+    combined = {}
+    for name, first in runs[0].items():
+        result = dict(first)
+        for key in ("events_per_sec", "p50", "p99"):
+            values = sorted(r[name][key] for r in runs)
+            if best:
+                result[key] = values[-1] if key == "events_per_sec" else values[0]
+            else:
+                result[key] = statistics.median(values)
+        combined[name] = result
+    return combined
+
+
+def print_results(results):
+    print(f"{'benchmark':<16}{'events':>9}{'events/s':>11}{'p50 us':>9}{'p99 us':>9}"
+          f"{'items':>8}{'canvas':>8}{'RSS MB':>8}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['events']:>9}{r['events_per_sec']:>11.0f}{r['p50'] * 1e6:>9.1f}"
+              f"{r['p99'] * 1e6:>9.1f}{r['items']:>8}{r['canvas_items']:>8}{r['rss'] / 2 ** 20:>8.1f}")
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if r["events_per_sec"] < base["events_per_sec"] * (1 - tolerance):
+            found.append(f"{name}: {r['events_per_sec']:.0f} events/s, baseline {base['events_per_sec']:.0f}")
+        if r["p99"] > max(base["p99"] * (1 + tolerance), base["p99"] + P99_SLACK):
+            found.append(f"{name}: p99 {r['p99'] * 1e6:.1f} us, baseline {base['p99'] * 1e6:.1f} us")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Humming Paint drawing handlers.")
+    parser.add_argument("--target", choices=TARGETS + ("both",), default="scene")
+    parser.add_argument("--scale", type=int, default=1, help="multiply the workload sizes")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--save-baseline", action="store_true")
+    mode.add_argument("--check", action="store_true", help="fail on regressions against the baseline")
+    parser.add_argument("--runs", type=int, default=3, help="runs to take the median (--check: best) of")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.check or args.save_baseline and os.path.exists(args.baseline):
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"error cannot read the baseline {args.baseline} ({e}); "
+                  f"write one with --save-baseline", file=sys.stderr)
+            return 1
+    targets = TARGETS if args.target == "both" else (args.target,)
+    missing = [f"{name}/{workload}" for name in targets for workload in WORKLOADS
+               if args.check and f"{name}/{workload}" not in baseline]
+    if missing:
+        print(f"error no baseline for {', '.join(missing)} in {args.baseline}", file=sys.stderr)
+        return 1
+    try:
+        runs = [run(targets, args.scale) for _ in range(args.runs)]
+    except RuntimeError as e:
+        print(f"error {e}", file=sys.stderr)
+        return 1
+    # the baseline is a typical run, and a regression has to show in every run
+    results = combine(runs, best=args.check)
+    print_results(results)
+    if args.check:
+        found = regressions(results, baseline, args.tolerance)
+        for line in found:
+            print(f"regression {line}")
+        return 1 if found else 0
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""A small bitmap font, so text can be drawn without a font rasterizer.
+
+Each printable ASCII character is a 5 x 8 glyph: rows top to bottom, the top
+bit of the 5 the leftmost pixel, the last row below the baseline. Glyphs are
+drawn in cells of 6 x 15 units (the pixel spacing and leading around them),
+which is text_extent's rough 0.6 x 1.5 em at a unit of a tenth of the size.
+Other characters are drawn as a box.
+"""
+from functools import lru_cache
+
+GLYPH_WIDTH, GLYPH_HEIGHT = 5, 8
+ADVANCE = 6  # units from one character to the next
+LINE_HEIGHT = 15  # units from one line to the next
+TOP = 4  # units above a glyph in its line
+UNIT = 0.1  # a unit, in ems
+
+# GLYPH_HEIGHT rows of two hex digits per glyph, for characters 32 to 126
+GLYPHS = (
+    "000000000000000004040404040004000a0a0a00000000000a0a1f0a1f0a0a00"  #  !"#
+    "040f140e051e040018190204081303000c12140815120d000404040000000000"  # $%&'
+    "020408080804020008040202020408000004150e150400000004041f04040000"  # ()*+
+    "00000000000404080000001f0000000000000000000004000001020408100000"  # ,-./
+    "0e11131519110e00040c040404040e000e11010204081f001f02040201110e00"  # 0123
+    "02060a121f0202001f101e0101110e000608101e11110e001f01020408080800"  # 4567
+    "0e11110e11110e000e11110f01020c0000000400000400000000040000040408"  # 89:;
+    "020408100804020000001f001f00000008040201020408000e11010204000400"  # <=>?
+    "0e11010d15150e000e11111f111111001e11111e11111e000e11101010110e00"  # @ABC
+    "1c12111111121c001f10101e10101f001f10101e101010000e11101711110f00"  # DEFG
+    "1111111f111111000e04040404040e000702020202120c001112141814121100"  # HIJK
+    "1010101010101f00111b15151111110011111915131111000e11111111110e00"  # LMNO
+    "1e11111e101010000e11111115120d001e11111e141211000f10100e01011e00"  # PQRS
+    "1f040404040404001111111111110e0011111111110a04001111111515150a00"  # TUVW
+    "11110a040a1111001111110a040404001f01020408101f000e08080808080e00"  # XYZ[
+    "00100804020100000e02020202020e00040a1100000000000000000000001f00"  # \]^_
+    "080400000000000000000e010f110f001010161911111e0000000e1010110e00"  # `abc
+    "01010d1311110f0000000e111f100e000609081c0808080000000f11110f010e"  # defg
+    "101016191111110004000c0404040e00020006020202120c1010121418141200"  # hijk
+    "0c04040404040e0000001a1515111100000016191111110000000e1111110e00"  # lmno
+    "00001e11111e101000000f11110f0101000016191010100000000f100e011e00"  # pqrs
+    "08081c08080906000000111111130d0000001111110a04000000111115150a00"  # tuvw
+    "0000110a040a110000001111110f010e00001f0204081f000204040804040200"  # xyz{
+    "040404040404040008040402040408000000081502000000"  # |}~
+)
+BOX = (0x1F, 0x11, 0x11, 0x11, 0x11, 0x11, 0x1F, 0)
+
+
+@lru_cache(maxsize=256)
+def glyph(char):
+    """The rows of a character's glyph, as GLYPH_WIDTH-bit numbers."""
+    code = ord(char) - 32
+    if not 0 <= code < 95:
+        return BOX
+    start = code * 2 * GLYPH_HEIGHT
+    return tuple(bytes.fromhex(GLYPHS[start:start + 2 * GLYPH_HEIGHT]))
+
+
+@lru_cache(maxsize=256)
+def runs(char):
+    """(row, first, last) runs of the character's lit pixels."""
+    found = []
+    for row, bits in enumerate(glyph(char)):
+        column = 0
+        while column < GLYPH_WIDTH:
+            if bits >> (GLYPH_WIDTH - 1 - column) & 1:
+                first = column
+                while column + 1 < GLYPH_WIDTH and bits >> (GLYPH_WIDTH - 2 - column) & 1:
+                    column += 1
+                found.append((row, first, column))
+            column += 1
+    return tuple(found)
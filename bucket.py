@@ -0,0 +1,279 @@
+"""Flood fill ("paint bucket") over a rasterized view of the scene.
+
+fill_at() draws the visible layers' items in the view into a Raster at the
+screen resolution, finds the pixels connected to the clicked one whose color
+is within the tolerance of its color, and returns them as one scene.Fill
+record of row spans.
+
+With NumPy the fill is a scanline fill done on whole arrays: every row is
+split into runs of matching pixels, runs in neighbouring rows that share a
+column are joined with a vectorized union-find, and the runs joined to the
+clicked one are the filled area. Without NumPy a classic span-stack scanline
+fill walks the pixel buffer instead.
+
+Rasterizing a busy view costs far more than filling it. A ViewCache keeps
+the last rasterized view for the next fill: items committed on top of the
+drawing (the fills themselves, mostly) are drawn into it, and any other
+change drops it. The GUI draws it again a few items at a time while idle
+(ViewCache.warm), so a fill usually finds it ready. When it is not, the fill
+only rasterizes the items around the filled area: those at the clicked point,
+then those meeting the box of the area filled so far, until no other item
+meets it (pixels the others do not touch look the same either way). Only
+once the area grows past FULL_VIEW of the view is all of it rasterized.
+"""
+import itertools
+import math
+
+from raster import Raster
+from scene import Fill, scaled
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FULL_VIEW = 0.25  # share of the view past which a fill rasterizes all of it
+MARGIN = 2  # pixels around the filled area whose items are drawn too, for rounding
+WARM_ITEMS = 50  # items drawn per ViewCache.warm call
+
+
+def rasterize(scene, view, zoom, background="white", ids=None):
+    """The scene's visible items in the world rectangle view, at the given zoom.
+
+    ids (in stacking order) limits it to those items. Text and pictures are
+    not rasterized, so they do not stop a fill.
+    """
+    raster = view_raster(view, zoom, background)
+    draw_items(raster, scene, visible_items(scene, view) if ids is None else ids, zoom)
+    return raster
+
+
+def view_raster(view, zoom, background="white"):
+    x1, y1, x2, y2 = view
+    ox, oy = math.floor(x1 * zoom), math.floor(y1 * zoom)
+    return Raster(max(1, math.ceil(x2 * zoom) - ox), max(1, math.ceil(y2 * zoom) - oy),
+                  background, origin=(ox, oy))
+
+
+def visible_items(scene, box):
+    """Ids of the items of visible layers meeting the box, in stacking order."""
+    items = scene.items
+    shown = {layer.id for layer in scene.layers if layer.visible}
+    return [item_id for item_id in scene.find_overlapping(*box) if items[item_id].layer in shown]
+
+
+def draw_items(raster, scene, ids, zoom):
+    records = (scene.items[item_id] for item_id in ids)
+    raster.draw_all(records if zoom == 1 else (scaled(record, zoom) for record in records))
+
+
+def fill_around(scene, column, row, view, zoom, background="white", tolerance=0):
+    """(raster, spans) of the fill from pixel (column, row), rasterizing only the items around it.
+
+    Returns None once the filled area covers more than FULL_VIEW of the view.
+    """
+    vx1, vy1, vx2, vy2 = view
+    limit = FULL_VIEW * (vx2 - vx1) * (vy2 - vy1)
+    margin = MARGIN / zoom
+    ox, oy = math.floor(vx1 * zoom), math.floor(vy1 * zoom)
+    x1 = x2 = (ox + column) / zoom
+    y1 = y2 = (oy + row) / zoom
+    drawn = set()
+    raster = spans = None
+    while True:
+        near = visible_items(scene, (max(x1 - margin, vx1), max(y1 - margin, vy1),
+                                     min(x2 + margin, vx2), min(y2 + margin, vy2)))
+        if raster is not None and drawn.issuperset(near):
+            return raster, spans
+        # drawn again from scratch: a new item may lie under ones drawn before
+        drawn.update(near)
+        raster = rasterize(scene, view, zoom, background, sorted(drawn, key=scene.stacking_key))
+        spans = flood_spans(raster, column, row, tolerance)
+        rows, firsts, lasts = spans[0::3], spans[1::3], spans[2::3]
+        x1, y1 = (ox + min(firsts)) / zoom, (oy + min(rows)) / zoom
+        x2, y2 = (ox + max(lasts)) / zoom, (oy + max(rows)) / zoom
+        if (x2 - x1) * (y2 - y1) > limit:
+            return None
+
+
+class ViewCache:
+
+    def __init__(self, scene):
+        self.scene = scene
+        self.key = None
+        self.raster = None
+        self.pending = None  # (key, raster, ids left to draw) while warm() is drawing
+        scene.listeners.append(self.changed)
+
+    def changed(self, op, item_id, record):
+        if op in ("add", "extend"):
+            return  # a live stroke that is not finished yet
+        self.pending = None
+        if self.raster is None:
+            return
+        if op == "commit":
+            layer = self.scene.layer(record.layer)
+            if not layer.visible:
+                return
+            if (self.scene.order[item_id] == self.scene.top
+                    and layer is [shown for shown in self.scene.layers if shown.visible][-1]):
+                # on top of everything (not put back under others by undo or a move):
+                # draw it over the cached pixels
+                view, zoom, background = self.key
+                self.raster.draw(record if zoom == 1 else scaled(record, zoom))
+                return
+        self.raster = None
+
+    def get(self, view, zoom, background="white", draw=True):
+        """The rasterized view, drawn again only when it or the drawing changed.
+
+        With draw false it is None instead of drawn again.
+        """
+        key = (tuple(view), zoom, background)
+        if self.raster is None or key != self.key:
+            if not draw:
+                return None
+            self.raster = rasterize(self.scene, view, zoom, background)
+            self.key = key
+        return self.raster
+
+    def warm(self, view, zoom, background="white"):
+        """Draws the next WARM_ITEMS items of the view; True once the cache holds all of it."""
+        key = (tuple(view), zoom, background)
+        if self.raster is not None and key == self.key:
+            return True
+        if self.pending is None or self.pending[0] != key:
+            self.pending = key, view_raster(view, zoom, background), iter(visible_items(self.scene, view))
+        raster, ids = self.pending[1:]
+        chunk = list(itertools.islice(ids, WARM_ITEMS))
+        draw_items(raster, self.scene, chunk, zoom)
+        if len(chunk) < WARM_ITEMS:
+            self.key, self.raster, self.pending = key, raster, None
+            return True
+        return False
+
+
+def flood_spans(raster, column, row, tolerance=0):
+    """The (row, first, last) pixel spans connected to (column, row), as a flat list.
+
+    A pixel matches when no channel differs from the clicked one by more than
+    tolerance; pixels connect to their four neighbours.
+    """
+    if np is None:
+        return scanline_fill(raster, column, row, tolerance)
+    pixels = raster.pixels
+    height, width = pixels.shape[:2]
+    match = None
+    for channel, target in enumerate(pixels[row, column].tolist()):
+        low = max(target - tolerance, 0)
+        # subtracting low wraps the values below it around to the top of the range
+        plane = np.ascontiguousarray(pixels[..., channel])
+        plane -= np.uint8(low)
+        near = plane <= np.uint8(min(target + tolerance, 255) - low)
+        match = near if match is None else match & near
+    # runs of matching pixels, by the flat index (row * width + column) of their ends
+    starts = match.copy()
+    starts[:, 1:] &= ~match[:, :-1]
+    ends = match
+    ends[:, :-1] &= ~match[:, 1:]
+    first_index = np.flatnonzero(starts)
+    last_index = np.flatnonzero(ends)
+    rows, firsts = np.divmod(first_index, width)
+    # the runs of the next row sharing a column with each run: [lo, hi)
+    lo = np.searchsorted(last_index, first_index + width)
+    hi = np.searchsorted(first_index, last_index + width, side="right")
+    counts = np.maximum(hi - lo, 0)
+    a = np.repeat(np.arange(len(rows)), counts)
+    b = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(int(counts.sum()))
+    parent = join_runs(len(rows), a, b)
+    seed = np.searchsorted(first_index, row * width + column, side="right") - 1
+    filled = parent == parent[seed]
+    lasts = last_index[filled] - rows[filled] * width
+    return np.stack((rows[filled], firsts[filled], lasts), axis=1).ravel().tolist()
+
+
+def join_runs(count, a, b):
+    """Union-find over count nodes joined by the edges (a[i], b[i]).
+
+    Returns every node's root. Roots are hooked under the smaller of two
+    joined roots, then the trees are flattened by pointer jumping, until no
+    edge joins two trees.
+    """
+    parent = np.arange(count)
+    while len(a):
+        ra, rb = parent[a], parent[b]
+        low, high = np.minimum(ra, rb), np.maximum(ra, rb)
+        apart = low != high
+        if not apart.any():
+            break
+        np.minimum.at(parent, high[apart], low[apart])
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+        # edges inside one tree stay joined
+        a, b = a[apart], b[apart]
+    return parent
+
+
+def scanline_fill(raster, column, row, tolerance=0):
+    width, height, channels = raster.width, raster.height, raster.channels
+    pixels = raster.pixels
+    start = (row * width + column) * channels
+    target = pixels[start:start + channels]
+
+    def matches(x, y):
+        offset = (y * width + x) * channels
+        return all(abs(pixels[offset + c] - target[c]) <= tolerance for c in range(channels))
+
+    done = bytearray(width * height)
+    spans = []
+    stack = [(column, row)]
+    while stack:
+        x, y = stack.pop()
+        if done[y * width + x] or not matches(x, y):
+            continue
+        first = x
+        while first > 0 and not done[y * width + first - 1] and matches(first - 1, y):
+            first -= 1
+        last = x
+        while last < width - 1 and not done[y * width + last + 1] and matches(last + 1, y):
+            last += 1
+        done[y * width + first:y * width + last + 1] = b"\1" * (last - first + 1)
+        spans += (y, first, last)
+        for ny in (y - 1, y + 1):
+            if 0 <= ny < height:
+                # one seed per run of matching pixels next to the span
+                inside = False
+                for nx in range(first, last + 1):
+                    if not done[ny * width + nx] and matches(nx, ny):
+                        if not inside:
+                            stack.append((nx, ny))
+                            inside = True
+                    else:
+                        inside = False
+    return spans
+
+
+def fill_at(scene, x, y, view, zoom, color, background="white", tolerance=0, layer=0, cache=None):
+    """A Fill of the area around world point (x, y), as far as the view reaches, or None.
+
+    cache is an optional ViewCache of the scene.
+    """
+    x1, y1, x2, y2 = view
+    ox, oy = math.floor(x1 * zoom), math.floor(y1 * zoom)
+    column, row = round(x * zoom) - ox, round(y * zoom) - oy
+    if not (0 <= column < math.ceil(x2 * zoom) - ox and 0 <= row < math.ceil(y2 * zoom) - oy):
+        return None
+    raster = None if cache is None else cache.get(view, zoom, background, draw=False)
+    around = None if raster is not None else fill_around(scene, column, row, view, zoom, background,
+                                                         tolerance)
+    if around is not None:
+        raster, spans = around
+    else:
+        if raster is None:
+            raster = rasterize(scene, view, zoom, background) if cache is None else cache.get(
+                view, zoom, background)
+        spans = flood_spans(raster, column, row, tolerance)
+    return Fill(ox / zoom, oy / zoom, 1 / zoom, spans, color, layer)
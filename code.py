@@ -1,18 +1,178 @@
+import time
+STARTED = time.perf_counter()  # startup is timed from here (see perf.Startup)
+import importlib
+import itertools
+import json
+import math
+import os
+import queue
+import sys
+import threading
 import tkinter as tk
-from tkinter import colorchooser
-from tkinter import simpledialog
-from tkinter import font
+
+import journal
+import labels
+import perf
+import storage
+from controller import SHAPE_TOOLS, Controller
+from history import History
+from fonts import FontCache
+from lazy import LazyModule
+from pictures import PictureCache
+from renderer import CanvasRenderer
+from scene import Scene, Picture, set_text_extent
+
+
+# dialogs and what only export, fills and shared sessions need load on first
+# use; NumPy is imported in the background once the window is up (first_frame)
+colorchooser = LazyModule("tkinter.colorchooser")
+filedialog = LazyModule("tkinter.filedialog")
+messagebox = LazyModule("tkinter.messagebox")
+simpledialog = LazyModule("tkinter.simpledialog")
+subprocess = LazyModule("subprocess")
+tempfile = LazyModule("tempfile")
+session = LazyModule("session")
+bucket = LazyModule("bucket")
+
+startup = perf.Startup(STARTED)
+startup.mark("imports")
 
 shape_start_x, shape_start_y = None, None
-prev_x, prev_y = None, None
 temp_shape_id = None
 current_color = "black"
 current_width = 1
 current_font_size = 12 
+TEXT_FAMILY = "Arial"
 canvas_bg_color = "white"
 current_mode = "pencil" 
 
+# The toolbar's tools, in order: mode -> (button label, canvas cursor).
+# The buttons are made from this; the handlers dispatch on the mode.
+TOOLS = {
+    "pencil": ("Pencil", "pencil"),
+    "eraser": ("Eraser", "dotbox"),
+    "square": ("Square", "crosshair"),
+    "circle": ("Circle", "crosshair"),
+    "text": ("Text", "xterm"),
+    "select": ("Select", "arrow"),
+    "fill": ("Fill", "spraycan"),
+    "stamp": ("Stamp", "plus"),
+}
+WIDTHS = (1, 3, 5, 10)  # preset line widths of the toolbar
+
+# Input pipeline for pencil and eraser (see controller.py): the motion
+# points it queues are handed to the scene once per FRAME_MS.
+FRAME_MS = 16
+frame_job = None
+
+# Drag-to-size shape tools (controller.SHAPE_TOOLS) draw a preview of the
+# canvas item type of their record kind on press and reshape it with
+# coords() while dragging, so a new shape tool only needs an entry there.
+
+# Bucket tool: fills the area around the click, as far as the window shows
+# it, whose color is within FILL_TOLERANCE (per RGB channel) of the clicked
+# pixel. The rasterized window is cached between fills (see bucket.py) and,
+# while the tool is active, drawn again a few items at a time when idle.
+FILL_TOLERANCE = 32
+FILL_WARM_MS = 200  # how often an idle bucket tool checks that its cache is current
+
+# Stamp tool: a click places the current image (chosen with the Image
+# button, or on the first click) at its own size, centered on the click;
+# dragging sizes it, keeping its proportions. Every stamp refers to the one
+# copy of the image in scene.images, and the decoded image and its scaled
+# versions are shared through the PictureCache (see pictures.py).
+STAMP_DRAG = 3  # screen pixels a press must move to size the stamp instead
+stamp_key = None  # key in scene.images of the current stamp image
+
+# Select tool: click picks the topmost item within HIT_RADIUS screen pixels
+# (Shift+click toggles it), dragging on empty canvas selects every item
+# inside the band, and dragging a selected item moves the whole selection.
+HIT_RADIUS = 3
+selection = set()  # scene ids
+select_x, select_y = None, None  # where the press happened, in world coordinates
+drag_x, drag_y = None, None
+moving = False
+band_id = None  # rubber band preview
+
+# The picture itself lives in the scene; the renderer mirrors it onto the canvas.
+scene = Scene()
+# Flatten old strokes and shapes into one image so long sessions stay fast.
+BAKE_OLD_ITEMS = True
+# New items go to the active layer and only it can be edited. With
+# CACHE_INACTIVE_LAYERS the other layers are shown as flattened images
+# (toggled with the Cache checkbox of the layers panel).
+CACHE_INACTIVE_LAYERS = True
+active_layer = scene.layers[0].id
+UNDO_MEMORY = 16 * 1024 * 1024  # bytes of undo history to keep
+history = History(scene, max_bytes=UNDO_MEMORY)
+controller = Controller(scene)  # what the drawing tools do to the scene
+fill_cache = None  # a bucket.ViewCache, made when the bucket tool is first used
+fill_warm_job = None
+
+# Viewport navigation: the middle button drags the drawing, the wheel
+# scrolls it by SCROLL_STEP pixels and Ctrl+wheel zooms by ZOOM_STEP.
+ZOOM_STEP = 1.25
+SCROLL_STEP = 60
+pan_x, pan_y = None, None
+
+APP_TITLE = "Humming Paint 4.0 (With text drawing!)"
+FILE_TYPES = [("Humming Paint drawings", "*.hpaint"), ("All files", "*")]
+EXPORT_TYPES = [("PNG image", "*.png"), ("SVG image", "*.svg")]
+LABEL_TYPES = [("Label files", "*.csv *.tsv *.txt"), ("All files", "*")]
+IMAGE_TYPES = [("Images", "*.png *.ppm *.pgm"), ("All files", "*")]
+EXPORT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "export.py")
+LOAD_CHUNK = 2000  # items added per event-loop turn while opening a drawing
+loading = None  # (storage.Drawing, its record iterator) while a drawing is being opened
+
+# Shared sessions (see session.py): what the others draw is merged every
+# SESSION_POLL_MS, for at most SESSION_BUDGET seconds per turn.
+SESSION_POLL_MS = 25
+SESSION_BUDGET = 0.008
+session_client = None  # session.Client and session.Board once joined
+session_board = None
+
 tool_buttons = {}
+autosave = None  # journal.Journal, started when run as the app
+
+# The last session (its drawing, tool, color, width and font size) is read
+# on a worker thread once the first frame is up and merged LOAD_CHUNK
+# items per event-loop turn, so the window shows and takes input at once.
+# Until then strokes can be drawn; they keep their place under the restored items.
+SETTINGS_PATH = os.path.join(journal.default_directory(), "settings.json")
+RESTORE_POLL_MS = 10
+restore_job = None  # pending after() of the restore, until it is done
+recorder = None  # replay.Recorder; a recorded session starts from the default settings
+
+# Every UI entry point (event handlers and toolbar actions) goes through
+# ui_entry, which reports each call to the entry_hooks as
+# hook(name, args, start, seconds, depth); depth is 0 for calls made by Tk
+# itself. replay.py uses this to record and time sessions.
+entry_hooks = []
+entry_depth = 0
+
+
+def ui_entry(func):
+    name = func.__name__
+
+    def entry(*args):
+        global entry_depth
+        if not entry_hooks:
+            return func(*args)
+        depth = entry_depth
+        entry_depth += 1
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            seconds = time.perf_counter() - start
+            entry_depth = depth
+            for hook in entry_hooks:
+                hook(name, args, start, seconds, depth)
+
+    entry.__name__ = name
+    entry.__doc__ = func.__doc__
+    return entry
+
 
 def update_button_states():
    
@@ -22,115 +182,252 @@ def update_button_states():
             if mode != 'color':
                  button.config(relief=relief)
 
+def show_color():
+    """Paints the Color button in the current color, with text that stays readable on it."""
+    try:
+        r, g, b = root.winfo_rgb(current_color)
+        fg_color = 'white' if (r + g + b) / 3 / 65535 < 0.5 else 'black'
+    except tk.TclError:
+        fg_color = 'black'
+    tool_buttons['color'].config(bg=current_color, activebackground=current_color,
+                                 fg=fg_color, activeforeground=fg_color)
+
+@ui_entry
 def activate_mode(mode):
     
     global current_mode
     if current_mode == mode: return
     current_mode = mode
     print(f"Mode: {current_mode}")
-
-    cursors = {
-        "pencil": "pencil", "eraser": "dotbox", "square": "crosshair",
-        "circle": "crosshair", "text": "xterm"
-    }
-    canvas.config(cursor=cursors.get(mode, "")) 
+    select_items(())
+    canvas.config(cursor=TOOLS[mode][1])
     update_button_states()
+    start_fill_warming()
 
 
-def get_drawing_color():
-   
-    return canvas_bg_color if current_mode == "eraser" else current_color
+def start_fill_warming():
+    global fill_warm_job
+    if current_mode == "fill" and fill_warm_job is None:
+        fill_warm_job = root.after_idle(warm_fill_cache)
+
+
+def view_cache():
+
+    global fill_cache
+    if fill_cache is None:
+        fill_cache = bucket.ViewCache(scene)
+    return fill_cache
+
+
+def warm_fill_cache():
+    """Rasterizes the view for the bucket tool, a chunk at a time, until it is cached."""
+    global fill_warm_job
+    fill_warm_job = None
+    if current_mode != "fill":
+        return
+    done = view_cache().warm(renderer.view(), renderer.zoom, canvas_bg_color)
+    fill_warm_job = root.after(FILL_WARM_MS if done else 1, warm_fill_cache)
+
+
+def bucket_fill(x, y):
+    """Fills the area around world point (x, y) with the current color."""
+    record = bucket.fill_at(scene, x, y, renderer.view(), renderer.zoom, current_color,
+                            canvas_bg_color, FILL_TOLERANCE, active_layer, view_cache())
+    if record is not None:
+        scene.add(record)
+
+
+def stamp_rect(x, y):
+    """The world rectangle of a stamp pressed at the start point and released at (x, y)."""
+    width, height = pictures.size_of(stamp_key) or (1, 1)
+    x0, y0 = shape_start_x, shape_start_y
+    if max(abs(x - x0), abs(y - y0)) * renderer.zoom < STAMP_DRAG:
+        return x0 - width / 2, y0 - height / 2, x0 + width / 2, y0 + height / 2
+    # the drag sets the width, or the height when it is the larger part of the proportions
+    scale = max(abs(x - x0) / width, abs(y - y0) / height)
+    x1 = x0 + math.copysign(width * scale, x - x0)
+    y1 = y0 + math.copysign(height * scale, y - y0)
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def select_items(ids):
+
+    global selection
+    selection = set(ids)
+    renderer.select(selection)
+
+
+def start_select(x, y, shift):
+
+    global select_x, select_y, drag_x, drag_y, moving, band_id
+    select_x, select_y = drag_x, drag_y = x, y
+    hit = scene.find_at(x, y, HIT_RADIUS / renderer.zoom, active_layer)
+    if hit is None:
+        if not shift:
+            select_items(())
+        band_id = canvas.create_rectangle(*renderer.to_canvas(x, y, x, y), dash=(2, 2), outline="gray")
+    elif shift:
+        select_items(selection ^ {hit})
+    else:
+        if hit not in selection:
+            select_items((hit,))
+        moving = True
+
+
+def drag_select(x, y):
 
+    global drag_x, drag_y
+    if moving:
+        renderer.drag_selection(x - drag_x, y - drag_y)
+        drag_x, drag_y = x, y
+    elif band_id:
+        canvas.coords(band_id, *renderer.to_canvas(select_x, select_y, x, y))
+
+
+def stop_select(x, y):
+
+    global moving, band_id
+    if moving:
+        moving = False
+        ids = [item_id for item_id in selection if item_id in scene.items]
+        if x != select_x or y != select_y:
+            scene.move(ids, x - select_x, y - select_y)
+        select_items(ids)
+    elif band_id:
+        canvas.delete(band_id)
+        band_id = None
+        found = scene.find_enclosed(min(select_x, x), min(select_y, y), max(select_x, x), max(select_y, y),
+                                    active_layer)
+        select_items(selection | set(found))
+
+
+@ui_entry
+def delete_selection(event=None):
+
+    if current_mode == "select" and not moving:
+        ids = [item_id for item_id in selection if item_id in scene.items]
+        select_items(())
+        for item_id in ids:
+            scene.remove(item_id)
+        history.checkpoint()
+
+
+def shape_color_option(kind):
+
+    return "fill" if kind == "line" else "outline"
+
+
+@ui_entry
 def start_draw(event):
     """Called when the mouse button is pressed."""
-    global shape_start_x, shape_start_y, prev_x, prev_y, temp_shape_id
+    global shape_start_x, shape_start_y, temp_shape_id
     temp_shape_id = None
 
+    if not scene.editable(active_layer):
+        root.bell()  # the active layer is hidden or locked
+        return
+    x, y = renderer.to_world(event.x, event.y)
     if current_mode in ["pencil", "eraser"]:
-        prev_x, prev_y = event.x, event.y
-        draw_color = get_drawing_color()
-        if current_width <= 1 and current_mode == "pencil":
-             canvas.create_line(event.x, event.y, event.x+1, event.y, fill=draw_color, width=1)
-        elif current_width <= 1 and current_mode == "eraser":
-             canvas.create_line(event.x, event.y, event.x+1, event.y, fill=draw_color, width=1)
-        else:
-            radius = current_width / 2
-            canvas.create_oval(event.x - radius, event.y - radius,
-                               event.x + radius, event.y + radius,
-                               fill=draw_color, outline=draw_color, width=0)
-    elif current_mode in ["square", "circle"]:
-        shape_start_x, shape_start_y = event.x, event.y
+        controller.start_stroke(current_mode, x, y, current_color, current_width, active_layer,
+                                renderer.zoom)
+    elif current_mode in SHAPE_TOOLS:
+        shape_start_x, shape_start_y = x, y
+        kind = SHAPE_TOOLS[current_mode]
+        creator = getattr(canvas, "create_" + kind)
+        temp_shape_id = creator(*renderer.to_canvas(x, y, x, y), dash=(2, 2),
+                                **{shape_color_option(kind): "gray"})
+    elif current_mode == "select":
+        start_select(x, y, getattr(event, "state", 0) & 0x1)
+    elif current_mode == "fill":
+        bucket_fill(x, y)
+    elif current_mode == "stamp":
+        if stamp_key is None:
+            import_image()
+            return
+        shape_start_x, shape_start_y = x, y
+        temp_shape_id = canvas.create_rectangle(*renderer.to_canvas(*stamp_rect(x, y)), dash=(2, 2),
+                                                outline="gray")
     elif current_mode == "text":
         user_text = simpledialog.askstring("Enter Text", "Text to draw:", parent=root)
         if user_text:
-            canvas.create_text(event.x, event.y, text=user_text,
-                               fill=current_color, anchor=tk.NW,
-                               font=("Arial", current_font_size), 
-                               tags='drawn_text')
+            controller.add_text(x, y, user_text, current_color, TEXT_FAMILY, current_font_size,
+                                active_layer)
+            history.checkpoint()
 
 
+@ui_entry
 def draw(event):
     
-    global prev_x, prev_y, temp_shape_id
+    global frame_job
+
+    x, y = renderer.to_world(event.x, event.y)
+    if controller.drawing:
+        if controller.move(x, y) and frame_job is None:
+            frame_job = canvas.after(FRAME_MS, flush_points)
+    elif current_mode == "select":
+        drag_select(x, y)
+    elif current_mode == "stamp" and temp_shape_id:
+        canvas.coords(temp_shape_id, *renderer.to_canvas(*stamp_rect(x, y)))
+    elif temp_shape_id:
+        canvas.coords(temp_shape_id, *renderer.to_canvas(shape_start_x, shape_start_y, x, y))
 
-    if current_mode in ["pencil", "eraser"]:
-        if prev_x is not None and prev_y is not None:
-            draw_color = get_drawing_color()
-            canvas.create_line(prev_x, prev_y, event.x, event.y,
-                               fill=draw_color, width=current_width,
-                               capstyle=tk.ROUND, smooth=tk.TRUE,
-                               tags=('line' if current_mode == 'pencil' else 'erased_line'))
-            prev_x, prev_y = event.x, event.y
-    elif current_mode in ["square", "circle"] and shape_start_x is not None:
-        if temp_shape_id:
-            canvas.delete(temp_shape_id)
-        x1, y1 = shape_start_x, shape_start_y
-        x2, y2 = event.x, event.y
-        creator = canvas.create_rectangle if current_mode == "square" else canvas.create_oval
-        temp_shape_id = creator(x1, y1, x2, y2, outline="gray", dash=(2, 2))
 
+@ui_entry
+def flush_points():
+    """Hands the motion points queued since the last frame to the scene."""
+    global frame_job
+    frame_job = None
+    controller.flush()
 
+
+@ui_entry
 def stop_draw(event):
     
-    global prev_x, prev_y, shape_start_x, shape_start_y, temp_shape_id
+    global shape_start_x, shape_start_y, temp_shape_id
 
-    if temp_shape_id:
+    if controller.drawing:
+        if frame_job is not None:
+            canvas.after_cancel(frame_job)
+        flush_points()
+        if controller.stop_stroke() is not None:
+            startup.mark_idle(canvas, "first_stroke")
+    elif current_mode == "select":
+        stop_select(*renderer.to_world(event.x, event.y))
+    elif current_mode == "stamp" and temp_shape_id:
+        x1, y1, x2, y2 = stamp_rect(*renderer.to_world(event.x, event.y))
         canvas.delete(temp_shape_id)
+        scene.add(Picture(x1, y1, x2 - x1, y2 - y1, stamp_key, active_layer))
+        startup.mark_idle(canvas, "first_stroke")
+        shape_start_x, shape_start_y = None, None
         temp_shape_id = None
-
-    if current_mode in ["pencil", "eraser"]:
-        prev_x, prev_y = None, None
-    elif current_mode in ["square", "circle"] and shape_start_x is not None:
+    elif temp_shape_id:
         x1, y1 = shape_start_x, shape_start_y
-        x2, y2 = event.x, event.y
-        draw_color = current_color
-        effective_width = max(1, current_width)
-        creator = canvas.create_rectangle if current_mode == "square" else canvas.create_oval
-        if x1 == x2 and y1 == y2:
-             x2 += effective_width
-             y2 += effective_width
-        creator(x1, y1, x2, y2, outline=draw_color, width=effective_width, tags='drawn_shape')
+        x2, y2 = renderer.to_world(event.x, event.y)
+        kind = canvas.type(temp_shape_id)
+        canvas.delete(temp_shape_id)
+        controller.add_shape(kind, x1, y1, x2, y2, current_color, current_width, active_layer)
+        startup.mark_idle(canvas, "first_stroke")
         shape_start_x, shape_start_y = None, None
+        temp_shape_id = None
+    history.checkpoint()
 
 
+@ui_entry
 def choose_color():
     
     global current_color
     color_code = colorchooser.askcolor(title="Choose Color", initialcolor=current_color)
     if color_code and color_code[1]:
         current_color = color_code[1]
-        if 'color' in tool_buttons and tool_buttons['color']:
-            btn = tool_buttons['color']
-            btn.config(bg=current_color, activebackground=current_color)
-            try: 
-                r, g, b = root.winfo_rgb(current_color)
-                brightness = (r + g + b) / 3 / 65535
-                fg_color = 'white' if brightness < 0.5 else 'black'
-                btn.config(fg=fg_color, activeforeground=fg_color)
-            except:
-                 btn.config(fg='black', activeforeground='black')
+        if current_mode == "select" and selection:
+            ids = [item_id for item_id in selection if item_id in scene.items]
+            scene.recolor(ids, current_color)
+            select_items(ids)
+            history.checkpoint()
+        show_color()
 
 
+@ui_entry
 def set_width(size):
    
     global current_width
@@ -144,6 +441,7 @@ def set_width(size):
     current_width = new_width
     print(f"Thickness set to: {current_width}px")
 
+@ui_entry
 def set_font_size():
     
     global current_font_size
@@ -156,49 +454,517 @@ def set_font_size():
         print(f"Font size set to: {current_font_size}pt")
 
 
+@ui_entry
 def clear_canvas():
     
-    canvas.delete("all")
+    stop_restore()
+    select_items(())
+    scene.clear()
+    history.checkpoint()
 
 
-root = tk.Tk()
-root.title("Humming Paint 4.0 (With text drawing!)") 
+@ui_entry
+def select_layer(layer_id):
+    """Makes the layer the one that is drawn on."""
+    global active_layer
+    if layer_id == active_layer or controller.drawing or temp_shape_id is not None or moving:
+        return
+    select_items(())
+    active_layer = layer_id
+    renderer.set_active_layer(layer_id)
+    refresh_layer_list()
 
-controls_frame = tk.Frame(root, bd=2, relief=tk.RAISED)
-controls_frame.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
 
-btn_width = 6
-tool_buttons["pencil"] = tk.Button(controls_frame, text="Pencil", width=btn_width, command=lambda: activate_mode("pencil"))
-tool_buttons["pencil"].pack(side=tk.LEFT, padx=(5, 2), pady=2)
+@ui_entry
+def new_layer():
+
+    layer = scene.add_layer()
+    if layer is None:
+        messagebox.showinfo("Layers", "No more layers can be added.", parent=root)
+        return
+    select_layer(layer.id)
+
+
+@ui_entry
+def delete_layer():
+
+    if len(scene.layers) == 1 or controller.drawing or temp_shape_id is not None:
+        return
+    select_items(())
+    scene.remove_layer(active_layer)
+    history.checkpoint()  # the items are brought back to the bottom layer by undo
+
+
+@ui_entry
+def move_layer(steps):
+
+    scene.move_layer(active_layer, steps)
+
+
+@ui_entry
+def toggle_layer(setting):
+    """Flips the active layer's "visible" or "locked" setting."""
+    if controller.drawing or temp_shape_id is not None or moving:
+        return
+    select_items(())
+    layer = scene.layer(active_layer)
+    scene.update_layer(active_layer, **{setting: not getattr(layer, setting)})
+
+
+@ui_entry
+def rename_layer(event=None):
+
+    layer = scene.layer(active_layer)
+    name = simpledialog.askstring("Layer Name", "Name:", parent=root, initialvalue=layer.name)
+    if name:
+        scene.update_layer(active_layer, name=name)
+
+
+def toggle_layer_cache():
+
+    renderer.set_cache_layers(cache_layers_var.get())
+
+
+def layer_list_clicked(event=None):
 
-tool_buttons["eraser"] = tk.Button(controls_frame, text="Eraser", width=btn_width, command=lambda: activate_mode("eraser"))
-tool_buttons["eraser"].pack(side=tk.LEFT, padx=2, pady=2)
+    chosen = layer_list.curselection()
+    if chosen:
+        # the list shows the top layer first
+        select_layer(scene.layers[len(scene.layers) - 1 - chosen[0]].id)
 
-tool_buttons["square"] = tk.Button(controls_frame, text="Square", width=btn_width, command=lambda: activate_mode("square"))
-tool_buttons["square"].pack(side=tk.LEFT, padx=2, pady=2)
 
-tool_buttons["circle"] = tk.Button(controls_frame, text="Circle", width=btn_width, command=lambda: activate_mode("circle"))
-tool_buttons["circle"].pack(side=tk.LEFT, padx=2, pady=2)
+def layers_changed(op, item_id, record):
 
-tool_buttons["text"] = tk.Button(controls_frame, text="Text", width=btn_width, command=lambda: activate_mode("text"))
-tool_buttons["text"].pack(side=tk.LEFT, padx=2, pady=2)
+    global active_layer
+    if op != "layers":
+        return
+    if active_layer not in scene.depth:
+        active_layer = scene.layers[-1].id
+        renderer.set_active_layer(active_layer)
+    refresh_layer_list()
 
 
-try: r, g, b = root.winfo_rgb(current_color); initial_fg = 'white' if (r + g + b) / 3 / 65535 < 0.5 else 'black'
-except: initial_fg = 'black'
-tool_buttons['color'] = tk.Button(controls_frame, text="Color", width=btn_width, command=choose_color,
-                                  bg=current_color, fg=initial_fg,
-                                  activebackground=current_color, activeforeground=initial_fg)
+def refresh_layer_list():
+
+    layer_list.delete(0, tk.END)
+    for layer in reversed(scene.layers):
+        flags = ("  " if layer.visible else "H ") + ("L " if layer.locked else "  ")
+        layer_list.insert(tk.END, flags + layer.name)
+    position = len(scene.layers) - 1 - scene.depth[active_layer]
+    layer_list.selection_set(position)
+    layer_list.see(position)
+
+
+@ui_entry
+def save_drawing(event=None):
+
+    path = filedialog.asksaveasfilename(parent=root, defaultextension=".hpaint",
+                                        filetypes=FILE_TYPES)
+    if not path: return
+    try:
+        storage.save(path, scene, canvas_bg_color, scene.layers, scene.images)
+    except OSError as e:
+        messagebox.showerror("Save", f"Could not save the drawing:\n{e}", parent=root)
+
+
+@ui_entry
+def open_drawing(event=None):
+    
+    global canvas_bg_color, loading
+    path = filedialog.askopenfilename(parent=root, filetypes=FILE_TYPES)
+    if not path: return
+    try:
+        drawing = storage.Drawing(path)
+    except (OSError, storage.FormatError) as e:
+        messagebox.showerror("Open", f"Could not open the drawing:\n{e}", parent=root)
+        return
+    stop_restore()
+    if loading:
+        loading[0].close()  # its pending load_chunk goes on with this drawing
+    select_items(())
+    scene.clear()
+    scene.set_layers(drawing.layers)
+    for data in drawing.images.values():
+        scene.add_image(data)
+    canvas_bg_color = drawing.background
+    if autosave:
+        autosave.background = canvas_bg_color
+    canvas.config(bg=canvas_bg_color)
+    # stream the items in over several event-loop turns so the window stays responsive
+    loading = drawing, iter(drawing)
+    root.after(0, load_chunk)
+
+
+@ui_entry
+def load_chunk():
+    """Adds the next LOAD_CHUNK items of the drawing being opened (recorded, so replays load alike)."""
+    global loading
+    if loading is None:
+        return
+    drawing, records = loading
+    added = 0
+    try:
+        for record in itertools.islice(records, LOAD_CHUNK):
+            scene.add(record)
+            added += 1
+    except storage.FormatError as e:
+        messagebox.showerror("Open", f"Only part of the drawing could be read:\n{e}", parent=root)
+        added = 0
+    if added == LOAD_CHUNK:
+        root.after(1, load_chunk)
+    else:
+        drawing.close()
+        loading = None
+        history.reset()
+
+
+def check_color(color):
+    """Raises ValueError for a color Tk does not know."""
+    try:
+        root.winfo_rgb(color)
+    except tk.TclError:
+        raise ValueError(f"unknown color {color!r}") from None
+
+
+@ui_entry
+def import_labels(event=None):
+    """Places every label of a label file (see labels.py) on the active layer in one go."""
+    path = filedialog.askopenfilename(parent=root, filetypes=LABEL_TYPES)
+    if not path: return
+    if not scene.editable(active_layer):
+        root.bell()
+        return
+    try:
+        records = labels.read_labels(path, current_font_size, current_color, TEXT_FAMILY, active_layer,
+                                     check_color)
+    except (OSError, ValueError) as e:
+        messagebox.showerror("Labels", f"Could not read the labels:\n{e}", parent=root)
+        return
+    for record in records:
+        scene.add(record)
+    history.checkpoint()
+    print(f"Placed {len(records)} labels")
+
+
+@ui_entry
+def import_image(event=None):
+    """Reads an image file and makes it the stamp of the Stamp tool."""
+    global stamp_key
+    path = filedialog.askopenfilename(parent=root, filetypes=IMAGE_TYPES)
+    if not path: return
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        # decoded once, here; stamps and zoom levels then only scale the cached copy
+        stamp_key, (width, height) = pictures.load(data)
+    except (OSError, ValueError) as e:
+        messagebox.showerror("Image", f"Could not read the image:\n{e}", parent=root)
+        return
+    scene.add_image(data)
+    print(f"Stamp: {os.path.basename(path)} ({width}x{height})")
+    activate_mode("stamp")
+
+
+@ui_entry
+def export_drawing(event=None):
+    """Renders the scene to PNG/SVG in a worker process (see export.py)."""
+    path = filedialog.asksaveasfilename(parent=root, defaultextension=".png",
+                                        filetypes=EXPORT_TYPES)
+    if not path: return
+    fd, source = tempfile.mkstemp(suffix=".hpaint")
+    os.close(fd)
+    try:
+        storage.save(source, scene, canvas_bg_color, scene.layers, scene.images)
+    except OSError as e:
+        os.remove(source)
+        messagebox.showerror("Export", f"Could not export the drawing:\n{e}", parent=root)
+        return
+    worker = subprocess.Popen([sys.executable, EXPORT_SCRIPT, source, path, "--progress",
+                               "--min-size", str(canvas.winfo_width()), str(canvas.winfo_height())],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    lines = queue.Queue()
+
+    def read_output():
+        for line in worker.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    threading.Thread(target=read_output, daemon=True).start()
+    root.after(100, poll_export, worker, lines, source)
+
+
+def poll_export(worker, lines, source):
+
+    finished = False
+    while not lines.empty():
+        line = lines.get()
+        if line is None:
+            finished = True
+        elif line.startswith("progress"):
+            _, done, total = line.split()
+            root.title(f"{APP_TITLE} - exporting {100 * int(done) // max(int(total), 1)}%")
+    if not finished:
+        root.after(100, poll_export, worker, lines, source)
+        return
+    worker.wait()
+    os.remove(source)
+    root.title(APP_TITLE)
+    if worker.returncode:
+        messagebox.showerror("Export", f"Export failed:\n{worker.stderr.read()}", parent=root)
+
+
+def join_session(address):
+    """Joins the drawing session of the server at "host:port" and shares this drawing with it."""
+    global session_client, session_board
+    host, sep, port = address.rpartition(":")
+    if not sep:
+        host, port = address, session.PORT
+    client = session.Client(host, int(port))
+    try:
+        client.start()
+    except OSError as e:
+        print(f"Could not join the session at {address}: {e}")
+        return
+    session_client = client
+    session_board = session.Board(scene, client.send)
+    session_board.publish()
+    root.after(SESSION_POLL_MS, merge_session)
+    print(f"Joined the drawing session at {address}")
+
+
+def merge_session():
+    """Merges what the others drew, a time slice per turn so drawing never waits for it."""
+    global session_client, session_board
+    with history.untracked():
+        alive = session_board.merge(session_client.incoming, SESSION_BUDGET)
+    if not selection <= scene.items.keys():
+        select_items(selection & scene.items.keys())
+    if alive:
+        root.after(SESSION_POLL_MS, merge_session)
+    else:
+        print("The drawing session ended")
+        session_board.detach()
+        session_client = session_board = None
+
+
+def read_settings():
+    try:
+        with open(SETTINGS_PATH, encoding="utf-8") as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return settings if isinstance(settings, dict) else {}
+
+
+def save_settings():
+    settings = {"tool": current_mode, "color": current_color, "width": current_width,
+                "font_size": current_font_size}
+    try:
+        os.makedirs(os.path.dirname(SETTINGS_PATH), exist_ok=True)
+        with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
+            json.dump(settings, f)
+    except OSError as e:
+        print(f"Could not save the settings: {e}")
+
+
+def apply_settings(settings):
+    """Takes over the tool, color, width and font size of saved settings, quietly."""
+    global current_mode, current_color, current_width, current_font_size
+    if settings.get("tool") in TOOLS:
+        current_mode = settings["tool"]
+    width, size = settings.get("width"), settings.get("font_size")
+    if isinstance(width, int) and 1 <= width <= 100:
+        current_width = width
+    if isinstance(size, int) and 6 <= size <= 120:
+        current_font_size = size
+    if isinstance(settings.get("color"), str):
+        try:
+            root.winfo_rgb(settings["color"])
+            current_color = settings["color"]
+        except tk.TclError:
+            pass
+    canvas.config(cursor=TOOLS[current_mode][1])
+    start_fill_warming()
+    update_button_states()
+    show_color()
+
+
+def first_frame():
+    """Runs once the window is on screen: from here on, the last session comes back."""
+    global restore_job
+    startup.mark("first_frame")
+    # raster brings in NumPy (when installed), the slowest import of all, needed from the first stroke on
+    threading.Thread(target=importlib.import_module, args=("raster",), name="preload", daemon=True).start()
+    results = queue.Queue()
+    threading.Thread(target=lambda: results.put(journal.read_autosave()), name="restore", daemon=True).start()
+    restore_job = root.after(RESTORE_POLL_MS, restore_session, results)
+
+
+def restore_session(results):
+
+    global restore_job, canvas_bg_color
+    try:
+        state = results.get_nowait()
+    except queue.Empty:
+        restore_job = root.after(RESTORE_POLL_MS, restore_session, results)
+        return
+    if state is None:
+        finish_restore()
+        return
+    background, layers, items, images = state
+    for data in images.values():
+        scene.add_image(data)
+    if layers is not None:
+        # layers holding what was drawn in the meantime stay, on top
+        known = {layer.id for layer in layers}
+        scene.set_layers(list(layers) + [layer for layer in scene.layers
+                                         if layer.id not in known and scene.layer_items(layer.id)])
+    canvas_bg_color = background
+    canvas.config(bg=canvas_bg_color)
+    restore_job = root.after(0, restore_chunk, iter(items.values()))
+
+
+def restore_chunk(records):
+
+    global restore_job
+    added = 0
+    # new ids, so whatever was drawn in the meantime keeps its own; not undoable
+    with history.untracked():
+        for record in itertools.islice(records, LOAD_CHUNK):
+            scene.add(record)
+            added += 1
+    if added == LOAD_CHUNK:
+        restore_job = root.after(1, restore_chunk, records)
+    else:
+        finish_restore()
+
+
+def stop_restore():
+    """Gives up restoring the last session, e.g. because another drawing is opened."""
+    if restore_job is not None:
+        root.after_cancel(restore_job)
+        finish_restore()
+
+
+def finish_restore():
+    """Starts journaling the drawing, and joins the shared session if there is one."""
+    global restore_job, autosave
+    restore_job = None
+    startup.mark("restored")
+    if monitor.enabled:
+        print(startup.summary())
+    autosave = journal.Journal(scene, background=canvas_bg_color)
+    autosave.start()
+    if scene.items:
+        # the restored items got new ids: the journal starts over from a snapshot
+        autosave.compact()
+    if recorder is not None:
+        # the trace starts from the restored drawing, which goes into its header
+        recorder.start()
+    # HUMMING_PAINT_SESSION=host:port draws together with everyone else on that server
+    if os.environ.get("HUMMING_PAINT_SESSION"):
+        join_session(os.environ["HUMMING_PAINT_SESSION"])
+
+
+def quit_app():
+
+    save_settings()
+    try:
+        if session_client:
+            session_client.close()
+    finally:
+        # whatever happened to the session, flush the autosave and close the window
+        if autosave:
+            autosave.close()
+        if monitor.enabled:
+            monitor.dump()
+        root.destroy()
+
+
+@ui_entry
+def undo(event=None):
+
+    if not controller.drawing and temp_shape_id is None and not moving:
+        select_items(())
+        history.undo()
+
+
+@ui_entry
+def redo(event=None):
+
+    if not controller.drawing and temp_shape_id is None and not moving:
+        select_items(())
+        history.redo()
+
+
+@ui_entry
+def pan_view(dx, dy):
+    """Moves the drawing by (dx, dy) pixels."""
+    if not controller.drawing and temp_shape_id is None:
+        renderer.pan(dx, dy)
+
+
+@ui_entry
+def zoom_view(factor, x, y):
+    """Zooms by factor around window position (x, y)."""
+    if not controller.drawing and temp_shape_id is None:
+        renderer.zoom_at(factor, x, y)
+
+
+def start_pan(event):
+
+    global pan_x, pan_y
+    pan_x, pan_y = event.x, event.y
+
+
+def drag_pan(event):
+
+    global pan_x, pan_y
+    pan_view(event.x - pan_x, event.y - pan_y)
+    pan_x, pan_y = event.x, event.y
+
+
+def wheel(event):
+    """Wheel scrolls, Shift+wheel scrolls sideways, Ctrl+wheel zooms at the pointer."""
+    up = event.num == 4 or event.delta > 0
+    if event.state & 0x4:
+        zoom_view(ZOOM_STEP if up else 1 / ZOOM_STEP, event.x, event.y)
+    elif event.state & 0x1:
+        pan_view(SCROLL_STEP if up else -SCROLL_STEP, 0)
+    else:
+        pan_view(0, SCROLL_STEP if up else -SCROLL_STEP)
+
+
+def zoom_center(factor):
+
+    zoom_view(factor, canvas.winfo_width() / 2, canvas.winfo_height() / 2)
+
+
+root = tk.Tk()
+root.title(APP_TITLE)
+# shared Font objects; text is indexed by its real extent from here on
+fonts = FontCache(root)
+set_text_extent(fonts.extent)
+pictures = PictureCache(root, scene.images)
+
+controls_frame = tk.Frame(root, bd=2, relief=tk.RAISED)
+controls_frame.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+
+btn_width = 6
+for mode, (label, cursor) in TOOLS.items():
+    tool_buttons[mode] = tk.Button(controls_frame, text=label, width=btn_width,
+                                   command=lambda mode=mode: activate_mode(mode))
+    tool_buttons[mode].pack(side=tk.LEFT, padx=(5, 2) if mode == "pencil" else 2, pady=2)
+
+tool_buttons['color'] = tk.Button(controls_frame, text="Color", width=btn_width, command=choose_color)
 tool_buttons['color'].pack(side=tk.LEFT, padx=(4, 2), pady=2)
 
 width_label = tk.Label(controls_frame, text=" Width:")
 width_label.pack(side=tk.LEFT, padx=(5,0), pady=2)
 width_btn_frame = tk.Frame(controls_frame)
 width_btn_frame.pack(side=tk.LEFT, padx=(0,5))
-tk.Button(width_btn_frame, text="1", width=2, command=lambda: set_width(1)).pack(side=tk.LEFT)
-tk.Button(width_btn_frame, text="3", width=2, command=lambda: set_width(3)).pack(side=tk.LEFT)
-tk.Button(width_btn_frame, text="5", width=2, command=lambda: set_width(5)).pack(side=tk.LEFT)
-tk.Button(width_btn_frame, text="10", width=2, command=lambda: set_width(10)).pack(side=tk.LEFT)
+for width in WIDTHS:
+    tk.Button(width_btn_frame, text=str(width), width=2, command=lambda width=width: set_width(width)).pack(side=tk.LEFT)
 tk.Button(width_btn_frame, text="...", width=2, command=lambda: set_width('custom')).pack(side=tk.LEFT) # Custom button smaller
 
 font_size_button = tk.Button(controls_frame, text="Font Size", width=7, command=set_font_size)
@@ -207,13 +973,82 @@ font_size_button.pack(side=tk.LEFT, padx=2, pady=2)
 clear_button = tk.Button(controls_frame, text="Clear All", width=8, command=clear_canvas)
 clear_button.pack(side=tk.RIGHT, padx=5, pady=2)
 
+for label, command in (("Redo", redo), ("Undo", undo), ("Save", save_drawing), ("Export", export_drawing),
+                       ("Open", open_drawing), ("Labels", import_labels), ("Image", import_image)):
+    tk.Button(controls_frame, text=label, width=btn_width, command=command).pack(side=tk.RIGHT, padx=2, pady=2)
+
+layers_frame = tk.Frame(root, bd=2, relief=tk.RAISED)
+layers_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(0, 5), pady=(0, 5))
+tk.Label(layers_frame, text="Layers").pack(side=tk.TOP)
+layer_list = tk.Listbox(layers_frame, width=16, height=10, exportselection=False, activestyle=tk.NONE)
+layer_list.pack(side=tk.TOP, fill=tk.Y, expand=True, padx=2)
+layer_list.bind("<<ListboxSelect>>", layer_list_clicked)
+layer_list.bind("<Double-Button-1>", rename_layer)
+layer_buttons = tk.Frame(layers_frame)
+layer_buttons.pack(side=tk.TOP, pady=2)
+tk.Button(layer_buttons, text="New", width=5, command=new_layer).grid(row=0, column=0)
+tk.Button(layer_buttons, text="Delete", width=5, command=delete_layer).grid(row=0, column=1)
+tk.Button(layer_buttons, text="Up", width=5, command=lambda: move_layer(1)).grid(row=1, column=0)
+tk.Button(layer_buttons, text="Down", width=5, command=lambda: move_layer(-1)).grid(row=1, column=1)
+tk.Button(layer_buttons, text="Hide", width=5, command=lambda: toggle_layer("visible")).grid(row=2, column=0)
+tk.Button(layer_buttons, text="Lock", width=5, command=lambda: toggle_layer("locked")).grid(row=2, column=1)
+cache_layers_var = tk.BooleanVar(value=CACHE_INACTIVE_LAYERS)
+tk.Checkbutton(layers_frame, text="Cache", variable=cache_layers_var,
+               command=toggle_layer_cache).pack(side=tk.TOP)
+
 canvas = tk.Canvas(root, bg=canvas_bg_color)
 canvas.pack(fill=tk.BOTH, expand=True)
+renderer = CanvasRenderer(canvas, scene, bake=BAKE_OLD_ITEMS, cache_layers=CACHE_INACTIVE_LAYERS,
+                          fonts=fonts, pictures=pictures)
+renderer.set_active_layer(active_layer)
+scene.listeners.append(layers_changed)
+refresh_layer_list()
 
 canvas.bind("<Button-1>", start_draw)
 canvas.bind("<B1-Motion>", draw)
 canvas.bind("<ButtonRelease-1>", stop_draw)
+root.bind("<Control-z>", undo)
+root.bind("<Control-y>", redo)
+root.bind("<Control-Shift-Z>", redo)
+root.bind("<Control-s>", save_drawing)
+root.bind("<Control-o>", open_drawing)
+root.bind("<Control-e>", export_drawing)
+root.bind("<Delete>", delete_selection)
+root.bind("<BackSpace>", delete_selection)
+root.bind("<Escape>", lambda event: select_items(()))
+canvas.bind("<Button-2>", start_pan)
+canvas.bind("<B2-Motion>", drag_pan)
+canvas.bind("<MouseWheel>", wheel)
+canvas.bind("<Button-4>", wheel)
+canvas.bind("<Button-5>", wheel)
+root.bind("<Control-equal>", lambda event: zoom_center(ZOOM_STEP))
+root.bind("<Control-plus>", lambda event: zoom_center(ZOOM_STEP))
+root.bind("<Control-minus>", lambda event: zoom_center(1 / ZOOM_STEP))
+root.bind("<Control-0>", lambda event: zoom_center(1 / renderer.zoom))
+
+# timing of the hot paths, see perf.py
+monitor = perf.Monitor(sys.modules[__name__],
+                       os.path.join(journal.default_directory(), "perf.json"))
+root.bind("<F12>", monitor.toggle)
+root.bind("<Shift-F12>", monitor.dump)
+
+# the starting tool, width and color, set without the messages of activate_mode and set_width
+apply_settings({})
+startup.mark("window")
 
-set_width(1)
-activate_mode("pencil")
-root.mainloop()
+if __name__ == "__main__":
+    root.protocol("WM_DELETE_WINDOW", quit_app)
+    if os.environ.get("HUMMING_PAINT_PERF"):
+        if os.environ["HUMMING_PAINT_PERF"] != "1":
+            monitor.dump_path = os.environ["HUMMING_PAINT_PERF"]
+        monitor.enable()
+    # HUMMING_PAINT_RECORD=session.trace records this session for replay.py
+    if os.environ.get("HUMMING_PAINT_RECORD"):
+        import replay
+        recorder = replay.Recorder(sys.modules[__name__], os.environ["HUMMING_PAINT_RECORD"])
+    else:
+        # the last tool and colors, before any input can start a stroke with the defaults
+        apply_settings(read_settings())
+    # bring back the last session once the window is up, then journal every change
+    root.after_idle(first_frame)
+    root.mainloop()
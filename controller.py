@@ -0,0 +1,104 @@
+"""What the drawing tools do to the scene, without Tk.
+
+code.py's handlers turn events into world points, draw the rubber-band
+previews and ask for text; the pencil, eraser, shape and text tools then
+change the scene through a Controller, so bench.py can drive the very same
+pipeline on a bare Scene.
+
+Pencil and eraser input: motion points closer than POINT_SPACING (screen
+pixels) to the last kept one are dropped, the rest are queued and handed to
+the scene by flush() (code.py does it once a frame), and a finished pencil
+stroke is simplified with SIMPLIFY_TOLERANCE (screen pixels) before it is
+committed.
+"""
+import math
+
+from scene import Shape, Stroke, Text
+
+POINT_SPACING = {"pencil": 1.5, "eraser": 2}
+SIMPLIFY_TOLERANCE = {"pencil": 0.75}
+
+# Drag-to-size shape tools and the record kind each one makes.
+SHAPE_TOOLS = {"square": "rectangle", "circle": "oval"}
+
+
+class Controller:
+
+    def __init__(self, scene):
+        self.scene = scene
+        self.mode = None  # "pencil" or "eraser" while a stroke is drawn
+        self.width = 1
+        self.layer = 0
+        self.zoom = 1
+        self.stroke_id = None  # scene id of the pencil stroke being drawn
+        self.prev = None  # last kept motion point
+        self.flushed = None  # last point already handed to the scene
+        self.pending = []  # queued motion points, x, y, x, y...
+
+    @property
+    def drawing(self):
+        """True from the press of a pencil or eraser until its release."""
+        return self.prev is not None
+
+    def eraser_radius(self):
+        return max(self.width / 2, 2 / self.zoom)
+
+    def erase_segment(self, x0, y0, x1, y1):
+        """Removes everything of the layer under the eraser dragged from (x0, y0) to (x1, y1)."""
+        self.scene.erase(x0, y0, x1, y1, self.eraser_radius(), layer=self.layer)
+
+    def start_stroke(self, mode, x, y, color, width, layer=0, zoom=1):
+        """Starts a pencil stroke or an eraser drag at world point (x, y)."""
+        self.mode, self.width, self.layer, self.zoom = mode, width, layer, zoom
+        self.prev = self.flushed = (x, y)
+        if mode == "eraser":
+            self.erase_segment(x, y, x, y)
+        else:
+            self.stroke_id = self.scene.add(Stroke((x, y), color, width, layer), live=True)
+
+    def move(self, x, y):
+        """Queues a motion point of the stroke; False when it is dropped."""
+        if self.prev is None:
+            return False
+        # spacing is in screen pixels, whatever the zoom
+        if math.hypot(x - self.prev[0], y - self.prev[1]) * self.zoom < POINT_SPACING[self.mode]:
+            return False
+        self.pending.extend((x, y))
+        self.prev = (x, y)
+        return True
+
+    def flush(self):
+        """Hands the queued motion points to the scene."""
+        pending = self.pending
+        if not pending:
+            return
+        if self.mode == "eraser":
+            x, y = self.flushed
+            for i in range(0, len(pending), 2):
+                self.erase_segment(x, y, pending[i], pending[i + 1])
+                x, y = pending[i], pending[i + 1]
+        elif self.stroke_id is not None:
+            self.scene.extend(self.stroke_id, *pending)
+        self.flushed = (pending[-2], pending[-1])
+        pending.clear()
+
+    def stop_stroke(self):
+        """Flushes, simplifies and commits the stroke; returns its id, None for an eraser drag."""
+        self.flush()
+        stroke_id = self.stroke_id
+        if stroke_id is not None:
+            self.scene.simplify(stroke_id, SIMPLIFY_TOLERANCE.get(self.mode, 0) / self.zoom)
+            self.scene.commit(stroke_id)
+        self.stroke_id = self.prev = self.mode = None
+        return stroke_id
+
+    def add_shape(self, kind, x1, y1, x2, y2, color, width, layer=0):
+        """Adds a shape dragged from (x1, y1) to (x2, y2); a click makes one of the line width."""
+        width = max(1, width)
+        if x1 == x2 and y1 == y2:
+            x2 += width
+            y2 += width
+        return self.scene.add(Shape(kind, (x1, y1, x2, y2), color, width, layer))
+
+    def add_text(self, x, y, text, color, family, size, layer=0):
+        return self.scene.add(Text(x, y, text, color, family, size, layer))
@@ -0,0 +1,273 @@
+"""Exports drawings to PNG or SVG without Tk.
+
+The GUI runs this as a separate worker process on a temporary .hpaint copy of
+the scene, so a big export never blocks drawing:
+
+    python export.py drawing.hpaint picture.svg [--extent X1 Y1 X2 Y2 | --min-size W H]
+                     [--size W H] [--progress]
+
+--size scales the picture to fit W x H pixels, centered. With --progress,
+"progress DONE TOTAL" lines are printed as items are rendered. PNG export
+draws text in a small bitmap font (see bitmapfont.py); SVG keeps it as text.
+Pictures are drawn into PNGs from their decoded images and embedded into
+SVGs as PNG data. batch.py renders many drawings at once with this module.
+"""
+import argparse
+import base64
+import math
+import sys
+from functools import lru_cache
+from xml.sax.saxutils import escape, quoteattr
+
+import imaging
+import storage
+from raster import Raster, parse_color
+from scene import Fill, Picture, Stroke, Shape, Text, scaled
+
+FORMATS = ("png", "svg")
+PROGRESS_STEP = 1000  # items between progress reports
+
+
+def drawing_extent(records, min_size=(1, 1), margin=10):
+    """The area to export: from the canvas origin to beyond the last item."""
+    x1, y1 = 0, 0
+    x2, y2 = min_size
+    for record in records:
+        bx1, by1, bx2, by2 = record.bbox()
+        x1, y1 = min(x1, bx1 - margin), min(y1, by1 - margin)
+        x2, y2 = max(x2, bx2 + margin), max(y2, by2 + margin)
+    return int(x1), int(y1), int(x2 + 1), int(y2 + 1)
+
+
+def fit_extent(extent, size):
+    """The extent grown around its center to the shape of size, and the scale that fits it in."""
+    x1, y1, x2, y2 = extent
+    width, height = size
+    scale = min(width / (x2 - x1), height / (y2 - y1))
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    half_width, half_height = width / scale / 2, height / scale / 2
+    return (cx - half_width, cy - half_height, cx + half_width, cy + half_height), scale
+
+
+def svg_path(points):
+    """SVG path data for a Tk smooth=True polyline (see raster.smooth_points)."""
+    n = len(points) // 2
+    if n == 1:
+        return f"M{points[0]:g} {points[1]:g}l0 0"
+    parts = [f"M{points[0]:g} {points[1]:g}"]
+    if n == 2:
+        parts.append(f"L{points[2]:g} {points[3]:g}")
+    for i in range(n - 2):
+        cx, cy = points[2 * i + 2], points[2 * i + 3]
+        if i == n - 3:
+            ex, ey = points[-2], points[-1]
+        else:
+            ex, ey = (cx + points[2 * i + 4]) / 2, (cy + points[2 * i + 5]) / 2
+        parts.append(f"Q{cx:g} {cy:g} {ex:g} {ey:g}")
+    return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def svg_color(color):
+    """A Tk color in SVG, where some names (gray, green, maroon...) mean other colors."""
+    return "#%02x%02x%02x" % parse_color(color)
+
+
+def svg_fill_path(record):
+    """SVG path data for a Fill: one closed rectangle per span."""
+    cell, half = record.cell, record.cell / 2
+    spans = record.spans
+    parts = []
+    for i in range(0, len(spans), 3):
+        row, first, last = spans[i:i + 3]
+        width = (last - first + 1) * cell
+        parts.append(f"M{record.x + first * cell - half:g} {record.y + row * cell - half:g}"
+                     f"h{width:g}v{cell:g}h{-width:g}z")
+    return "".join(parts)
+
+
+def svg_symbol(key, data):
+    """An SVG symbol of an encoded image as PNG data (browsers do not show the PNM formats)."""
+    image = imaging.decode(data)
+    if not data.startswith(imaging.PNG_SIGNATURE):
+        data = image.png()
+    href = "data:image/png;base64," + base64.b64encode(data).decode("ascii")
+    return (f'<symbol id="image-{key}" viewBox="0 0 {image.width} {image.height}" '
+            f'preserveAspectRatio="none"><image width="{image.width}" height="{image.height}" '
+            f'href="{href}"/></symbol>')
+
+
+def svg_element(record):
+    if isinstance(record, Picture):
+        # the image itself is written once, as a symbol (see write_svg)
+        return (f'<use href="#image-{record.key}" x="{record.x:g}" y="{record.y:g}" '
+                f'width="{record.width:g}" height="{record.height:g}"/>')
+    if isinstance(record, Fill):
+        return f'<path d="{svg_fill_path(record)}" fill="{svg_color(record.color)}" stroke="none"/>'
+    if isinstance(record, Stroke):
+        return (f'<path d="{svg_path(record.points)}" stroke="{svg_color(record.color)}" '
+                f'stroke-width="{record.width:g}"/>')
+    if isinstance(record, Shape):
+        x1, y1, x2, y2 = record.coords
+        style = f'fill="none" stroke="{svg_color(record.color)}" stroke-width="{record.width:g}"'
+        if record.kind == "rectangle":
+            return (f'<rect x="{min(x1, x2):g}" y="{min(y1, y2):g}" width="{abs(x2 - x1):g}" '
+                    f'height="{abs(y2 - y1):g}" {style}/>')
+        return (f'<ellipse cx="{(x1 + x2) / 2:g}" cy="{(y1 + y2) / 2:g}" rx="{abs(x2 - x1) / 2:g}" '
+                f'ry="{abs(y2 - y1) / 2:g}" {style}/>')
+    lines = record.text.split("\n")
+    spans = "".join(f'<tspan x="{record.x:g}" dy="{0 if i == 0 else 1.2}em">{escape(line)}</tspan>'
+                    for i, line in enumerate(lines))
+    return (f'<text x="{record.x:g}" y="{record.y:g}" font-family={quoteattr(record.family)} '
+            f'font-size="{record.size}pt" fill="{svg_color(record.color)}" '
+            f'dominant-baseline="hanging">{spans}</text>')
+
+
+def write_svg(f, records, extent, background, progress=None, size=None, images=None):
+    if size:
+        extent, scale = fit_extent(extent, size)
+    x1, y1, x2, y2 = extent
+    width, height = size or (x2 - x1, y2 - y1)
+    f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'viewBox="{x1:g} {y1:g} {x2 - x1:g} {y2 - y1:g}">\n')
+    f.write(f'<rect x="{x1:g}" y="{y1:g}" width="{x2 - x1:g}" height="{y2 - y1:g}" '
+            f'fill="{svg_color(background)}"/>\n')
+    images = images or {}
+    keys = {record.key for record in records if isinstance(record, Picture) and record.key in images}
+    for key in keys:
+        try:
+            f.write(svg_symbol(key, images[key]))
+            f.write("\n")
+        except ValueError as e:
+            print(f"Leaving out image {key}: {e}", file=sys.stderr)
+    # strokes share their line style through the group
+    f.write('<g fill="none" stroke-linecap="round" stroke-linejoin="round">\n')
+    for done, record in enumerate(records, 1):
+        f.write(svg_element(record))
+        f.write("\n")
+        if progress and done % PROGRESS_STEP == 0:
+            progress(done, len(records))
+    f.write("</g>\n</svg>\n")
+
+
+def render_png(records, extent, background, progress=None, size=None, images=None):
+    scale = 1
+    if size:
+        (x1, y1, x2, y2), scale = fit_extent(extent, size)
+        x1, y1 = math.floor(x1 * scale), math.floor(y1 * scale)
+        x2, y2 = x1 + size[0], y1 + size[1]
+    else:
+        x1, y1, x2, y2 = extent
+    raster = Raster(x2 - x1, y2 - y1, background, origin=(x1, y1))
+    pyramids = {}  # image key -> imaging.Pyramid, or None when it cannot be decoded
+    for start in range(0, len(records), PROGRESS_STEP):
+        batch = records[start:start + PROGRESS_STEP]
+        if scale != 1:
+            batch = [scaled(record, scale) for record in batch]
+        # runs of other items are drawn in one go, pictures and text between them
+        run = []
+        for record in batch:
+            if isinstance(record, Picture):
+                raster.draw_all(run)
+                run = []
+                draw_picture(raster, record, images or {}, pyramids)
+            elif isinstance(record, Text):
+                raster.draw_all(run)
+                run = []
+                raster.draw_text(record)
+            else:
+                run.append(record)
+        raster.draw_all(run)
+        if progress:
+            progress(min(start + PROGRESS_STEP, len(records)), len(records))
+    return raster.png()
+
+
+def draw_picture(raster, record, images, pyramids):
+    """Composites the part of a picture inside the raster (in its pixels) onto it."""
+    if record.key not in pyramids:
+        try:
+            pyramids[record.key] = imaging.Pyramid(imaging.decode(images[record.key]))
+        except (KeyError, ValueError) as e:
+            print(f"Leaving out image {record.key}: {e}", file=sys.stderr)
+            pyramids[record.key] = None
+    pyramid = pyramids[record.key]
+    if pyramid is None:
+        return
+    x, y = round(record.x), round(record.y)
+    width, height = max(1, round(record.width)), max(1, round(record.height))
+    ox, oy = raster.origin
+    crop = (max(0, ox - x), max(0, oy - y),
+            min(width, ox + raster.width - x), min(height, oy + raster.height - y))
+    if crop[0] < crop[2] and crop[1] < crop[3]:
+        image = pyramid.scaled(width, height, crop)
+        image.origin = (x + crop[0], y + crop[1])
+        raster.composite(image)
+
+
+def visible_records(drawing):
+    """The records of the drawing's visible layers, bottom layer first."""
+    depth = {layer.id: position for position, layer in enumerate(drawing.layers) if layer.visible}
+    records = [record for record in drawing if record.layer in depth]
+    records.sort(key=lambda record: depth[record.layer])  # stable: keeps the order within a layer
+    return records
+
+
+def export(in_path, out_path, extent=None, background=None, progress=None, min_size=(1, 1), size=None):
+    """Renders the drawing file in_path to out_path (.png or .svg); returns the number of items drawn.
+
+    size, a (width, height) in pixels, scales the picture to fit it.
+    """
+    fmt = out_path.rsplit(".", 1)[-1].lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format: {out_path}")
+    if size and min(size) < 1:
+        raise ValueError(f"bad output size: {size[0]}x{size[1]}")
+    with storage.Drawing(in_path) as drawing:
+        records = visible_records(drawing)
+        background = background or drawing.background
+        images = {key: bytes(data) for key, data in drawing.images.items()}
+    extent = extent or drawing_extent(records, min_size)
+    if fmt == "svg":
+        with open(out_path, "w", encoding="utf-8") as f:
+            write_svg(f, records, extent, background, progress, size, images)
+    else:
+        data = render_png(records, extent, background, progress, size, images)
+        with open(out_path, "wb") as f:
+            f.write(data)
+    if progress:
+        progress(len(records), len(records))
+    return len(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a Humming Paint drawing to PNG or SVG.")
+    parser.add_argument("drawing")
+    parser.add_argument("output")
+    parser.add_argument("--extent", nargs=4, type=int, metavar=("X1", "Y1", "X2", "Y2"))
+    parser.add_argument("--min-size", nargs=2, type=int, default=(1, 1), metavar=("W", "H"),
+                        help="export at least this much of the canvas when no extent is given")
+    parser.add_argument("--size", nargs=2, type=int, metavar=("W", "H"), help="scale to fit W x H pixels")
+    parser.add_argument("--background")
+    parser.add_argument("--progress", action="store_true", help="print progress lines")
+    args = parser.parse_args(argv)
+    if args.background:
+        try:
+            parse_color(args.background)
+        except ValueError as e:
+            parser.error(f"--background: {e}")
+
+    def report(done, total):
+        print(f"progress {done} {total}", flush=True)
+
+    try:
+        export(args.drawing, args.output, args.extent, args.background,
+               report if args.progress else None, args.min_size, args.size)
+    except (OSError, ValueError) as e:
+        print(f"error {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
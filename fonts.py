@@ -0,0 +1,42 @@
+"""Shared Tk fonts and cached text measurement.
+
+Tk parses a font description every time a (family, size) tuple is passed to
+create_text; a named tkinter.font.Font is parsed once and every text item
+using it shares it. FontCache hands out one Font per (family, size, style)
+and measures text with them, remembering the last EXTENT_CACHE extents so
+placing or re-indexing the same labels does not ask Tk again.
+"""
+from functools import lru_cache
+
+from lazy import LazyModule
+
+tkfont = LazyModule("tkinter.font")  # only needed once there is text
+
+EXTENT_CACHE = 4096  # (text, family, size) extents kept
+
+
+class FontCache:
+
+    def __init__(self, root):
+        self.root = root
+        self.fonts = {}  # (family, size, style) -> tkinter.font.Font
+        self.extent = lru_cache(maxsize=EXTENT_CACHE)(self.measure)
+
+    def get(self, family, size, style=""):
+        """The Font for family at size points; style is any of "bold italic underline overstrike"."""
+        key = (family, size, style)
+        font = self.fonts.get(key)
+        if font is None:
+            words = style.split()
+            font = tkfont.Font(self.root, family=family, size=size,
+                               weight="bold" if "bold" in words else "normal",
+                               slant="italic" if "italic" in words else "roman",
+                               underline="underline" in words, overstrike="overstrike" in words)
+            self.fonts[key] = font
+        return font
+
+    def measure(self, text, family, size, style=""):
+        """The (width, height) in pixels of text drawn in the font; extent() is the cached version."""
+        font = self.get(family, size, style)
+        lines = text.split("\n")
+        return max(font.measure(line) for line in lines), len(lines) * font.metrics("linespace")
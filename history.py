@@ -0,0 +1,131 @@
+"""Undo/redo as a log of scene deltas.
+
+History listens to a scene and records what each finished operation did:
+which items it added and which records it removed (a clear is a removal of
+everything), with their place in the stacking order, so undo and redo put
+every item back where it was rather than on top. Records are shared with
+the scene rather than copied, so an entry costs about as much as the items
+it touched, and undoing it replays only those deltas.
+
+Handlers call checkpoint() when an operation ends; everything recorded since
+the previous checkpoint becomes one undo step. Changes made inside
+untracked() (other people's, in a shared session) are not recorded, and
+undo skips items they have already removed or put back.
+"""
+from collections import deque
+from contextlib import contextmanager
+
+from scene import Fill, Stroke, Text
+
+# rough per-record overhead of a delta on top of its coordinates/text
+RECORD_OVERHEAD = 120
+
+
+def record_size(record):
+    if isinstance(record, Stroke):
+        return RECORD_OVERHEAD + 4 * len(record.points)
+    if isinstance(record, Fill):
+        return RECORD_OVERHEAD + 4 * len(record.spans)
+    if isinstance(record, Text):
+        return RECORD_OVERHEAD + len(record.text)
+    return RECORD_OVERHEAD + 16
+
+
+class History:
+
+    def __init__(self, scene, max_bytes=16 * 1024 * 1024):
+        self.scene = scene
+        self.max_bytes = max_bytes
+        self.undo_stack = deque()  # entries: (deltas, size)
+        self.redo_stack = []
+        self.pending = []
+        self.pending_size = 0
+        self.size = 0  # bytes held by undo_stack
+        self.replaying = False
+        scene.listeners.append(self.record)
+
+    def record(self, op, item_id, record):
+        if self.replaying:
+            return
+        order = self.scene.order
+        if op == "commit":
+            self.pending.append(("add", item_id, record, order[item_id]))
+            self.pending_size += record_size(record)
+        elif op == "remove":
+            self.pending.append(("remove", item_id, record, order[item_id]))
+            self.pending_size += record_size(record)
+        elif op == "clear" and record:
+            self.pending.append(("clear", None, record, {old_id: order[old_id] for old_id in record}))
+            self.pending_size += sum(map(record_size, record.values()))
+
+    def checkpoint(self):
+        """Closes the current operation as one undo step."""
+        if not self.pending:
+            return
+        self.undo_stack.append((self.pending, self.pending_size))
+        self.size += self.pending_size
+        self.pending, self.pending_size = [], 0
+        self.redo_stack.clear()
+        # forget the oldest steps once over the memory cap, but always keep the newest
+        while self.size > self.max_bytes and len(self.undo_stack) > 1:
+            self.size -= self.undo_stack.popleft()[1]
+
+    def reset(self):
+        """Forgets all history, e.g. after a new drawing was opened."""
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.pending, self.pending_size = [], 0
+        self.size = 0
+
+    @contextmanager
+    def untracked(self):
+        """Changes made in the with block are not undoable."""
+        self.replaying = True
+        try:
+            yield
+        finally:
+            self.replaying = False
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self):
+        self.checkpoint()
+        if not self.undo_stack:
+            return False
+        deltas, size = self.undo_stack.pop()
+        self.size -= size
+        self.replay(deltas, reverse=True)
+        self.redo_stack.append((deltas, size))
+        return True
+
+    def redo(self):
+        if not self.redo_stack:
+            return False
+        deltas, size = self.redo_stack.pop()
+        self.replay(deltas, reverse=False)
+        self.undo_stack.append((deltas, size))
+        self.size += size
+        return True
+
+    def replay(self, deltas, reverse):
+        scene = self.scene
+        self.replaying = True
+        try:
+            for op, item_id, record, order in (reversed(deltas) if reverse else deltas):
+                if op == "clear":
+                    if reverse:
+                        for old_id, old_record in record.items():
+                            scene.insert(old_id, old_record, order[old_id])
+                    else:
+                        scene.clear()
+                elif (op == "add") == reverse:
+                    if item_id in scene.items:
+                        scene.remove(item_id)
+                elif item_id not in scene.items:
+                    scene.insert(item_id, record, order)
+        finally:
+            self.replaying = False
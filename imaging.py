@@ -0,0 +1,376 @@
+"""Decodes imported images and scales them, without Tk.
+
+decode() reads PNG (any color type at 1-16 bits, not interlaced) and binary
+PPM/PGM into a transparent raster.Raster, so the picture is decoded once and
+then only sampled. A Pyramid keeps that image and, with NumPy, half-size
+copies of it down to a single pixel (each one averaged from the one above,
+weighted by alpha); scaled() samples the smallest level that is still at
+least as big as the size asked for, so shrinking a big image is cheap and
+does not alias. Without NumPy there is only the full-size level.
+
+PNG rows are unfiltered with NumPy along the image's anti-diagonals: the
+pixel left of, above and above-left of every pixel on a diagonal are on the
+two diagonals before it, so each filter type is one vectorized step per
+diagonal instead of a Python loop per byte.
+"""
+import struct
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from raster import Raster
+
+MAX_PIXELS = 64 * 1024 * 1024  # bigger images are refused rather than decoded
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}  # by color type
+PNG_DEPTHS = {0: (1, 2, 4, 8, 16), 2: (8, 16), 3: (1, 2, 4, 8), 4: (8, 16), 6: (8, 16)}
+CHUNK = struct.Struct(">I4s")
+IHDR = struct.Struct(">IIBBBBB")
+
+
+def decode(data):
+    """The image in data (PNG, PPM or PGM) as an RGBA Raster; ValueError if it cannot be read."""
+    data = bytes(data)
+    if data.startswith(PNG_SIGNATURE):
+        return decode_png(data)
+    if data[:2] in (b"P5", b"P6"):
+        return decode_pnm(data)
+    raise ValueError("unsupported image format (PNG, PPM and PGM can be imported)")
+
+
+def image_size(width, height):
+    if width < 1 or height < 1:
+        raise ValueError("empty image")
+    if width * height > MAX_PIXELS:
+        raise ValueError(f"image too large ({width}x{height})")
+
+
+def decode_png(data):
+    offset = len(PNG_SIGNATURE)
+    header = palette = transparency = None
+    compressed = []
+    while offset + CHUNK.size <= len(data):
+        length, kind = CHUNK.unpack_from(data, offset)
+        body = data[offset + CHUNK.size:offset + CHUNK.size + length]
+        offset += CHUNK.size + length + 4  # and the CRC
+        if len(body) < length:
+            break
+        if kind == b"IHDR":
+            header = IHDR.unpack(body[:IHDR.size])
+        elif kind == b"PLTE":
+            palette = body
+        elif kind == b"tRNS":
+            transparency = body
+        elif kind == b"IDAT":
+            compressed.append(body)
+        elif kind == b"IEND":
+            break
+    if header is None or not compressed:
+        raise ValueError("truncated PNG")
+    width, height, depth, color_type, _, _, interlace = header
+    image_size(width, height)
+    if color_type not in PNG_CHANNELS or depth not in PNG_DEPTHS[color_type]:
+        raise ValueError(f"unsupported PNG (color type {color_type}, {depth} bits)")
+    if interlace:
+        raise ValueError("interlaced PNGs are not supported")
+    if color_type == 3 and palette is None:
+        raise ValueError("PNG palette missing")
+    channels = PNG_CHANNELS[color_type]
+    bits = channels * depth
+    stride = (width * bits + 7) // 8
+    try:
+        raw = zlib.decompress(b"".join(compressed))
+    except zlib.error as e:
+        raise ValueError(f"corrupt PNG: {e}") from None
+    if len(raw) < height * (stride + 1):
+        raise ValueError("truncated PNG")
+    unit = max(1, bits // 8)  # bytes per pixel, as the filters see them
+    if np is None:
+        return png_raster_slow(unfilter_slow(raw, height, stride, unit), width, height, depth,
+                               color_type, palette, transparency)
+    rows = unfilter(np.frombuffer(raw, np.uint8, height * (stride + 1)).reshape(height, stride + 1),
+                    unit)
+    if depth == 16:
+        samples = rows[:, 0::2][:, :width * channels]
+    elif depth < 8:
+        shifts = np.arange(8 - depth, -1, -depth, dtype=np.uint8)
+        samples = ((rows[:, :, None] >> shifts) & (1 << depth) - 1).reshape(height, -1)[:, :width]
+    else:
+        samples = rows
+    samples = samples.reshape(height, width, channels)
+    image = Raster(width, height, None)
+    pixels = image.pixels
+    if color_type == 3:
+        pixels[:] = palette_table(palette, transparency)[samples[..., 0]]
+        return image
+    if color_type in (0, 4):
+        gray = samples[..., 0]
+        if depth < 8:
+            gray = gray * (255 // ((1 << depth) - 1))
+        pixels[..., :3] = gray[..., None]
+    else:
+        pixels[..., :3] = samples[..., :3]
+    if color_type in (4, 6):
+        pixels[..., 3] = samples[..., -1]
+    else:
+        pixels[..., 3] = 255
+        key = color_key(transparency, color_type, depth)
+        if key is not None:
+            if depth == 16:  # the key is compared with the full 16-bit samples
+                samples = rows.view(">u2").reshape(height, width, channels)
+            pixels[(samples == key).all(axis=2), 3] = 0
+    return image
+
+
+def color_key(transparency, color_type, depth):
+    """The sample values of a tRNS color key (gray or RGB), or None."""
+    if transparency is None:
+        return None
+    count = 1 if color_type == 0 else 3
+    if len(transparency) < 2 * count:
+        return None
+    return list(struct.unpack(f">{count}H", transparency[:2 * count]))
+
+
+def palette_table(palette, transparency):
+    """A (256, 4) RGBA lookup table from PLTE and tRNS."""
+    table = np.zeros((256, 4), np.uint8)
+    table[:, 3] = 255
+    colors = np.frombuffer(palette[:len(palette) // 3 * 3], np.uint8).reshape(-1, 3)[:256]
+    table[:len(colors), :3] = colors
+    if transparency:
+        alpha = np.frombuffer(transparency[:256], np.uint8)
+        table[:len(alpha), 3] = alpha
+    return table
+
+
+def unfilter(rows, unit):
+    """Undoes the PNG row filters of (height, 1 + stride) filtered rows; returns (height, stride)."""
+    height = rows.shape[0]
+    kinds = rows[:, 0]
+    if kinds.max(initial=0) > 4:
+        raise ValueError("corrupt PNG: bad filter type")
+    data = rows[:, 1:]
+    stride = data.shape[1]
+    columns = stride // unit
+    if not (kinds >= 3).any():
+        # None, Sub and Up need no pixel to the left that is still being decoded: row at a time
+        out = np.empty((height, stride), np.uint8)
+        previous = np.zeros(stride, np.uint8)
+        for row in range(height):
+            line = data[row]
+            if kinds[row] == 1:
+                line = np.cumsum(line.reshape(columns, unit), axis=0, dtype=np.uint8).reshape(-1)
+            elif kinds[row] == 2:
+                line = line + previous
+            out[row] = line
+            previous = out[row]
+        return out
+    # one padding row on top and column on the left stand in for the zeros off the image
+    out = np.zeros((height + 1, columns + 1, unit), np.int16)
+    flat = out.reshape(-1, unit)
+    filtered = data.reshape(height, columns, unit)
+    for diagonal in range(height + columns - 1):
+        row = np.arange(max(0, diagonal - columns + 1), min(height, diagonal + 1))
+        column = diagonal - row
+        here = (row + 1) * (columns + 1) + column + 1
+        a, b, c = flat[here - 1], flat[here - columns - 1], flat[here - columns - 2]
+        kind = kinds[row][:, None]
+        p = a + b - c
+        pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+        paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+        predicted = np.select([kind == 1, kind == 2, kind == 3, kind == 4],
+                              [a, b, (a + b) >> 1, paeth], 0)
+        flat[here] = (filtered[row, column] + predicted) & 0xFF
+    return out[1:, 1:].astype(np.uint8).reshape(height, stride)
+
+
+def unfilter_slow(raw, height, stride, unit):
+    """unfilter without NumPy, on the decompressed bytes; returns the rows as one bytearray."""
+    out = bytearray(height * stride)
+    previous = bytearray(stride)
+    for row in range(height):
+        start = row * (stride + 1)
+        kind = raw[start]
+        line = bytearray(raw[start + 1:start + 1 + stride])
+        if kind == 1:
+            for i in range(unit, stride):
+                line[i] = (line[i] + line[i - unit]) & 0xFF
+        elif kind == 2:
+            for i in range(stride):
+                line[i] = (line[i] + previous[i]) & 0xFF
+        elif kind == 3:
+            for i in range(stride):
+                left = line[i - unit] if i >= unit else 0
+                line[i] = (line[i] + ((left + previous[i]) >> 1)) & 0xFF
+        elif kind == 4:
+            for i in range(stride):
+                a = line[i - unit] if i >= unit else 0
+                b = previous[i]
+                c = previous[i - unit] if i >= unit else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                line[i] = (line[i] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 0xFF
+        elif kind:
+            raise ValueError("corrupt PNG: bad filter type")
+        out[row * stride:(row + 1) * stride] = line
+        previous = line
+    return out
+
+
+def png_raster_slow(rows, width, height, depth, color_type, palette, transparency):
+    channels = PNG_CHANNELS[color_type]
+    stride = len(rows) // height
+    key = color_key(transparency, color_type, depth) if color_type in (0, 2) else None
+    alphas = transparency or b""
+    image = Raster(width, height, None)
+    out = image.pixels
+    index = 0
+    for row in range(height):
+        line = rows[row * stride:(row + 1) * stride]
+        for column in range(width):
+            if depth < 8:
+                bit = column * depth
+                value = line[bit // 8] >> (8 - depth - bit % 8) & (1 << depth) - 1
+                samples = [value]
+            elif depth == 16:
+                start = column * channels * 2
+                samples = list(struct.unpack_from(f">{channels}H", line, start))
+            else:
+                samples = list(line[column * channels:(column + 1) * channels])
+            if key is not None and samples == key:
+                pixel = (0, 0, 0, 0)
+            else:
+                if depth == 16:
+                    samples = [value >> 8 for value in samples]
+                if color_type == 3:
+                    value = samples[0]
+                    pixel = (tuple(palette[3 * value:3 * value + 3]) or (0, 0, 0)) + (
+                        alphas[value] if value < len(alphas) else 255,)
+                elif color_type in (0, 4):
+                    gray = samples[0] * (255 // ((1 << depth) - 1)) if depth < 8 else samples[0]
+                    pixel = (gray, gray, gray, samples[1] if color_type == 4 else 255)
+                else:
+                    pixel = tuple(samples[:3]) + ((samples[3],) if color_type == 6 else (255,))
+            out[index:index + 4] = bytes(pixel)
+            index += 4
+    return image
+
+
+def decode_pnm(data):
+    """Binary PGM (P5) or PPM (P6)."""
+    fields = []
+    offset = 2
+    while len(fields) < 3:
+        while offset < len(data) and data[offset:offset + 1].isspace():
+            offset += 1
+        if data[offset:offset + 1] == b"#":
+            offset = data.find(b"\n", offset)
+            if offset < 0:
+                raise ValueError("truncated PPM")
+            continue
+        end = offset
+        while end < len(data) and data[end:end + 1].isdigit():
+            end += 1
+        if end == offset:
+            raise ValueError("corrupt PPM header")
+        fields.append(int(data[offset:end]))
+        offset = end
+    offset += 1  # the single whitespace before the pixels
+    width, height, maxval = fields
+    image_size(width, height)
+    if not 0 < maxval < 65536:
+        raise ValueError("corrupt PPM header")
+    channels = 3 if data[:2] == b"P6" else 1
+    size = 2 if maxval > 255 else 1
+    count = width * height * channels
+    if len(data) < offset + count * size:
+        raise ValueError("truncated PPM")
+    image = Raster(width, height, None)
+    if np is not None:
+        samples = np.frombuffer(data, ">u2" if size == 2 else np.uint8, count, offset)
+        samples = (samples.astype(np.uint32) * 255 // maxval).astype(np.uint8)
+        image.pixels[..., :3] = samples.reshape(height, width, channels)
+        image.pixels[..., 3] = 255
+        return image
+    if size == 2:
+        samples = struct.unpack_from(f">{count}H", data, offset)
+    else:
+        samples = data[offset:offset + count]
+    out = image.pixels
+    for index in range(width * height):
+        pixel = samples[index * channels:(index + 1) * channels]
+        pixel = [value * 255 // maxval for value in pixel]
+        out[4 * index:4 * index + 4] = bytes((pixel * 3)[:3] + [255])
+    return image
+
+
+def half(pixels):
+    """The (height, width, 4) RGBA array at half size, each pixel averaged from 2x2, weighted by alpha."""
+    height, width = max(1, pixels.shape[0] // 2), max(1, pixels.shape[1] // 2)
+    block = pixels[:height * 2, :width * 2].astype(np.uint32)
+    if block.shape[0] == 1:
+        block = np.repeat(block, 2, axis=0)
+    if block.shape[1] == 1:
+        block = np.repeat(block, 2, axis=1)
+    block = block.reshape(height, 2, width, 2, 4)
+    alpha = block[..., 3:]
+    weight = alpha.sum(axis=(1, 3))
+    color = (block[..., :3] * alpha).sum(axis=(1, 3))
+    out = np.empty((height, width, 4), np.uint8)
+    out[..., :3] = (color + weight // 2) // np.maximum(weight, 1)
+    out[..., 3] = (weight[..., 0] + 2) // 4
+    return out
+
+
+class Pyramid:
+    """An image and its half-size copies (made when first needed), to sample scaled versions from."""
+
+    def __init__(self, image):
+        self.width = image.width
+        self.height = image.height
+        self.levels = [image]
+
+    @property
+    def nbytes(self):
+        return sum(len(level.pixels) if np is None else level.pixels.nbytes for level in self.levels)
+
+    def level(self, width, height):
+        """The smallest level at least width x height (or the last one)."""
+        while True:
+            image = self.levels[-1]
+            if np is None or image.width // 2 < max(width, 1) or image.height // 2 < max(height, 1):
+                break
+            pixels = half(image.pixels)
+            smaller = Raster(pixels.shape[1], pixels.shape[0], None)
+            smaller.pixels = pixels
+            self.levels.append(smaller)
+        for image in self.levels:
+            if image.width // 2 < width or image.height // 2 < height:
+                return image
+        return self.levels[-1]
+
+    def scaled(self, width, height, crop=None):
+        """The image scaled to width x height, as an RGBA Raster.
+
+        crop, (x1, y1, x2, y2) in pixels of the scaled image, makes only that
+        part of it (the raster's origin is then (x1, y1)); so a picture zoomed
+        far in costs no more than the window it is shown in.
+        """
+        x1, y1, x2, y2 = crop or (0, 0, width, height)
+        image = self.level(width, height)
+        columns = [min(image.width - 1, int((x + 0.5) * image.width / width)) for x in range(x1, x2)]
+        rows = [min(image.height - 1, int((y + 0.5) * image.height / height)) for y in range(y1, y2)]
+        out = Raster(x2 - x1, y2 - y1, None, origin=(x1, y1))
+        if np is not None:
+            out.pixels = image.pixels[np.array(rows, np.intp)[:, None], np.array(columns, np.intp)]
+            return out
+        pixels, stride = image.pixels, image.width * 4
+        for y, row in enumerate(rows):
+            source = pixels[row * stride:(row + 1) * stride]
+            line = b"".join(source[4 * column:4 * column + 4] for column in columns)
+            out.pixels[y * len(line):(y + 1) * len(line)] = line
+        return out
@@ -0,0 +1,331 @@
+"""Autosave: an append-only journal of scene operations plus a snapshot.
+
+Every committed item, removal, clear, layer change and new image is
+appended to autosave.journal by a background thread, so the Tk main loop
+only pays for putting a tuple on a queue. When the journal grows past
+COMPACT_BYTES (and on close) the scene is folded into autosave.hpaint and
+the journal starts over. read_autosave() loads the snapshot and replays the
+journal on top of it; recover() puts the result into a scene.
+
+Journal entries are u32 length, u32 CRC32, then the payload; a torn entry at
+the end (the app was killed mid-write) is ignored on recovery.
+
+Items keep their place in the stacking order (Scene.order) across a
+recovery: an ADD carries the item's order key, and a journal that follows a
+snapshot starts with an ORDER entry holding the keys of the snapshot's items.
+"""
+import os
+import queue
+import struct
+import sys
+import threading
+import zlib
+from array import array
+
+import storage
+from scene import Layer, image_key
+
+SNAPSHOT_NAME = "autosave.hpaint"
+JOURNAL_NAME = "autosave.journal"
+COMPACT_BYTES = 8 * 1024 * 1024
+FLUSH_INTERVAL = 1.0  # seconds of idle time after which written entries are fsynced
+
+ADD, REMOVE, CLEAR, LAYERS, IMAGE, ORDER = range(6)
+ENTRY = struct.Struct("<II")          # payload length, crc32
+OP = struct.Struct("<BI")             # op, item id
+RECORD = struct.Struct("<BHfI")       # kind, font size, width, coord count
+LAYER_ID = struct.Struct("<I")        # after the strings of an ADD; older journals lack it
+ORDER_KEY = struct.Struct("<I")       # after the layer id; older journals lack it
+LAYER = struct.Struct("<IBH")         # id, flags, name length; the name follows
+STRING_LENGTH = struct.Struct("<H")
+
+
+def default_directory():
+    return os.path.join(os.path.expanduser("~"), ".humming_paint")
+
+
+def encode(op, item_id, record, order=None):
+    payload = bytearray(OP.pack(op, item_id))
+    if op == ADD:
+        kind, size, color, text, family, width, coords = storage.record_fields(record)
+        payload += RECORD.pack(kind, size, width, len(coords))
+        if sys.byteorder == "big":
+            coords = array("f", coords)
+            coords.byteswap()
+        payload += coords.tobytes()
+        for value in (color, text, family):
+            data = value.encode("utf-8")
+            payload += STRING_LENGTH.pack(len(data)) + data
+        payload += LAYER_ID.pack(record.layer)
+        if order is not None:
+            payload += ORDER_KEY.pack(order)
+    elif op == LAYERS:
+        payload += STRING_LENGTH.pack(len(record))
+        for layer in record:
+            name = layer.name.encode("utf-8")
+            payload += LAYER.pack(layer.id, storage.layer_flags(layer), len(name)) + name
+    elif op == IMAGE:
+        payload += record  # the encoded image
+    elif op == ORDER:
+        keys = array("I", record)
+        if sys.byteorder == "big":
+            keys.byteswap()
+        payload += keys.tobytes()
+    return ENTRY.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode(payload):
+    """(op, item id, record, order key); the order key is None but for ADDs that have one.
+
+    Raises storage.FormatError for an ADD whose record is damaged.
+    """
+    op, item_id = OP.unpack_from(payload)
+    if op == LAYERS:
+        return op, item_id, decode_layers(payload, OP.size), None
+    if op == IMAGE:
+        return op, item_id, bytes(payload[OP.size:]), None
+    if op == ORDER:
+        keys = array("I", payload[OP.size:])
+        if sys.byteorder == "big":
+            keys.byteswap()
+        return op, item_id, keys, None
+    if op != ADD:
+        return op, item_id, None, None
+    offset = OP.size
+    kind, size, width, count = RECORD.unpack_from(payload, offset)
+    offset += RECORD.size
+    coords = array("f", payload[offset:offset + 4 * count])
+    if not storage.coords_fit(kind, len(coords)) or len(coords) != count:
+        raise storage.FormatError(f"entry for item {item_id} is damaged")
+    if sys.byteorder == "big":
+        coords.byteswap()
+    offset += 4 * count
+    strings = []
+    for _ in range(3):
+        (length,) = STRING_LENGTH.unpack_from(payload, offset)
+        offset += STRING_LENGTH.size
+        strings.append(payload[offset:offset + length].decode("utf-8"))
+        offset += length
+    color, text, family = strings
+    layer = order = None
+    if offset < len(payload):
+        (layer,) = LAYER_ID.unpack_from(payload, offset)
+        offset += LAYER_ID.size
+    if offset < len(payload):
+        (order,) = ORDER_KEY.unpack_from(payload, offset)
+    return (op, item_id, storage.build_record(kind, size, color, text, family, width, coords, layer or 0),
+            order)
+
+
+def decode_layers(payload, offset):
+    (count,) = STRING_LENGTH.unpack_from(payload, offset)
+    offset += STRING_LENGTH.size
+    layers = []
+    for _ in range(count):
+        layer_id, flags, length = LAYER.unpack_from(payload, offset)
+        offset += LAYER.size
+        name = payload[offset:offset + length].decode("utf-8")
+        offset += length
+        layers.append(Layer(layer_id, name, bool(flags & storage.VISIBLE),
+                            bool(flags & storage.LOCKED)))
+    return layers
+
+
+def read_journal(path):
+    """Yields (op, item_id, record, order) for every intact entry of a journal file."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    yield from read_entries(data)
+
+
+def read_entries(data):
+    """Yields (op, item_id, record, order) for the intact entries at the start of data."""
+    offset = 0
+    while offset + ENTRY.size <= len(data):
+        length, crc = ENTRY.unpack_from(data, offset)
+        payload = data[offset + ENTRY.size:offset + ENTRY.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        try:
+            entry = decode(payload)
+        except storage.FormatError:
+            break  # like a torn entry: what follows may depend on it
+        yield entry
+        offset += ENTRY.size + length
+
+
+def read_autosave(directory=None):
+    """The last autosaved session as (background, layers, {id: record}, {key: image}), or None.
+
+    The records are in stacking order and layers is None when the session
+    never changed them. No scene is touched, so this can run on any thread.
+    """
+    directory = directory or default_directory()
+    snapshot_path = os.path.join(directory, SNAPSHOT_NAME)
+    background = layers = None
+    items = {}
+    orders = {}  # id -> order key
+    images = {}
+    restored = False
+    if os.path.exists(snapshot_path):
+        try:
+            with storage.Drawing(snapshot_path) as drawing:
+                layers = drawing.layers
+                items = dict(drawing.items())
+                orders = {item_id: position for position, item_id in enumerate(items)}
+                images = {key: bytes(data) for key, data in drawing.images.items()}
+                background = drawing.background
+                restored = True
+        except (OSError, storage.FormatError) as e:
+            print(f"Autosave snapshot unreadable, skipping it: {e}")
+    top = len(orders)
+    for op, item_id, record, order in read_journal(os.path.join(directory, JOURNAL_NAME)):
+        restored = True
+        if op == ORDER:
+            if len(record) == len(items):  # the keys of the snapshot's items
+                orders = dict(zip(items, record))
+                top = max(record, default=0)
+        elif op == ADD:
+            if order is None:  # written before order keys: on top
+                order = top + 1
+            top = max(top, order)
+            items[item_id] = record
+            orders[item_id] = order
+        elif op == REMOVE:
+            items.pop(item_id, None)
+        elif op == LAYERS:
+            layers = record
+        elif op == IMAGE:
+            images[image_key(record)] = record
+        else:
+            items.clear()
+    if not restored:
+        return None
+    items = {item_id: items[item_id] for item_id in sorted(items, key=orders.__getitem__)}
+    return background or "white", layers, items, images
+
+
+def recover(scene, directory=None):
+    """Restores the last autosaved session into an empty scene.
+
+    Returns the background color, or None when there was nothing to restore.
+    """
+    state = read_autosave(directory)
+    if state is None:
+        return None
+    background, layers, items, images = state
+    if layers is not None:
+        scene.set_layers(layers)
+    for data in images.values():
+        scene.add_image(data)
+    for item_id, record in items.items():
+        scene.insert(item_id, record)  # in stacking order, so each goes on top
+    return background
+
+
+class Journal:
+
+    def __init__(self, scene, directory=None, background="white"):
+        self.scene = scene
+        self.directory = directory or default_directory()
+        self.snapshot_path = os.path.join(self.directory, SNAPSHOT_NAME)
+        self.journal_path = os.path.join(self.directory, JOURNAL_NAME)
+        self.background = background
+        self.queue = queue.Queue()
+        self.compact_requested = False  # set by the writer, acted on by the UI thread
+        self.snapshot_queued = False
+        self.thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, name="autosave", daemon=True)
+        self.thread.start()
+        self.scene.listeners.append(self.record)
+
+    def record(self, op, item_id, record):
+        if op == "commit":
+            self.queue.put((ADD, item_id, record, self.scene.order[item_id]))
+        elif op == "remove":
+            self.queue.put((REMOVE, item_id, None))
+        elif op == "clear":
+            self.queue.put((CLEAR, 0, None))
+        elif op == "layers":
+            self.queue.put((LAYERS, 0, [layer.copy() for layer in record]))
+        elif op == "image":
+            self.queue.put((IMAGE, 0, self.scene.images[record]))
+        else:
+            return
+        if self.compact_requested:
+            self.compact_requested = False
+            self.compact()
+
+    def compact(self):
+        """Queues a snapshot of the scene as it is now; the journal restarts after it."""
+        # copying the id -> record pairs is cheap and freezes the item list for the writer
+        self.snapshot_queued = True
+        items = list(self.scene)
+        order = self.scene.order
+        self.queue.put(("snapshot", items, self.background, [layer.copy() for layer in self.scene.layers],
+                        dict(self.scene.images), [order[item_id] for item_id, record in items]))
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.scene.listeners.remove(self.record)
+        self.compact()
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        journal = open(self.journal_path, "ab")
+        written = journal.tell()
+        unsynced = False
+        while True:
+            try:
+                entries = [self.queue.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                if unsynced:
+                    os.fsync(journal.fileno())
+                    unsynced = False
+                continue
+            # batch whatever else is already waiting
+            while len(entries) < 1000:
+                try:
+                    entries.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for entry in entries:
+                if entry is None:
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                    journal.close()
+                    return
+                if entry[0] == "snapshot":
+                    journal.close()
+                    try:
+                        storage.save(self.snapshot_path, *entry[1:5], all_images=True)
+                        journal = open(self.journal_path, "wb")
+                        journal.write(encode(ORDER, 0, entry[5]))
+                    except OSError as e:
+                        print(f"Autosave snapshot failed: {e}")
+                        journal = open(self.journal_path, "ab")
+                    written = journal.tell()
+                    self.snapshot_queued = False
+                else:
+                    try:
+                        data = encode(*entry)
+                    except (struct.error, ValueError) as e:
+                        # one unencodable record must not stop the autosaves after it
+                        print(f"Autosave left out item {entry[1]}: {e}")
+                        continue
+                    journal.write(data)
+                    written += len(data)
+            journal.flush()
+            unsynced = True
+            if written > COMPACT_BYTES and not self.snapshot_queued:
+                # the snapshot has to be taken on the UI thread, at the next change
+                self.compact_requested = True
@@ -0,0 +1,48 @@
+"""Reads text labels to place in bulk (the Labels button of code.py).
+
+A label file is CSV, or tab-separated when its first row has a tab in it:
+
+    x, y, text[, size[, color]]
+
+one label per row, at world coordinates x, y. Sizes go from MIN_SIZE to
+MAX_SIZE, like the Font Size dialog's. Empty rows and rows starting with #
+are skipped; quoted CSV fields may hold commas and line breaks.
+"""
+import csv
+
+from scene import Text
+
+MIN_SIZE, MAX_SIZE = 6, 120
+
+
+def read_labels(path, size=12, color="black", family="Arial", layer=0, check_color=None):
+    """The labels in the file as Text records; size and color are the defaults.
+
+    check_color, if given, is called with each row's color and raises
+    ValueError for one that cannot be drawn, so a bad file is rejected whole.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        first = f.readline()
+        f.seek(0)
+        reader = csv.reader(f, delimiter="\t" if "\t" in first else ",")
+        records = []
+        for row in reader:
+            if not row or not "".join(row).strip() or row[0].lstrip().startswith("#"):
+                continue
+            if len(row) < 3:
+                raise ValueError(f"{path}:{reader.line_num}: expected x, y, text[, size[, color]]")
+            try:
+                x, y = float(row[0]), float(row[1])
+                label_size = int(row[3]) if len(row) > 3 and row[3].strip() else size
+            except ValueError:
+                raise ValueError(f"{path}:{reader.line_num}: bad number") from None
+            if not MIN_SIZE <= label_size <= MAX_SIZE:
+                raise ValueError(f"{path}:{reader.line_num}: size {label_size} is not {MIN_SIZE} to {MAX_SIZE}")
+            label_color = row[4].strip() if len(row) > 4 and row[4].strip() else color
+            if check_color and label_color != color:
+                try:
+                    check_color(label_color)
+                except ValueError:
+                    raise ValueError(f"{path}:{reader.line_num}: unknown color {label_color!r}") from None
+            records.append(Text(x, y, row[2], label_color, family, label_size, layer))
+    return records
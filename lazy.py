@@ -0,0 +1,12 @@
+"""Modules imported the first time they are used, to keep them off the startup path."""
+import importlib
+
+
+class LazyModule:
+    """A module imported the first time one of its attributes is used."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self.name), attr)
@@ -0,0 +1,198 @@
+"""Opt-in timing of the UI hot paths with a status-bar readout.
+
+Turned on by HUMMING_PAINT_PERF (set it to a file name to choose where the
+data is dumped, or to 1) or toggled with F12. While it is on, every call of
+the HANDLERS is timed through code.entry_hooks, keyed by handler and tool,
+and so is the event-to-render delay: the time from an event that changed the
+drawing until Tk got idle again, i.e. had redrawn the canvas. Each key keeps
+a rolling histogram of its last WINDOW samples. Shift-F12 (and quitting
+while it is on) dumps the histograms and the raw samples, with the scene
+and canvas item counts at each one, as JSON. Counting canvas items walks all
+of them, so the count is taken with each status-bar refresh (REFRESH_MS) and
+samples carry the latest one.
+
+Startup is always timed, from the top of code.py: the STARTUP milestones go
+into the dumps and are printed once the last session is back when the
+monitor is on from the start.
+"""
+import json
+import os
+import time
+import tkinter as tk
+from collections import deque
+
+HANDLERS = ("start_draw", "draw", "flush_points", "stop_draw", "clear_canvas")
+BUCKETS = [1e-5 * 2 ** k for k in range(18)]  # upper bounds in seconds, 10us to 1.3s
+WINDOW = 2000      # samples per rolling histogram
+SAMPLES = 100000   # raw samples kept for dumps
+REFRESH_MS = 500
+# imports done, widgets built, first frame on screen (the canvas takes input
+# from here), last session restored, first stroke of the user on screen
+STARTUP = ("imports", "window", "first_frame", "restored", "first_stroke")
+
+
+def bucket(seconds):
+    for index, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            return index
+    return len(BUCKETS)
+
+
+class Histogram:
+    """Bucket counts over the last `window` samples."""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.samples = deque()
+        self.counts = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds):
+        if len(self.samples) == self.window:
+            self.counts[bucket(self.samples.popleft())] -= 1
+        self.samples.append(seconds)
+        self.counts[bucket(seconds)] += 1
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of the samples."""
+        wanted = fraction * len(self.samples)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= wanted:
+                return BUCKETS[index] if index < len(BUCKETS) else max(self.samples)
+        return 0.0
+
+    def summary(self):
+        return {"count": len(self.samples), "p50": self.percentile(0.5), "p99": self.percentile(0.99),
+                "max": max(self.samples, default=0.0), "buckets": list(self.counts)}
+
+
+class Startup:
+    """Seconds from started until each startup milestone."""
+
+    def __init__(self, started):
+        self.started = started
+        self.marks = {}
+
+    def mark(self, name):
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() - self.started
+
+    def mark_idle(self, widget, name):
+        """Marks once Tk is idle again, i.e. has drawn what was asked until now."""
+        if name not in self.marks:
+            widget.after_idle(self.mark, name)
+
+    def summary(self):
+        return "startup: " + ", ".join(f"{name} {self.marks[name] * 1000:.0f}" for name in STARTUP
+                                       if name in self.marks) + " ms"
+
+
+class Monitor:
+
+    def __init__(self, app, dump_path):
+        self.app = app  # the code.py module
+        self.dump_path = dump_path
+        self.histograms = {}       # (handler, tool) -> Histogram
+        self.render = Histogram()
+        self.samples = deque(maxlen=SAMPLES)  # (time, handler, tool, seconds, scene items, canvas items)
+        self.canvas_items = 0  # as of the last refresh
+        self.t0 = time.perf_counter()
+        self.unrendered = None     # start of the oldest event not on screen yet
+        self.label = None
+        self.job = None
+
+    @property
+    def enabled(self):
+        return self.hook in self.app.entry_hooks
+
+    def toggle(self, event=None):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.app.entry_hooks.append(self.hook)
+        self.label = tk.Label(self.app.root, anchor=tk.W, font=("TkFixedFont", 9))
+        self.label.pack(side=tk.BOTTOM, fill=tk.X, before=self.app.canvas)
+        self.refresh()
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.app.entry_hooks.remove(self.hook)
+        self.app.root.after_cancel(self.job)
+        self.label.destroy()
+        self.label = self.job = None
+
+    def hook(self, name, args, start, seconds, depth):
+        if name not in HANDLERS:
+            return
+        app = self.app
+        tool = app.current_mode
+        key = (name, tool)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].add(seconds)
+        self.samples.append((round(start - self.t0, 6), name, tool, seconds, len(app.scene),
+                             self.canvas_items))
+        if depth:
+            return
+        if name == "draw" and tool in ("pencil", "eraser"):
+            # the point is only queued; its delay ends after the frame that flushes it
+            if app.controller.pending and self.unrendered is None:
+                self.unrendered = start
+            return
+        if self.unrendered is None:
+            self.unrendered = start
+        # idle callbacks run in order, so this one runs after the canvas redraw
+        app.canvas.after_idle(self.rendered)
+
+    def rendered(self):
+        if self.unrendered is None:
+            return
+        delay = time.perf_counter() - self.unrendered
+        self.unrendered = None
+        self.render.add(delay)
+        self.samples.append((round(time.perf_counter() - self.t0, 6), "(render)",
+                             self.app.current_mode, delay, len(self.app.scene), self.canvas_items))
+
+    def refresh(self):
+        app = self.app
+        tool = app.current_mode
+        parts = [f"{tool}:"]
+        for name in HANDLERS:
+            histogram = self.histograms.get((name, tool))
+            if histogram and histogram.samples:
+                parts.append(f"{name} {ms(histogram.percentile(0.5))}/{ms(histogram.percentile(0.99))}")
+        if self.render.samples:
+            parts.append(f"| render {ms(self.render.percentile(0.5))}/{ms(self.render.percentile(0.99))}")
+        self.canvas_items = len(app.canvas.find_all())
+        parts.append(f"| canvas {self.canvas_items} items, scene {len(app.scene)}")
+        self.label.config(text="  ".join(parts) + "  (p50/p99 ms)")
+        self.job = app.root.after(REFRESH_MS, self.refresh)
+
+    def dump(self, event=None):
+        data = {
+            "buckets": BUCKETS,
+            "handlers": {f"{name}:{tool}": histogram.summary()
+                         for (name, tool), histogram in self.histograms.items()},
+            "render": self.render.summary(),
+            "startup": self.app.startup.marks,
+            "samples": list(self.samples),
+        }
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.dump_path)), exist_ok=True)
+            with open(self.dump_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        except OSError as e:
+            print(f"Could not write performance data: {e}")
+            return
+        print(f"Performance data written to {self.dump_path}")
+
+
+def ms(seconds):
+    return f"{seconds * 1000:.2g}"
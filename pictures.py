@@ -0,0 +1,111 @@
+"""Decoded images and their scaled PhotoImages, in one bounded LRU cache.
+
+A Picture is drawn at its size times the zoom, so a stamp placed many times
+or viewed at a few zoom levels asks for the same few sizes over and over.
+PictureCache decodes each image of scene.images once (an imaging.Pyramid)
+and keeps the PhotoImage made for every (image, size, visible part) it was
+asked for. Both count against max_bytes (4 bytes a pixel, as Tk stores
+them) and the least recently used are dropped past it; a dropped pyramid is
+decoded again when next needed. A PhotoImage shown on the canvas stays
+alive through its canvas item's reference, so dropping it from here only
+frees it once the item is gone.
+"""
+import tkinter as tk
+from collections import OrderedDict
+
+from lazy import LazyModule
+from scene import image_key
+
+imaging = LazyModule("imaging")  # with NumPy; only needed once there are images
+
+PICTURE_CACHE = 64 * 1024 * 1024  # bytes of decoded and scaled images kept
+
+
+class PictureCache:
+
+    def __init__(self, master, images, max_bytes=PICTURE_CACHE):
+        self.master = master
+        self.images = images  # image key -> encoded bytes, e.g. scene.images
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (Pyramid or PhotoImage, bytes), least recently used first
+        self.size = 0
+        self.failed = set()  # image keys that could not be decoded
+
+    def pyramid(self, key):
+        """The decoded image, or None when it is unknown or unreadable."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry[0]
+        if key not in self.images or key in self.failed:
+            return None
+        try:
+            pyramid = imaging.Pyramid(imaging.decode(self.images[key]))
+        except ValueError as e:
+            print(f"Cannot show image {key}: {e}")
+            self.failed.add(key)
+            return None
+        self.put(key, pyramid, pyramid.nbytes)
+        return pyramid
+
+    def load(self, data):
+        """Decodes newly imported image bytes into the cache; returns (key, (width, height)).
+
+        Raises ValueError when they are not a readable image.
+        """
+        pyramid = imaging.Pyramid(imaging.decode(data))
+        key = image_key(data)
+        self.failed.discard(key)
+        if key not in self.entries:
+            self.put(key, pyramid, pyramid.nbytes)
+        return key, (pyramid.width, pyramid.height)
+
+    def size_of(self, key):
+        """(width, height) of the image in pixels, or None."""
+        pyramid = self.pyramid(key)
+        return None if pyramid is None else (pyramid.width, pyramid.height)
+
+    def photo(self, key, width, height, crop=None):
+        """A PhotoImage of the image scaled to width x height; crop as in imaging.Pyramid.scaled."""
+        variant = (key, width, height, crop)
+        entry = self.entries.get(variant)
+        if entry is not None:
+            self.entries.move_to_end(variant)
+            return entry[0]
+        pyramid = self.pyramid(key)
+        if pyramid is None:
+            return None
+        levels = len(pyramid.levels)
+        image = pyramid.scaled(width, height, crop)
+        photo = photo_image(self.master, image)
+        if len(pyramid.levels) != levels:
+            self.resize(key, pyramid.nbytes)
+        self.put(variant, photo, image.width * image.height * 4)
+        return photo
+
+    def put(self, key, value, size):
+        self.entries[key] = (value, size)
+        self.size += size
+        self.evict(keep=key)
+
+    def resize(self, key, size):
+        value, old = self.entries[key]
+        self.entries[key] = (value, size)
+        self.size += size - old
+
+    def evict(self, keep=None):
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            if key == keep:
+                self.entries.move_to_end(key)
+                continue
+            self.size -= self.entries.pop(key)[1]
+
+
+def photo_image(master, image):
+    """A PhotoImage of an RGBA raster.Raster; opaque images go as PPM, which Tk reads fastest."""
+    pixels = image.pixels
+    if imaging.np is not None and (pixels[..., 3] == 255).all():
+        header = b"P6 %d %d 255\n" % (image.width, image.height)
+        return tk.PhotoImage(master=master, data=header + pixels[..., :3].tobytes(), format="ppm")
+    return tk.PhotoImage(master=master, data=image.png(level=0), format="png")
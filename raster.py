@@ -0,0 +1,467 @@
+"""Offscreen rasterizer for scene records.
+
+Draws strokes and shapes into an RGB pixel buffer (RGBA when transparent)
+without Tk. The buffer is a NumPy array when NumPy is installed and a plain
+bytearray otherwise. Shapes are filled one horizontal span at a time; with
+NumPy a whole stroke is drawn in one go by stamping its brush disc along the
+path.
+
+Text is only drawn when asked for with draw_text, in a small bitmap font
+(see bitmapfont.py) that looks nothing like Tk's, so a bucket fill does not
+stop at it. Pictures are left to the caller, as the records do not hold
+their images; composite() lays a decoded one (see imaging.py) over the raster.
+"""
+import math
+import string
+import struct
+import zlib
+from functools import lru_cache
+
+import bitmapfont
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import colors
+from scene import Fill, Stroke, Shape
+
+BATCH_POINTS = 20000  # coordinates per batch in draw_all, bounds its temporary arrays
+
+
+def parse_color(color):
+    """Turns a Tk color ("#rgb", "#rrggbb", "#rrrrggggbbbb" or a name) into (r, g, b).
+
+    Raises ValueError for anything Tk would not take either.
+    """
+    if color.startswith("#"):
+        digits = len(color) - 1
+        if digits in (3, 6, 9, 12) and all(c in string.hexdigits for c in color[1:]):
+            step = digits // 3
+            channels = [int(color[1 + i * step:1 + (i + 1) * step], 16) for i in range(3)]
+            scale = 16 ** step - 1
+            return tuple(round(c * 255 / scale) for c in channels)
+    rgb = colors.rgb(color)
+    if rgb is None:
+        raise ValueError(f"unknown color {color!r}")
+    return rgb
+
+
+def smooth_points(points):
+    """Flattens Tk's smooth=True spline through a flat x/y point list.
+
+    Tk draws a quadratic Bezier per inner vertex, running between the
+    midpoints of its neighbouring segments (the ends are kept as is).
+    """
+    n = len(points) // 2
+    if n < 3:
+        return list(points)
+    out = [points[0], points[1]]
+    for i in range(n - 2):
+        cx, cy = points[2 * i + 2], points[2 * i + 3]
+        if i == 0:
+            sx, sy = points[0], points[1]
+        else:
+            sx, sy = (points[2 * i] + cx) / 2, (points[2 * i + 1] + cy) / 2
+        if i == n - 3:
+            ex, ey = points[-2], points[-1]
+        else:
+            ex, ey = (cx + points[2 * i + 4]) / 2, (cy + points[2 * i + 5]) / 2
+        steps = max(1, min(12, int((abs(ex - sx) + abs(ey - sy)) / 3)))
+        for k in range(1, steps + 1):
+            t = k / steps
+            a, b, c = (1 - t) * (1 - t), 2 * t * (1 - t), t * t
+            out.append(a * sx + b * cx + c * ex)
+            out.append(a * sy + b * cy + c * ey)
+    return out
+
+
+@lru_cache(maxsize=64)
+def disc_offsets(r):
+    """Integer (dx, dy) pixel offsets covered by a round brush of radius r."""
+    reach = int(math.ceil(r))
+    dy, dx = np.mgrid[-reach:reach + 1, -reach:reach + 1]
+    inside = dx * dx + dy * dy <= max(r * r, 0.25)
+    return dx[inside], dy[inside]
+
+
+class Raster:
+    """An image covering the world rectangle origin .. origin + size.
+
+    With background=None it is transparent RGBA, otherwise opaque RGB.
+    """
+
+    def __init__(self, width, height, background="white", origin=(0, 0)):
+        self.width = width
+        self.height = height
+        self.origin = origin
+        if background is None:
+            self.channels = 4
+            self.background = (0, 0, 0, 0)
+        else:
+            self.channels = 3
+            self.background = parse_color(background)
+        self.clip = None  # optional (x1, y1, x2, y2) in world coordinates
+        if np is not None:
+            self.pixels = np.empty((height, width, self.channels), dtype=np.uint8)
+            self.pixels[:] = self.background
+        else:
+            self.pixels = bytearray(bytes(self.background) * (width * height))
+
+    def ink(self, color):
+        """The pixel value for a Tk color."""
+        rgb = parse_color(color)
+        return rgb if self.channels == 3 else rgb + (255,)
+
+    def contains(self, x1, y1, x2, y2):
+        ox, oy = self.origin
+        return x1 >= ox and y1 >= oy and x2 <= ox + self.width and y2 <= oy + self.height
+
+    # Like Tk, pixel (i, j) is centered on world point origin + (i, j), and
+    # a span covers the pixels whose centers lie in [start, end).
+
+    def rows(self, y1, y2):
+        oy = self.origin[1]
+        if self.clip:
+            y1, y2 = max(y1, self.clip[1]), min(y2, self.clip[3])
+        first = max(0, math.ceil(y1 - oy))
+        last = min(self.height - 1, math.ceil(y2 - oy) - 1)
+        return range(first, last + 1)
+
+    def fill_span(self, row, x1, x2, rgb):
+        ox = self.origin[0]
+        if self.clip:
+            x1, x2 = max(x1, self.clip[0]), min(x2, self.clip[2])
+        first = max(0, math.ceil(x1 - ox))
+        last = min(self.width - 1, math.ceil(x2 - ox) - 1)
+        if first > last:
+            return
+        if np is not None:
+            self.pixels[row, first:last + 1] = rgb
+        else:
+            channels = self.channels
+            start = (row * self.width + first) * channels
+            self.pixels[start:start + (last - first + 1) * channels] = bytes(rgb) * (last - first + 1)
+
+    def fill_rect(self, x1, y1, x2, y2, rgb):
+        for row in self.rows(y1, y2):
+            self.fill_span(row, x1, x2, rgb)
+
+    def fill_spans(self, rows, x1s, x2s, rgb):
+        """NumPy path of fill_span for arrays of spans; rows must be inside the image and clip."""
+        ox = self.origin[0]
+        if self.clip:
+            x1s, x2s = np.maximum(x1s, self.clip[0]), np.minimum(x2s, self.clip[2])
+        firsts = np.maximum(np.ceil(x1s - ox), 0).astype(np.intp)
+        lasts = np.minimum(np.ceil(x2s - ox) - 1, self.width - 1).astype(np.intp)
+        counts = np.maximum(lasts - firsts + 1, 0)
+        starts = rows * self.width + firsts
+        index = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(int(counts.sum()))
+        self.pixels.reshape(-1, self.channels)[index] = rgb
+
+    def span_rows(self, y1, y2):
+        span = self.rows(y1, y2)
+        return np.arange(span.start, span.stop, dtype=np.intp)
+
+    def clear(self, x1, y1, x2, y2):
+        self.fill_rect(x1, y1, x2, y2, self.background)
+
+    def draw_capsule(self, x0, y0, x1, y1, r, rgb):
+        """Fills every pixel within r of the segment (a line with round caps)."""
+        oy = self.origin[1]
+        dx, dy = x1 - x0, y1 - y0
+        length2 = dx * dx + dy * dy
+        rl = r * math.sqrt(length2)
+        inf = float("inf")
+        for row in self.rows(min(y0, y1) - r, max(y0, y1) + r):
+            yc = oy + row
+            lo, hi = inf, -inf
+            for px, py in ((x0, y0), (x1, y1)):
+                h2 = r * r - (yc - py) ** 2
+                if h2 >= 0:
+                    h = math.sqrt(h2)
+                    lo, hi = min(lo, px - h), max(hi, px + h)
+            if length2:
+                # the band between the caps, as two linear constraints on x
+                a_lo, a_hi = -inf, inf
+                base = (yc - y0) * dy
+                if dx:
+                    a_lo, a_hi = sorted(((x0 * dx - base) / dx, (x0 * dx + length2 - base) / dx))
+                elif not 0 <= base <= length2:
+                    a_lo, a_hi = inf, -inf
+                b_lo, b_hi = -inf, inf
+                cross = (yc - y0) * dx
+                if dy:
+                    b_lo, b_hi = sorted((x0 + (cross - rl) / dy, x0 + (cross + rl) / dy))
+                elif abs(cross) > rl:
+                    b_lo, b_hi = inf, -inf
+                band_lo, band_hi = max(a_lo, b_lo), min(a_hi, b_hi)
+                if band_lo <= band_hi:
+                    lo, hi = min(lo, band_lo), max(hi, band_hi)
+            if lo <= hi:
+                self.fill_span(row, lo, hi, rgb)
+
+    def draw_polyline(self, points, width, rgb, smooth=True):
+        r = max(width, 1) / 2
+        if np is not None:
+            self.stamp_polylines([points], r, rgb, smooth)
+            return
+        if smooth:
+            points = smooth_points(points)
+        if len(points) == 2:
+            points = list(points) * 2
+        for i in range(0, len(points) - 2, 2):
+            self.draw_capsule(points[i], points[i + 1], points[i + 2], points[i + 3], r, rgb)
+
+    def stamp_polylines(self, paths, r, rgb, smooth):
+        """NumPy path of draw_polyline for several polylines of the same style at once.
+
+        The paths become one list of quadratic curve pieces (one per inner
+        vertex when smoothing, as in smooth_points, else one per segment), and
+        the brush disc is stamped at close steps along all of them.
+        """
+        lengths = np.array([len(points) // 2 for points in paths])
+        path = np.concatenate([np.asarray(points, dtype=np.float64) for points in paths])
+        path = path.reshape(-1, 2) - self.origin
+        ends = np.cumsum(lengths)
+        firsts = ends - lengths
+        pos = np.arange(len(path))
+        n = np.repeat(lengths, lengths)
+        last = np.repeat(ends - 1, lengths)
+        first = np.repeat(firsts, lengths)
+
+        pieces = []
+        if smooth:
+            j = np.nonzero((n >= 3) & (pos <= last - 2))[0]
+            control = path[j + 1]
+            start = np.where((j == first[j])[:, None], path[j], (path[j] + control) / 2)
+            end = np.where((j + 2 == last[j])[:, None], path[j + 2], (control + path[j + 2]) / 2)
+            pieces.append((start, control, end))
+            j = np.nonzero((n == 2) & (pos == first))[0]
+        else:
+            j = np.nonzero(pos < last)[0]
+        pieces.append((path[j], (path[j] + path[j + 1]) / 2, path[j + 1]))
+        j = np.nonzero(n == 1)[0]
+        pieces.append((path[j], path[j], path[j]))
+        start, control, end = (np.concatenate(part) for part in zip(*pieces))
+
+        length = np.hypot(*(control - start).T) + np.hypot(*(end - control).T)
+        counts = np.ceil(length / max(0.5, r / 4)).astype(np.int64) + 1
+        index = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(len(index)) - np.repeat(np.cumsum(counts) - counts, counts)
+        t = (offsets / np.maximum(counts - 1, 1)[index])[:, None]
+        samples = (1 - t) ** 2 * start[index] + 2 * t * (1 - t) * control[index] + t * t * end[index]
+        centers = np.rint(samples).astype(np.int64)
+        moved = np.any(centers[1:] != centers[:-1], axis=1)
+        centers = centers[np.concatenate(([True], moved))]
+
+        dx, dy = disc_offsets(r)
+        xs = (centers[:, 0:1] + dx).ravel()
+        ys = (centers[:, 1:2] + dy).ravel()
+        x1, y1, x2, y2 = 0, 0, self.width, self.height
+        if self.clip:
+            ox, oy = self.origin
+            cx1, cy1, cx2, cy2 = self.clip
+            x1, y1 = max(x1, math.ceil(cx1 - ox)), max(y1, math.ceil(cy1 - oy))
+            x2, y2 = min(x2, math.ceil(cx2 - ox)), min(y2, math.ceil(cy2 - oy))
+        inside = (xs >= x1) & (xs < x2) & (ys >= y1) & (ys < y2)
+        self.pixels[ys[inside], xs[inside]] = rgb
+
+    def draw_rectangle(self, coords, width, rgb):
+        x1, y1, x2, y2 = coords
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        h = max(width, 1) / 2
+        if np is not None:
+            # top, bottom, left and right edges as one set of spans
+            edges = ((x1 - h, y1 - h, x2 + h, y1 + h), (x1 - h, y2 - h, x2 + h, y2 + h),
+                     (x1 - h, y1 + h, x1 + h, y2 - h), (x2 - h, y1 + h, x2 + h, y2 - h))
+            rows = [self.span_rows(ey1, ey2) for ex1, ey1, ex2, ey2 in edges]
+            self.fill_spans(np.concatenate(rows),
+                            np.concatenate([np.full(len(r), e[0]) for r, e in zip(rows, edges)]),
+                            np.concatenate([np.full(len(r), e[2]) for r, e in zip(rows, edges)]), rgb)
+            return
+        self.fill_rect(x1 - h, y1 - h, x2 + h, y1 + h, rgb)
+        self.fill_rect(x1 - h, y2 - h, x2 + h, y2 + h, rgb)
+        self.fill_rect(x1 - h, y1 + h, x1 + h, y2 - h, rgb)
+        self.fill_rect(x2 - h, y1 + h, x2 + h, y2 - h, rgb)
+
+    def draw_oval(self, coords, width, rgb):
+        x1, y1, x2, y2 = coords
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        a, b = abs(x2 - x1) / 2, abs(y2 - y1) / 2
+        h = max(width, 1) / 2
+        oa, ob, ia, ib = a + h, b + h, a - h, b - h
+        oy = self.origin[1]
+        if np is not None:
+            rows = self.span_rows(cy - ob, cy + ob)
+            t = oy + rows - cy
+            outer = 1 - (t / ob) ** 2
+            rows, t, outer = rows[outer >= 0], t[outer >= 0], outer[outer >= 0]
+            ow = oa * np.sqrt(outer)
+            if ia > 0 and ib > 0:
+                inner = 1 - (t / ib) ** 2
+            else:
+                inner = np.full(len(rows), -1.0)
+            ring = inner > 0
+            iw = ia * np.sqrt(np.where(ring, inner, 0))
+            # solid rows are one span, rows through the hole two
+            self.fill_spans(np.concatenate((rows, rows[ring])),
+                            np.concatenate((cx - ow, (cx + iw)[ring])),
+                            np.concatenate((np.where(ring, cx - iw, cx + ow), (cx + ow)[ring])), rgb)
+            return
+        for row in self.rows(cy - ob, cy + ob):
+            t = oy + row - cy
+            outer = 1 - (t / ob) ** 2
+            if outer < 0:
+                continue
+            ow = oa * math.sqrt(outer)
+            inner = 1 - (t / ib) ** 2 if ia > 0 and ib > 0 else -1
+            if inner <= 0:
+                self.fill_span(row, cx - ow, cx + ow, rgb)
+            else:
+                iw = ia * math.sqrt(inner)
+                self.fill_span(row, cx - ow, cx - iw, rgb)
+                self.fill_span(row, cx + iw, cx + ow, rgb)
+
+    def draw_fill(self, record, rgb):
+        """Fills the cells of a Fill record."""
+        cell, half = record.cell, record.cell / 2
+        if np is None:
+            spans = record.spans
+            for i in range(0, len(spans), 3):
+                row, first, last = spans[i:i + 3]
+                self.fill_rect(record.x + first * cell - half, record.y + row * cell - half,
+                               record.x + last * cell + half, record.y + row * cell + half, rgb)
+            return
+        spans = np.frombuffer(record.spans, dtype=np.float32).reshape(-1, 3).astype(np.float64)
+        y1 = record.y + spans[:, 0] * cell - half
+        y2 = y1 + cell
+        if self.clip:
+            y1, y2 = np.maximum(y1, self.clip[1]), np.minimum(y2, self.clip[3])
+        # a span covers cell pixel rows (or fewer) at this scale: one pixel span per row
+        oy = self.origin[1]
+        r1 = np.clip(np.ceil(y1 - oy), 0, self.height).astype(np.intp)
+        r2 = np.clip(np.ceil(y2 - oy), 0, self.height).astype(np.intp)
+        counts = np.maximum(r2 - r1, 0)
+        rows = np.repeat(r1 - np.cumsum(counts) + counts, counts) + np.arange(int(counts.sum()))
+        self.fill_spans(rows, np.repeat(record.x + spans[:, 1] * cell - half, counts),
+                        np.repeat(record.x + spans[:, 2] * cell + half, counts), rgb)
+
+    def draw_text(self, record):
+        """Draws a Text record in the bitmap font, about as big as text_extent guesses."""
+        rgb = self.ink(record.color)
+        unit = record.size * bitmapfont.UNIT
+        for number, line in enumerate(record.text.split("\n")):
+            top = record.y + (number * bitmapfont.LINE_HEIGHT + bitmapfont.TOP) * unit
+            for position, char in enumerate(line):
+                left = record.x + position * bitmapfont.ADVANCE * unit
+                for row, first, last in bitmapfont.runs(char):
+                    self.fill_rect(left + first * unit, top + row * unit,
+                                   left + (last + 1) * unit, top + (row + 1) * unit, rgb)
+
+    def draw(self, record):
+        """Draws a scene record; returns False for records it cannot draw (text)."""
+        if isinstance(record, Fill):
+            self.draw_fill(record, self.ink(record.color))
+        elif isinstance(record, Stroke):
+            self.draw_polyline(record.points, record.width, self.ink(record.color))
+        elif isinstance(record, Shape):
+            draw_shape = self.draw_rectangle if record.kind == "rectangle" else self.draw_oval
+            draw_shape(record.coords, record.width, self.ink(record.color))
+        else:
+            return False
+        return True
+
+    def composite(self, image):
+        """Lays an RGBA raster over this one, blending by its alpha; its origin is in the same pixels."""
+        ox, oy = image.origin[0] - self.origin[0], image.origin[1] - self.origin[1]
+        x1, y1 = max(0, ox), max(0, oy)
+        x2, y2 = min(self.width, ox + image.width), min(self.height, oy + image.height)
+        if x1 >= x2 or y1 >= y2:
+            return
+        if np is not None:
+            source = image.pixels[y1 - oy:y2 - oy, x1 - ox:x2 - ox].astype(np.float32)
+            target = self.pixels[y1:y2, x1:x2]
+            alpha = source[..., 3:] / 255
+            if self.channels == 3:
+                target[:] = np.rint(source[..., :3] * alpha + target * (1 - alpha))
+                return
+            under = target[..., 3:] / 255 * (1 - alpha)
+            total = alpha + under
+            color = (source[..., :3] * alpha + target[..., :3] * under) / np.maximum(total, 1e-6)
+            target[..., :3] = np.rint(color)
+            target[..., 3:] = np.rint(total * 255)
+            return
+        channels = self.channels
+        for y in range(y1, y2):
+            for x in range(x1, x2):
+                start = ((y - oy) * image.width + x - ox) * 4
+                r, g, b, a = image.pixels[start:start + 4]
+                if not a:
+                    continue
+                at = (y * self.width + x) * channels
+                old = self.pixels[at:at + channels]
+                if channels == 3:
+                    pixel = [(c * a + o * (255 - a) + 127) // 255 for c, o in zip((r, g, b), old)]
+                else:
+                    under = old[3] * (255 - a) // 255
+                    total = a + under
+                    pixel = [(c * a + o * under + total // 2) // total for c, o in zip((r, g, b), old)]
+                    pixel.append(total)
+                self.pixels[at:at + channels] = bytes(pixel)
+
+    def draw_all(self, records):
+        """Draws records in order. With NumPy, runs of strokes of the same color
+        and width are drawn as one batch."""
+        if np is None:
+            for record in records:
+                self.draw(record)
+            return
+        batch, style, size = [], None, 0
+
+        def flush():
+            if batch:
+                color, width = style
+                self.stamp_polylines(batch, max(width, 1) / 2, self.ink(color), True)
+                batch.clear()
+
+        for record in records:
+            if isinstance(record, Stroke):
+                if (record.color, record.width) != style or size > BATCH_POINTS:
+                    flush()
+                    style, size = (record.color, record.width), 0
+                batch.append(record.points)
+                size += len(record.points)
+            else:
+                flush()
+                style = None
+                self.draw(record)
+        flush()
+
+    def ppm(self):
+        """The image as binary PPM, which Tk's PhotoImage reads directly (RGB only)."""
+        header = b"P6 %d %d 255\n" % (self.width, self.height)
+        return header + bytes(self.pixels)
+
+    def png(self, level=6):
+        """The image as PNG bytes (8-bit RGB or RGBA, no filtering)."""
+        channels = self.channels
+        if np is not None:
+            rows = np.zeros((self.height, self.width * channels + 1), dtype=np.uint8)
+            rows[:, 1:] = self.pixels.reshape(self.height, -1)
+            raw = rows.tobytes()
+        else:
+            stride = self.width * channels
+            raw = b"".join(b"\0" + bytes(self.pixels[row * stride:(row + 1) * stride])
+                           for row in range(self.height))
+
+        def chunk(kind, data):
+            return (struct.pack(">I", len(data)) + kind + data
+                    + struct.pack(">I", zlib.crc32(kind + data)))
+
+        color_type = 2 if channels == 3 else 6
+        header = struct.pack(">IIBBBBB", self.width, self.height, 8, color_type, 0, 0, 0)
+        return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+                + chunk(b"IDAT", zlib.compress(raw, level)) + chunk(b"IEND", b""))
@@ -0,0 +1,664 @@
+"""Keeps a Tk canvas in sync with a scene.Scene.
+
+The canvas is a viewport onto the scene: canvas coordinates are world
+coordinates times the zoom, and panning scrolls the canvas. Only items near
+the view (the "region": the view plus CULL_MARGIN of it on every side) have
+canvas items. Once the view leaves the region, the region is culled again
+from the scene's spatial index, so panning and zooming cost in proportion to
+what is on screen rather than to the size of the drawing. Zoomed out,
+strokes are drawn from simplified level-of-detail copies of their points.
+
+Each layer of the scene starts with a hidden marker item, and its canvas
+items sit between its marker and the next layer's, so Tk's display list
+keeps the layer order. Items of hidden layers get no canvas items. With
+cache_layers on, the layers other than the active one are drawn into one
+image per layer instead of as vector items, like baked items are. Text and
+pictures always stay canvas items, and so does anything lying over one of
+them, which a backing image under them could not show.
+
+Pictures are image items showing a PhotoImage of their image at the zoomed
+size, cut to the region when they reach beyond it, from a
+pictures.PictureCache. Until their image is known (e.g. it is still on its
+way from a shared session) they show as a dashed frame.
+"""
+import math
+import time
+import tkinter as tk
+
+from lazy import LazyModule
+from scene import Fill, Picture, Stroke, Shape, Text, scaled, simplify_polyline
+
+raster_module = LazyModule("raster")  # with NumPy; only needed once something is baked
+
+# Live strokes are drawn in segments of at most this many points, so every
+# motion event only re-sends a bounded number of coordinates to Tk; the
+# segments are merged into one item when the stroke is committed.
+STROKE_CHUNK = 64
+
+# Baking: once more than BAKE_THRESHOLD committed items are live (or the
+# oldest one is older than BAKE_AGE seconds) everything but the newest
+# BAKE_KEEP items is rasterized into one backing image under the drawing.
+# The image only covers the region and is redrawn when the region changes.
+# Text and pictures are never baked, nor is what lies over them. The same images
+# hold the items of cached layers.
+BAKE_THRESHOLD = 3000
+BAKE_KEEP = 500
+BAKE_AGE = 600
+
+CULL_MARGIN = 0.25          # part of the view drawn beyond each of its edges
+MIN_ZOOM, MAX_ZOOM = 1 / 64, 32
+# Zoomed out to 1/2**level, a stroke is drawn from a copy simplified by
+# LOD_TOLERANCE * 2**level world pixels, i.e. at most LOD_TOLERANCE on screen.
+LOD_TOLERANCE = 0.5
+LOD_MIN_POINTS = 8          # strokes this short are always drawn as they are
+
+TAGS = {Stroke: "line", Shape: "drawn_shape", Text: "drawn_text", Fill: "drawn_fill",
+        Picture: "drawn_picture"}
+
+
+class Backing:
+    """A raster image of one layer's rasterized items in the region, and its canvas item."""
+    __slots__ = ("raster", "photo", "item")
+
+    def __init__(self):
+        self.raster = self.photo = self.item = None
+
+
+class CanvasRenderer:
+
+    def __init__(self, canvas, scene, bake=False, cache_layers=False, fonts=None, pictures=None):
+        self.canvas = canvas
+        self.scene = scene
+        self.fonts = fonts    # fonts.FontCache for text items, if any
+        self.pictures = pictures  # pictures.PictureCache for picture items; frames only without it
+        self.canvas_ids = {}  # scene id -> canvas item id
+        self.scene_ids = {}   # canvas item id -> scene id
+        self.live = {}        # scene id of a growing stroke -> [sealed segments, segment start]
+        self.lod = {}         # scene id -> {level: simplified points}
+        self.photos = {}      # scene id of a fill or picture -> the PhotoImage its canvas item shows
+        self.zoom = 1.0
+        self.view_x = self.view_y = 0  # canvas coordinates of the window's top-left corner
+        self.bake_enabled = bake
+        self.committed = {}   # scene id -> commit time of bakeable unbaked items, oldest first
+        self.baked = {}       # scene ids drawn into backing images
+        self.backings = {}    # layer id -> Backing, in canvas coordinates
+        self.damage = {}      # layer id -> world rectangle of its backing image to repaint
+        self.selected = set() # scene ids whose canvas items carry the "selected" tag
+        self.cache_layers = cache_layers
+        self.active_layer = scene.layers[-1].id
+        self.markers = {}     # layer id -> its marker item
+        self.above = {}       # layer id -> marker item of the layer above it, if any
+        self.hidden = set()   # ids of hidden layers
+        self.bottom = None    # id of the lowest visible layer; its backing can be opaque
+        self.overlays = {}    # layer id -> ids of its text and picture items
+        for item_id, record in scene.items.items():
+            if isinstance(record, (Text, Picture)):
+                self.overlays.setdefault(record.layer, set()).add(item_id)
+        canvas.config(confine=False)
+        self.layers_changed()
+        scene.listeners.append(self.apply)
+        canvas.bind("<Configure>", self.resized, add="+")
+
+    def apply(self, op, item_id, record):
+        if op == "add":
+            if isinstance(record, (Text, Picture)):
+                self.overlays.setdefault(record.layer, set()).add(item_id)
+            self.create(item_id, record)
+        elif op == "extend":
+            self.extend(item_id, record)
+        elif op == "commit":
+            self.commit(item_id, record)
+        elif op == "remove":
+            if isinstance(record, (Text, Picture)):
+                self.overlays.get(record.layer, set()).discard(item_id)
+            self.delete(item_id, record)
+        elif op == "clear":
+            self.overlays.clear()
+            self.canvas.delete(*TAGS.values())
+            self.canvas_ids.clear()
+            self.scene_ids.clear()
+            self.live.clear()
+            self.lod.clear()
+            self.photos.clear()
+            self.committed.clear()
+            self.selected.clear()
+            self.canvas.delete("selection_frame")
+            self.drop_backing()
+        elif op == "layers":
+            self.layers_changed()
+        elif op == "image":
+            self.image_arrived(record)
+
+    def layers_changed(self):
+        scene = self.scene
+        self.hidden = {layer.id for layer in scene.layers if not layer.visible}
+        self.bottom = next((layer.id for layer in scene.layers if layer.visible), None)
+        if self.active_layer not in scene.depth:
+            self.active_layer = scene.layers[-1].id
+        self.refresh()
+
+    def set_active_layer(self, layer_id):
+        """Makes new items go to the given layer; with cache_layers, the others become images."""
+        if layer_id != self.active_layer:
+            self.active_layer = layer_id
+            if self.cache_layers:
+                self.refresh()
+
+    def set_cache_layers(self, cache_layers):
+        if cache_layers != self.cache_layers:
+            self.cache_layers = cache_layers
+            self.refresh()
+
+    def rasterized(self, item_id, record):
+        """Whether the item is drawn into its layer's backing image rather than as a canvas item."""
+        if isinstance(record, (Text, Picture)):
+            return False
+        if item_id not in self.baked and not (self.cache_layers and record.layer != self.active_layer):
+            return False
+        return not self.over_overlay(item_id, record)
+
+    def over_overlay(self, item_id, record):
+        """Whether a text or picture item of the same layer lies under the item."""
+        overlays = self.overlays.get(record.layer)
+        if not overlays:
+            return False
+        order = self.scene.order
+        bbox = self.scene.index.boxes.get(item_id) or record.bbox()
+        return any(other in overlays and order[other] < order[item_id]
+                   for other in self.scene.index.query(*bbox))
+
+    def settle(self, layer_id, bbox, order):
+        """After a text or picture item at the given stacking order came or went,
+        moves the items over it between the backing image and canvas items."""
+        if layer_id in self.hidden or not overlaps(bbox, self.region):
+            return
+        scene = self.scene
+        for item_id in scene.find_overlapping(*bbox, layer_id):
+            record = scene.items[item_id]
+            if (scene.order[item_id] <= order or item_id in self.live or isinstance(record, (Text, Picture))
+                    or not overlaps(scene.index.boxes[item_id], self.region)):
+                continue
+            item = self.canvas_ids.get(item_id)
+            if self.rasterized(item_id, record):
+                if item is None:
+                    continue
+                del self.canvas_ids[item_id]
+                del self.scene_ids[item]
+                self.canvas.delete(item)
+            elif item is None:
+                item = self.draw_item(item_id, record)
+                self.place(item, layer_id)
+                self.restack(item_id, item, record)
+            else:
+                continue
+            self.add_damage(layer_id, scene.index.boxes[item_id])
+
+    def place(self, item, layer_id):
+        """Moves a new canvas item from the top of the display list to the top of its layer."""
+        above = self.above.get(layer_id)
+        if above is not None:
+            self.canvas.tag_lower(item, above)
+
+    def to_world(self, x, y):
+        """World coordinates of a window position (e.g. an event's x, y)."""
+        return (self.view_x + x) / self.zoom, (self.view_y + y) / self.zoom
+
+    def to_canvas(self, *coords):
+        """Canvas coordinates of world coordinates."""
+        zoom = self.zoom
+        return [v * zoom for v in coords]
+
+    def view(self):
+        """The world rectangle shown in the window."""
+        zoom = self.zoom
+        x, y = self.view_x, self.view_y
+        return (x / zoom, y / zoom,
+                (x + self.canvas.winfo_width()) / zoom, (y + self.canvas.winfo_height()) / zoom)
+
+    def cull_region(self):
+        x1, y1, x2, y2 = self.view()
+        mx, my = (x2 - x1) * CULL_MARGIN, (y2 - y1) * CULL_MARGIN
+        return x1 - mx, y1 - my, x2 + mx, y2 + my
+
+    def resized(self, event=None):
+        if not contains(self.region, self.view()):
+            self.refresh()
+
+    def scroll_to(self, x, y):
+        canvas = self.canvas
+        canvas.scan_mark(0, 0)
+        canvas.scan_dragto(round(self.view_x - x), round(self.view_y - y), gain=1)
+        self.view_x, self.view_y = canvas.canvasx(0), canvas.canvasy(0)
+
+    def pan(self, dx, dy):
+        """Moves the drawing by (dx, dy) window pixels."""
+        self.scroll_to(self.view_x - dx, self.view_y - dy)
+        if not contains(self.region, self.view()):
+            self.refresh()
+
+    def zoom_at(self, factor, x, y):
+        """Zooms by factor, keeping the point under window position (x, y) in place."""
+        zoom = min(max(self.zoom * factor, MIN_ZOOM), MAX_ZOOM)
+        if zoom == self.zoom:
+            return
+        wx, wy = self.to_world(x, y)
+        self.zoom = zoom
+        self.scroll_to(wx * zoom - x, wy * zoom - y)
+        self.refresh()
+
+    def refresh(self):
+        """Culls again: recreates the canvas items and backing images of everything in the region."""
+        self.region = self.cull_region()
+        canvas = self.canvas
+        stale = []
+        for item_id, item in list(self.canvas_ids.items()):
+            if item_id not in self.live:
+                del self.canvas_ids[item_id]
+                del self.scene_ids[item]
+                stale.append(item)
+        self.photos.clear()
+        if stale:
+            canvas.delete(*stale)
+        canvas.delete("layer_marker", "backing")
+        self.backings.clear()
+        self.damage.clear()
+
+        scene = self.scene
+        items = scene.items
+        in_region = {layer.id: [] for layer in scene.layers}
+        for item_id in scene.find_overlapping(*self.region):
+            in_region[items[item_id].layer].append(item_id)
+        # layer by layer from the bottom, so everything is created in stacking order
+        self.markers, self.above = {}, {}
+        for layer in scene.layers:
+            self.markers[layer.id] = canvas.create_line(0, 0, 0, 0, state=tk.HIDDEN,
+                                                        tags=("layer_marker", layer_tag(layer.id)))
+            if layer.id in self.hidden:
+                continue
+            ids = in_region[layer.id]
+            self.build_backing(layer.id, [item_id for item_id in ids
+                                          if self.rasterized(item_id, items[item_id])])
+            for item_id in ids:
+                if not self.rasterized(item_id, items[item_id]):
+                    self.draw_item(item_id, items[item_id])
+        for lower, upper in zip(scene.layers, scene.layers[1:]):
+            self.above[lower.id] = self.markers[upper.id]
+
+        for item_id, (sealed, start) in self.live.items():
+            layer_id = items[item_id].layer
+            for item in sealed + [self.canvas_ids[item_id]]:
+                canvas.tag_raise(item)
+                self.place(item, layer_id)
+        self.frame_selection()
+
+    def select(self, ids):
+        """Tags the canvas items of the given scene ids "selected" and frames them.
+
+        Baked items are brought back as canvas items first, so that
+        drag_selection can move the whole selection with one canvas.move.
+        """
+        canvas = self.canvas
+        canvas.dtag("selected", "selected")
+        self.selected = set(ids)
+        self.unbake([item_id for item_id in self.selected if item_id in self.baked])
+        for item_id in self.selected:
+            item = self.canvas_ids.get(item_id)
+            if item is not None:
+                canvas.addtag_withtag("selected", item)
+        self.frame_selection()
+
+    def frame_selection(self):
+        self.canvas.delete("selection_frame")
+        boxes = [self.scene.index.boxes[item_id] for item_id in self.selected
+                 if item_id in self.scene.index]
+        if boxes:
+            x1, y1, x2, y2 = self.to_canvas(*union(boxes))
+            self.canvas.create_rectangle(x1 - 2, y1 - 2, x2 + 2, y2 + 2, outline="#3399ff", dash=(4, 2),
+                                         tags=("selected", "selection_frame"))
+
+    def drag_selection(self, dx, dy):
+        """Moves the selected canvas items by (dx, dy) world pixels; the scene is not touched."""
+        self.canvas.move("selected", dx * self.zoom, dy * self.zoom)
+
+    def unbake(self, ids):
+        now = time.monotonic()
+        for item_id in ids:
+            del self.baked[item_id]
+            self.committed[item_id] = now
+            record = self.scene.items[item_id]
+            bbox = self.scene.index.boxes[item_id]
+            if item_id in self.canvas_ids:
+                continue  # kept over a text or picture
+            if overlaps(bbox, self.region) and record.layer not in self.hidden:
+                self.place(self.draw_item(item_id, record), record.layer)
+            self.add_damage(record.layer, bbox)
+
+    def create(self, item_id, record):
+        if record.layer in self.hidden:
+            return
+        bbox = self.scene.index.boxes.get(item_id) or record.bbox()
+        if not overlaps(bbox, self.region):
+            return  # culled; drawn once the view gets near it
+        if self.rasterized(item_id, record):
+            return  # on a cached layer; painted into its image when committed
+        item = self.draw_item(item_id, record)
+        self.place(item, record.layer)
+        if self.scene.order[item_id] != self.scene.top:
+            self.restack(item_id, item, record)
+            if isinstance(record, (Text, Picture)):
+                self.settle(record.layer, bbox, self.scene.order[item_id])
+        elif isinstance(record, Stroke):
+            self.live[item_id] = [[], 0]
+
+    def restack(self, item_id, item, record):
+        """Puts an item that went back to its old place in the stacking order (undo, a move)
+        under the canvas items stacked above it that it overlaps."""
+        order = self.scene.order
+        above = [other for other in self.scene.find_overlapping(*record.bbox(), record.layer)
+                 if order[other] > order[item_id]]
+        if any(other in self.baked for other in above) and not isinstance(record, (Text, Picture)):
+            # a baked item above it is drawn under every canvas item: bake this one too
+            self.baked[item_id] = None
+            if self.rasterized(item_id, record):
+                self.canvas.delete(item)
+                del self.canvas_ids[item_id]
+                del self.scene_ids[item]
+                self.add_damage(record.layer, record.bbox())
+                return
+        for other in above:
+            other_item = self.canvas_ids.get(other)
+            if other_item is not None:
+                self.canvas.tag_lower(item, other_item)
+                return
+
+    def draw_item(self, item_id, record):
+        canvas = self.canvas
+        zoom = self.zoom
+        tags = (TAGS[type(record)], layer_tag(record.layer))
+        if item_id in self.selected:
+            tags += ("selected",)
+        if isinstance(record, Stroke):
+            item = canvas.create_line(*self.stroke_coords(item_id, record),
+                                      **self.stroke_options(record, tags))
+        elif isinstance(record, Shape):
+            creator = getattr(canvas, "create_" + record.kind)
+            item = creator(*self.scaled(record.coords), outline=record.color,
+                           width=record.width * zoom, tags=tags)
+        elif isinstance(record, Fill):
+            photo, origin = self.fill_photo(record)
+            item = canvas.create_image(*origin, image=photo, anchor=tk.NW, tags=tags)
+            self.photos[item_id] = photo
+        elif isinstance(record, Picture):
+            photo, origin = self.picture_photo(record)
+            if photo is None:
+                item = canvas.create_rectangle(*self.to_canvas(*record.bbox()), outline="gray",
+                                               dash=(4, 4), tags=tags)
+            else:
+                item = canvas.create_image(*origin, image=photo, anchor=tk.NW, tags=tags)
+                self.photos[item_id] = photo
+        else:
+            size = max(1, round(record.size * zoom))
+            font = self.fonts.get(record.family, size) if self.fonts else (record.family, size)
+            item = canvas.create_text(record.x * zoom, record.y * zoom, text=record.text,
+                                      fill=record.color, anchor=tk.NW, font=font, tags=tags)
+        self.canvas_ids[item_id] = item
+        self.scene_ids[item] = item_id
+        return item
+
+    def fill_photo(self, record):
+        """The part of a fill in the region as a transparent PhotoImage, and its canvas origin."""
+        zoom = self.zoom
+        x1, y1, x2, y2 = self.to_canvas(*record.bbox())
+        rx1, ry1, rx2, ry2 = self.to_canvas(*self.region)
+        ox, oy = math.floor(max(x1, rx1)), math.floor(max(y1, ry1))
+        width, height = max(1, math.ceil(min(x2, rx2)) - ox), max(1, math.ceil(min(y2, ry2)) - oy)
+        raster = raster_module.Raster(width, height, None, origin=(ox, oy))
+        raster.draw(record if zoom == 1 else scaled(record, zoom))
+        return tk.PhotoImage(master=self.canvas, data=raster.png(level=0), format="png"), raster.origin
+
+    def picture_photo(self, record):
+        """The PhotoImage of a picture at the zoom, cut to the region, and its canvas origin."""
+        if self.pictures is None:
+            return None, None
+        zoom = self.zoom
+        x, y = round(record.x * zoom), round(record.y * zoom)
+        width, height = max(1, round(record.width * zoom)), max(1, round(record.height * zoom))
+        rx1, ry1, rx2, ry2 = self.to_canvas(*self.region)
+        crop = (max(0, math.floor(rx1) - x), max(0, math.floor(ry1) - y),
+                min(width, math.ceil(rx2) - x), min(height, math.ceil(ry2) - y))
+        if crop[0] >= crop[2] or crop[1] >= crop[3]:
+            return None, None
+        if crop == (0, 0, width, height):
+            crop = None  # all of it: the same PhotoImage serves every view of it at this zoom
+        photo = self.pictures.photo(record.key, width, height, crop)
+        return photo, (x + (crop[0] if crop else 0), y + (crop[1] if crop else 0))
+
+    def image_arrived(self, key):
+        """Shows the pictures of an image that was not known when they were drawn."""
+        items = self.scene.items
+        for item_id in [item_id for item_id in self.canvas_ids
+                        if isinstance(items.get(item_id), Picture) and items[item_id].key == key]:
+            item = self.canvas_ids.pop(item_id)
+            del self.scene_ids[item]
+            new_item = self.draw_item(item_id, items[item_id])
+            self.canvas.tag_raise(new_item, item)
+            self.canvas.delete(item)
+
+    def scaled(self, values):
+        zoom = self.zoom
+        return values if zoom == 1 else [v * zoom for v in values]
+
+    def zoomed_points(self, item_id, record):
+        """The stroke's points in canvas coordinates, at the level of detail of the zoom."""
+        points = record.points
+        if self.zoom <= 0.5 and item_id not in self.live and len(points) > 2 * LOD_MIN_POINTS:
+            level = int(math.log2(1 / self.zoom))
+            levels = self.lod.setdefault(item_id, {})
+            if level not in levels:
+                levels[level] = simplify_polyline(points, LOD_TOLERANCE * 2 ** level)
+            points = levels[level]
+        return self.scaled(points)
+
+    def stroke_coords(self, item_id, record):
+        points = self.zoomed_points(item_id, record)
+        if len(points) == 2:
+            # a one pixel long line with round caps doubles as a dot
+            points = (points[0], points[1], points[0] + 1, points[1])
+        return points
+
+    def stroke_options(self, record, tags=TAGS[Stroke]):
+        return dict(fill=record.color, width=record.width * self.zoom,
+                    capstyle=tk.ROUND, joinstyle=tk.ROUND, smooth=tk.TRUE, tags=tags)
+
+    def extend(self, item_id, record):
+        if item_id not in self.live:
+            return
+        sealed, start = self.live[item_id]
+        item = self.canvas_ids[item_id]
+        points = record.points
+        if len(points) - start > 2 * STROKE_CHUNK:
+            # seal the live segment and continue from its last point
+            sealed.append(item)
+            del self.scene_ids[item]
+            start = len(points) - 4
+            item = self.canvas.create_line(*self.scaled(points[start:]),
+                                           **self.stroke_options(record, (TAGS[Stroke], layer_tag(record.layer))))
+            self.place(item, record.layer)
+            self.live[item_id] = [sealed, start]
+            self.canvas_ids[item_id] = item
+            self.scene_ids[item] = item_id
+        else:
+            self.canvas.coords(item, *self.scaled(points[start:]))
+
+    def commit(self, item_id, record):
+        if record.layer in self.hidden:
+            return
+        if item_id not in self.canvas_ids and self.rasterized(item_id, record):
+            self.add_damage(record.layer, self.scene.index.boxes[item_id])
+            return
+        sealed, start = self.live.pop(item_id, (None, 0))
+        if sealed is not None:
+            # merge the segments; the points may also have been simplified meanwhile
+            self.canvas.delete(*sealed)
+            self.canvas.coords(self.canvas_ids[item_id], *self.stroke_coords(item_id, record))
+        if self.bake_enabled and not isinstance(record, (Text, Picture)):
+            now = time.monotonic()
+            self.committed[item_id] = now
+            if len(self.committed) > BAKE_THRESHOLD:
+                self.bake(list(self.committed)[:-BAKE_KEEP])
+            elif len(self.committed) > BAKE_KEEP and next(iter(self.committed.values())) < now - BAKE_AGE:
+                self.bake([i for i in list(self.committed)[:-BAKE_KEEP]
+                           if self.committed[i] < now - BAKE_AGE])
+
+    def delete(self, item_id, record):
+        self.lod.pop(item_id, None)
+        self.photos.pop(item_id, None)
+        self.committed.pop(item_id, None)
+        self.baked.pop(item_id, None)
+        item = self.canvas_ids.pop(item_id, None)
+        if item is None:
+            # culled, or drawn into its layer's backing image
+            if record.layer not in self.hidden:
+                self.add_damage(record.layer, record.bbox())
+        else:
+            del self.scene_ids[item]
+            sealed, start = self.live.pop(item_id, (None, 0))
+            if sealed:
+                self.canvas.delete(*sealed)
+            self.canvas.delete(item)
+        if isinstance(record, (Text, Picture)):
+            self.settle(record.layer, record.bbox(), self.scene.order[item_id])
+
+    def bake(self, ids):
+        """Moves the given committed items from canvas items into the backing image."""
+        ids = [item_id for item_id in ids if item_id not in self.selected]
+        if not ids:
+            return
+        drawn = {}  # layer id -> ids that had canvas items
+        items = []
+        for item_id in ids:
+            self.committed.pop(item_id, None)
+            self.baked[item_id] = None
+            if not self.rasterized(item_id, self.scene.items[item_id]):
+                continue  # over a text or picture: stays a canvas item
+            item = self.canvas_ids.pop(item_id, None)
+            if item is not None:
+                del self.scene_ids[item]
+                items.append(item)
+                drawn.setdefault(self.scene.items[item_id].layer, []).append(item_id)
+        if items:
+            self.canvas.delete(*items)
+        for layer_id, layer_ids in drawn.items():
+            backing = self.backings.get(layer_id)
+            if backing is None:
+                self.build_backing(layer_id)
+            else:
+                backing.raster.draw_all(self.canvas_record(item_id) for item_id in layer_ids)
+                self.show_backing(layer_id)
+
+    def canvas_record(self, item_id):
+        """The record in canvas coordinates, for rasterizing."""
+        record = self.scene.items[item_id]
+        if self.zoom == 1:
+            return record
+        if isinstance(record, Stroke):
+            copy = Stroke((), record.color, record.width * self.zoom)
+            copy.points = self.zoomed_points(item_id, record)
+            return copy
+        return scaled(record, self.zoom)
+
+    def rasterized_in(self, layer_id, x1, y1, x2, y2):
+        items = self.scene.items
+        return [item_id for item_id in self.scene.find_overlapping(x1, y1, x2, y2, layer_id)
+                if self.rasterized(item_id, items[item_id])]
+
+    def build_backing(self, layer_id, ids=None):
+        """Rasterizes the layer's rasterized items in the region into a new backing image.
+
+        ids, when known, are those items in stacking order.
+        """
+        x1, y1, x2, y2 = self.region
+        if ids is None:
+            ids = self.rasterized_in(layer_id, x1, y1, x2, y2)
+        if not ids:
+            self.hide_backing(layer_id)
+            return
+        zoom = self.zoom
+        ox, oy = math.floor(x1 * zoom) - 1, math.floor(y1 * zoom) - 1
+        # only the lowest visible layer may cover the canvas; the others need transparency
+        background = self.canvas.cget("bg") if layer_id == self.bottom else None
+        backing = self.backings.setdefault(layer_id, Backing())
+        backing.raster = raster_module.Raster(math.ceil(x2 * zoom) + 2 - ox, math.ceil(y2 * zoom) + 2 - oy,
+                                              background, origin=(ox, oy))
+        backing.raster.draw_all(self.canvas_record(item_id) for item_id in ids)
+        self.show_backing(layer_id)
+
+    def add_damage(self, layer_id, bbox):
+        if not overlaps(bbox, self.region):
+            return
+        if not self.damage:
+            self.canvas.after_idle(self.repaint)
+        old = self.damage.get(layer_id)
+        self.damage[layer_id] = bbox if old is None else union((old, bbox))
+
+    def repaint(self):
+        """Redraws the damaged parts of the backing images after their items changed."""
+        damage, self.damage = self.damage, {}
+        for layer_id, (x1, y1, x2, y2) in damage.items():
+            if layer_id in self.hidden or layer_id not in self.scene.depth:
+                continue
+            backing = self.backings.get(layer_id)
+            if backing is None:
+                self.build_backing(layer_id)
+                continue
+            raster = backing.raster
+            raster.clip = self.to_canvas(x1, y1, x2, y2)
+            raster.clear(*raster.clip)
+            raster.draw_all(self.canvas_record(item_id)
+                            for item_id in self.rasterized_in(layer_id, x1, y1, x2, y2))
+            raster.clip = None
+            self.show_backing(layer_id)
+
+    def show_backing(self, layer_id):
+        backing = self.backings[layer_id]
+        raster = backing.raster
+        if raster.channels == 3:
+            backing.photo = tk.PhotoImage(master=self.canvas, data=raster.ppm(), format="ppm")
+        else:
+            backing.photo = tk.PhotoImage(master=self.canvas, data=raster.png(level=0), format="png")
+        if backing.item is None:
+            backing.item = self.canvas.create_image(*raster.origin, anchor=tk.NW, image=backing.photo,
+                                                    tags=("backing", layer_tag(layer_id)))
+            self.canvas.tag_raise(backing.item, self.markers[layer_id])
+        else:
+            self.canvas.coords(backing.item, *raster.origin)
+            self.canvas.itemconfig(backing.item, image=backing.photo)
+
+    def hide_backing(self, layer_id):
+        backing = self.backings.pop(layer_id, None)
+        if backing is not None and backing.item is not None:
+            self.canvas.delete(backing.item)
+        self.damage.pop(layer_id, None)
+
+    def drop_backing(self):
+        for layer_id in list(self.backings):
+            self.hide_backing(layer_id)
+        self.baked.clear()
+
+
+def layer_tag(layer_id):
+    return f"layer{layer_id}"
+
+
+def union(boxes):
+    x1s, y1s, x2s, y2s = zip(*boxes)
+    return min(x1s), min(y1s), max(x2s), max(y2s)
+
+
+def overlaps(a, b):
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+def contains(outer, inner):
+    return (outer[0] <= inner[0] and outer[1] <= inner[1]
+            and outer[2] >= inner[2] and outer[3] >= inner[3])
@@ -0,0 +1,279 @@
+"""Records Humming Paint sessions and replays them against the app.
+
+Record a session by starting the app with HUMMING_PAINT_RECORD set:
+
+    HUMMING_PAINT_RECORD=session.trace python code.py
+
+Then replay it, as fast as possible or at the speed it was recorded:
+
+    python replay.py session.trace [--speed max|recorded] [--json results.json]
+
+Recording starts once the last session has been restored. A trace is JSON
+lines: a header with the settings and the drawing at that point (layers,
+images and items as base64 autosave journal entries) that a replay starts
+from, then every UI entry point Tk called (see code.ui_entry) with its
+arguments and start time, and the answers given to the simpledialog,
+colorchooser and filedialog prompts, which are fed back in order during
+replay. The bytes of every file opened are in the trace too; a replay opens
+copies of them and saves into a temporary directory. Frame flushes and the
+chunks of a drawing being opened are recorded as flush_points and
+load_chunk calls and replayed at the same place in the event stream instead
+of from a timer, so a replay always ends in the same scene; the scene digest
+in the report shows that. The report
+gives the total time and the time spent in each handler, and in Tk redrawing
+the canvas, so one trace can be compared across versions.
+"""
+import argparse
+import atexit
+import base64
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+import zlib
+
+import journal
+
+TRACE_VERSION = 1
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "code.py")
+DIALOGS = {"simpledialog": ("askstring", "askinteger"), "colorchooser": ("askcolor",),
+           "filedialog": ("askopenfilename", "asksaveasfilename")}
+MESSAGES = {"messagebox": ("showinfo", "showerror")}  # no answer to record; replay keeps them quiet
+
+
+def encode_arg(value):
+    if hasattr(value, "x") and hasattr(value, "y"):
+        # a Tk event; state holds the modifier keys
+        return {"x": value.x, "y": value.y, "state": getattr(value, "state", 0)}
+    return value
+
+
+class Recorder:
+    """Appends every top-level UI entry point call of the app to a trace file."""
+
+    def __init__(self, app, path):
+        self.app = app
+        self.path = path
+        self.file = None
+        self.t0 = None
+
+    def start(self):
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.t0 = time.perf_counter()
+        self.write({"version": TRACE_VERSION, "mode": self.app.current_mode,
+                    "width": self.app.current_width, "color": self.app.current_color,
+                    "font_size": self.app.current_font_size, "background": self.app.canvas_bg_color,
+                    "layer": self.app.active_layer, "scene": encode_scene(self.app.scene)})
+        for module, names in DIALOGS.items():
+            real = getattr(self.app, module)
+            setattr(self.app, module, types.SimpleNamespace(
+                **{name: self.dialog(name, getattr(real, name)) for name in names}))
+        self.app.entry_hooks.append(self.hook)
+        atexit.register(self.close)
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry, separators=(",", ":")))
+        self.file.write("\n")
+
+    def hook(self, name, args, start, seconds, depth):
+        if depth == 0:
+            self.write({"t": round(start - self.t0, 6), "call": name,
+                        "args": [encode_arg(arg) for arg in args]})
+
+    def dialog(self, name, ask):
+        def answer(*args, **kwargs):
+            result = ask(*args, **kwargs)
+            entry = {"t": round(time.perf_counter() - self.t0, 6), "dialog": name, "result": result}
+            if name == "askopenfilename" and result:
+                # the replay may run where the file is not, or has changed since
+                try:
+                    with open(result, "rb") as f:
+                        entry["data"] = base64.b64encode(f.read()).decode("ascii")
+                except OSError:
+                    pass
+            self.write(entry)
+            return result
+        return answer
+
+    def close(self):
+        if self.file:
+            self.app.entry_hooks.remove(self.hook)
+            self.file.close()
+            self.file = None
+
+
+def encode_scene(scene):
+    """The scene's layers, images and items as base64 autosave journal entries."""
+    data = bytearray(journal.encode(journal.LAYERS, 0, scene.layers))
+    for image in scene.images.values():
+        data += journal.encode(journal.IMAGE, 0, image)
+    for item_id, record in scene:
+        data += journal.encode(journal.ADD, item_id, record, scene.order[item_id])
+    return base64.b64encode(data).decode("ascii")
+
+
+def load_scene(app, header):
+    """Puts the drawing a trace was recorded on into the app's (empty) scene."""
+    scene = app.scene
+    with app.history.untracked():
+        for op, item_id, record, order in journal.read_entries(base64.b64decode(header.get("scene", ""))):
+            if op == journal.LAYERS:
+                scene.set_layers(record)
+            elif op == journal.IMAGE:
+                scene.add_image(record)
+            elif op == journal.ADD:
+                scene.insert(item_id, record, order)
+    app.canvas_bg_color = header.get("background", "white")
+    app.canvas.config(bg=app.canvas_bg_color)
+    app.select_layer(header.get("layer", scene.layers[-1].id))
+
+
+def read_trace(path):
+    with open(path, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    if not entries or entries[0].get("version") != TRACE_VERSION:
+        raise ValueError(f"{path}: not a version {TRACE_VERSION} trace")
+    return entries[0], entries[1:]
+
+
+def load_app(path=APP_PATH):
+    """Imports code.py as a module; its window is created but no session is restored."""
+    spec = importlib.util.spec_from_file_location("humming_paint", path)
+    app = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = app
+    spec.loader.exec_module(app)
+    return app
+
+
+def scene_digest(scene):
+    """CRC32 of the scene contents, to check that two replays drew the same thing."""
+    crc = 0
+    for item_id, record in scene:
+        crc = zlib.crc32(journal.encode(journal.ADD, item_id, record), crc)
+    return f"{crc:08x}"
+
+
+class Timings:
+
+    def __init__(self):
+        self.handlers = {}  # name -> [calls, seconds, max seconds]
+
+    def add(self, name, seconds):
+        stats = self.handlers.setdefault(name, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+    def hook(self, name, args, start, seconds, depth):
+        # nested calls (stop_draw flushing its points) count for both handlers
+        self.add(name, seconds)
+
+
+def file_answer(entry, directory):
+    """The answer to replay for a file dialog: a path in directory, never the recorded one.
+
+    An opened file is written there from the bytes in the trace, and saving
+    goes there too, so a replay neither needs nor overwrites the original files.
+    """
+    path = entry["result"]
+    if not path:
+        return path
+    local = os.path.join(directory, os.path.basename(path))
+    if "data" in entry:
+        with open(local, "wb") as f:
+            f.write(base64.b64decode(entry["data"]))
+    return local
+
+
+def replay(app, header, entries, speed="max"):
+    """Feeds the trace to the app's handlers; returns the results as a dict."""
+    answers = []
+    for module, names in DIALOGS.items():
+        setattr(app, module, types.SimpleNamespace(
+            **{name: lambda *args, **kwargs: answers.pop(0) for name in names}))
+    for module, names in MESSAGES.items():
+        setattr(app, module, types.SimpleNamespace(**{name: lambda *args, **kwargs: "ok" for name in names}))
+    files = tempfile.TemporaryDirectory(prefix="replay-", ignore_cleanup_errors=True)
+    # start from the state the recording started in
+    app.current_color = header["color"]
+    app.current_font_size = header["font_size"]
+    app.set_width(header["width"])
+    app.activate_mode(header["mode"])
+    load_scene(app, header)
+    app.root.update()  # map the window so the canvas has its size
+
+    timings = Timings()
+    app.entry_hooks.append(timings.hook)
+    canvas = app.canvas
+    start = time.perf_counter()
+    try:
+        for entry in entries:
+            if speed == "recorded":
+                delay = start + entry["t"] - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if "dialog" in entry:
+                if entry["dialog"] in DIALOGS["filedialog"]:
+                    answers.append(file_answer(entry, files.name))
+                else:
+                    answers.append(entry["result"])
+                continue
+            args = [types.SimpleNamespace(widget=canvas, **arg) if isinstance(arg, dict) else arg
+                    for arg in entry["args"]]
+            getattr(app, entry["call"])(*args)
+            if app.frame_job is not None:
+                # the trace says when frames were flushed, not the timer
+                canvas.after_cancel(app.frame_job)
+            redraw = time.perf_counter()
+            app.root.update_idletasks()
+            timings.add("(redraw)", time.perf_counter() - redraw)
+    finally:
+        app.entry_hooks.remove(timings.hook)
+        files.cleanup()
+    total = time.perf_counter() - start
+    return {
+        "total": total,
+        "events": sum(1 for entry in entries if "call" in entry),
+        "items": len(app.scene),
+        "digest": scene_digest(app.scene),
+        "handlers": {name: {"calls": calls, "total": seconds, "max": longest}
+                     for name, (calls, seconds, longest) in timings.handlers.items()},
+    }
+
+
+def print_report(results):
+    print(f"{results['events']} events replayed in {results['total'] * 1000:.1f} ms; "
+          f"{results['items']} items, scene digest {results['digest']}")
+    print(f"{'handler':<16}{'calls':>8}{'total ms':>12}{'mean ms':>10}{'max ms':>10}")
+    handlers = sorted(results["handlers"].items(), key=lambda item: -item[1]["total"])
+    for name, stats in handlers:
+        print(f"{name:<16}{stats['calls']:>8}{stats['total'] * 1000:>12.1f}"
+              f"{stats['total'] * 1000 / stats['calls']:>10.3f}{stats['max'] * 1000:>10.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded Humming Paint session.")
+    parser.add_argument("trace")
+    parser.add_argument("--speed", choices=("max", "recorded"), default="max")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args(argv)
+    try:
+        header, entries = read_trace(args.trace)
+    except (OSError, ValueError) as e:
+        print(f"error {e}", file=sys.stderr)
+        return 1
+    app = load_app()
+    results = replay(app, header, entries, args.speed)
+    app.root.destroy()
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
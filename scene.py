@@ -0,0 +1,572 @@
+"""Headless document model for Humming Paint.
+
+The scene holds the picture as small records (strokes, shapes, text, fills,
+pictures) and is the source of truth; the Tk canvas is only a view of it. Nothing in
+here imports tkinter, so scenes can be built, tested, saved and rendered
+without a display.
+
+Every change is reported to the scene's listeners as ``listener(op, item_id,
+record)`` where op is one of:
+
+    "add"     a new item (a stroke may still be growing)
+    "extend"  points were appended to a live stroke
+    "commit"  the item is finished
+    "remove"  the item was deleted (record is the removed record)
+    "clear"   everything was deleted (record is the old {id: record} dict)
+    "layers"  the layer list or a layer's settings changed (item_id is None,
+              record is the scene's layer list)
+    "image"   an image was added to scene.images (item_id is None, record is
+              its key)
+
+Every record belongs to one layer (record.layer is a Layer id). The items of
+a lower layer are always drawn below those of a higher one; within a layer
+they stack in the order they were added.
+
+Imported images are kept once each, encoded as they were read, in
+scene.images under a key made from their bytes; Picture records only refer
+to them by that key, so stamping an image many times stores it once.
+"""
+import hashlib
+import math
+from array import array
+
+from spatial import GridIndex
+
+np = False  # NumPy once numpy() has imported it, None when it is not installed
+
+
+MAX_LAYERS = 256  # what the file format can address
+
+
+class Layer:
+    """A named group of items. Hidden layers are not drawn, locked ones not edited."""
+    __slots__ = ("id", "name", "visible", "locked")
+
+    def __init__(self, id, name, visible=True, locked=False):
+        self.id = id
+        self.name = name
+        self.visible = visible
+        self.locked = locked
+
+    def copy(self):
+        return Layer(self.id, self.name, self.visible, self.locked)
+
+
+class Stroke:
+    """A freehand polyline. points is a flat x, y array."""
+    __slots__ = ("points", "color", "width", "layer")
+
+    def __init__(self, points, color, width, layer=0):
+        self.points = array("f", points)
+        self.color = color
+        self.width = width
+        self.layer = layer
+
+    def bbox(self):
+        pad = self.width / 2
+        xs, ys = self.points[0::2], self.points[1::2]
+        return min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad
+
+
+class Shape:
+    """An outlined rectangle or oval; kind is the canvas item type."""
+    __slots__ = ("kind", "coords", "color", "width", "layer")
+
+    def __init__(self, kind, coords, color, width, layer=0):
+        self.kind = kind
+        self.coords = array("f", coords)
+        self.color = color
+        self.width = width
+        self.layer = layer
+
+    def bbox(self):
+        pad = self.width / 2
+        x1, y1, x2, y2 = self.coords
+        return min(x1, x2) - pad, min(y1, y2) - pad, max(x1, x2) + pad, max(y1, y2) + pad
+
+
+class Text:
+    """A text label anchored at its top-left corner."""
+    __slots__ = ("x", "y", "text", "color", "family", "size", "layer")
+
+    def __init__(self, x, y, text, color, family, size, layer=0):
+        self.x = x
+        self.y = y
+        self.text = text
+        self.color = color
+        self.family = family
+        self.size = size
+        self.layer = layer
+
+    def bbox(self):
+        width, height = text_extent(self.text, self.family, self.size)
+        return self.x, self.y, self.x + width, self.y + height
+
+
+def rough_text_extent(text, family, size):
+    """(width, height) of text without font metrics: the average glyph is ~0.6em wide."""
+    lines = text.split("\n")
+    return max(len(line) for line in lines) * size * 0.6, len(lines) * size * 1.5
+
+
+text_extent = rough_text_extent
+
+
+def set_text_extent(extent):
+    """Makes Text.bbox measure text with extent(text, family, size) -> (width, height).
+
+    The GUI passes real font metrics (fonts.FontCache.extent); call it before adding text.
+    """
+    global text_extent
+    text_extent = extent
+
+
+class Fill:
+    """An area painted by the bucket tool, as (row, first, last) spans of square cells.
+
+    Cell (column, row) has side cell and is centered on (x + column * cell,
+    y + row * cell); spans is a flat array of the filled cell ranges.
+    """
+    __slots__ = ("x", "y", "cell", "spans", "color", "layer")
+
+    def __init__(self, x, y, cell, spans, color, layer=0):
+        self.x = x
+        self.y = y
+        self.cell = cell
+        self.spans = array("f", spans)
+        self.color = color
+        self.layer = layer
+
+    def bbox(self):
+        rows, firsts, lasts = self.spans[0::3], self.spans[1::3], self.spans[2::3]
+        cell, half = self.cell, self.cell / 2
+        return (self.x + min(firsts) * cell - half, self.y + min(rows) * cell - half,
+                self.x + max(lasts) * cell + half, self.y + max(rows) * cell + half)
+
+
+class Picture:
+    """An image from scene.images (by key) drawn into the rectangle x, y, width, height."""
+    __slots__ = ("x", "y", "width", "height", "key", "layer")
+
+    def __init__(self, x, y, width, height, key, layer=0):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.key = key
+        self.layer = layer
+
+    def bbox(self):
+        return self.x, self.y, self.x + self.width, self.y + self.height
+
+
+def image_key(data):
+    """The key an image's encoded bytes are kept under."""
+    return hashlib.sha1(data).hexdigest()[:20]
+
+
+class Scene:
+
+    def __init__(self):
+        self.items = {}  # id -> record, in stacking order
+        self.images = {}  # image key -> encoded image bytes, for Picture records
+        self.next_id = 1
+        self.listeners = []
+        self.index = GridIndex()  # bounding boxes of the committed items
+        self.order = {}  # id -> position in the stacking order, for sorting
+        self.top = 0
+        self.layers = [Layer(0, "Layer 1")]  # bottom to top
+        self.depth = {0: 0}  # layer id -> position in self.layers
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        """(id, record) pairs in stacking order (within a layer; save files keep the layer apart)."""
+        items = self.items
+        return ((item_id, items[item_id]) for item_id in sorted(items, key=self.order.__getitem__))
+
+    def notify(self, op, item_id, record):
+        for listener in self.listeners:
+            listener(op, item_id, record)
+
+    def add(self, record, live=False):
+        """Adds a record and returns its id. Live strokes are committed later."""
+        item_id = self.next_id
+        self.next_id += 1
+        self.adopt(record)
+        self.items[item_id] = record
+        self.stack(item_id)
+        if not live:
+            self.index.insert(item_id, record.bbox())
+        self.notify("add", item_id, record)
+        if not live:
+            self.notify("commit", item_id, record)
+        return item_id
+
+    def insert(self, item_id, record, order=None):
+        """Puts a record back under a known id (undo/redo, loading).
+
+        order is its old place in the stacking order (see self.order), so
+        undo and moves put it back where it was; by default it goes on top.
+        """
+        self.adopt(record)
+        self.items[item_id] = record
+        self.next_id = max(self.next_id, item_id + 1)
+        if order is None:
+            self.stack(item_id)
+        else:
+            self.order[item_id] = order
+            self.top = max(self.top, order)
+        self.index.insert(item_id, record.bbox())
+        self.notify("add", item_id, record)
+        self.notify("commit", item_id, record)
+
+    def stack(self, item_id):
+        self.top += 1
+        self.order[item_id] = self.top
+
+    def adopt(self, record):
+        # items of a deleted layer (e.g. brought back by undo) go to the bottom layer
+        if record.layer not in self.depth:
+            record.layer = self.layers[0].id
+
+    def stacking_key(self, item_id):
+        return self.depth[self.items[item_id].layer], self.order[item_id]
+
+    def layer(self, layer_id):
+        return self.layers[self.depth[layer_id]]
+
+    def layer_items(self, layer_id):
+        return [item_id for item_id, record in self.items.items() if record.layer == layer_id]
+
+    def editable(self, layer_id):
+        layer = self.layer(layer_id)
+        return layer.visible and not layer.locked
+
+    def set_layers(self, layers):
+        """Replaces the layer list (e.g. when loading); items must not refer to others."""
+        self.layers = list(layers)
+        self.layers_changed()
+
+    def add_layer(self, name=None):
+        """Adds an empty layer on top and returns it, or None when there are MAX_LAYERS."""
+        if len(self.layers) >= MAX_LAYERS:
+            return None
+        layer_id = max(self.depth) + 1
+        layer = Layer(layer_id, name or f"Layer {len(self.layers) + 1}")
+        self.layers.append(layer)
+        self.layers_changed()
+        return layer
+
+    def remove_layer(self, layer_id):
+        """Deletes a layer and its items; the last layer cannot be deleted."""
+        if len(self.layers) == 1:
+            raise ValueError("cannot delete the only layer")
+        for item_id in self.layer_items(layer_id):
+            self.remove(item_id)
+        del self.layers[self.depth[layer_id]]
+        self.layers_changed()
+
+    def move_layer(self, layer_id, steps):
+        """Moves a layer up (steps > 0) or down the stack."""
+        position = self.depth[layer_id]
+        target = min(max(position + steps, 0), len(self.layers) - 1)
+        if target != position:
+            self.layers.insert(target, self.layers.pop(position))
+            self.layers_changed()
+
+    def update_layer(self, layer_id, **settings):
+        """Changes a layer's name, visible or locked setting."""
+        layer = self.layer(layer_id)
+        for name, value in settings.items():
+            setattr(layer, name, value)
+        self.layers_changed()
+
+    def layers_changed(self):
+        self.depth = {layer.id: position for position, layer in enumerate(self.layers)}
+        self.notify("layers", None, self.layers)
+
+    def add_image(self, data):
+        """Keeps an encoded image (once) and returns its key for Picture records."""
+        key = image_key(data)
+        if key not in self.images:
+            self.images[key] = bytes(data)
+            self.notify("image", None, key)
+        return key
+
+    def extend(self, item_id, *points):
+        record = self.items[item_id]
+        record.points.extend(points)
+        self.notify("extend", item_id, record)
+
+    def simplify(self, item_id, tolerance):
+        """Simplifies a live stroke before it is committed (see simplify_polyline)."""
+        record = self.items[item_id]
+        record.points = array("f", simplify_polyline(record.points, tolerance))
+
+    def commit(self, item_id):
+        record = self.items[item_id]
+        self.index.insert(item_id, record.bbox())
+        self.notify("commit", item_id, record)
+
+    def remove(self, item_id):
+        # the listeners can still look up the item's self.order (history keeps it for undo)
+        record = self.items.pop(item_id)
+        self.index.remove(item_id)
+        self.notify("remove", item_id, record)
+        del self.order[item_id]
+        return record
+
+    def clear(self):
+        old, self.items = self.items, {}
+        self.index.clear()
+        self.notify("clear", None, old)
+        self.order = {}
+
+    def find_overlapping(self, x1, y1, x2, y2, layer=None):
+        """Ids of committed items whose bounding box touches the rectangle, bottom first.
+
+        With layer given, only the items of that layer.
+        """
+        found = self.index.query(x1, y1, x2, y2)
+        if layer is not None:
+            items = self.items
+            found = [item_id for item_id in found if items[item_id].layer == layer]
+            return sorted(found, key=self.order.__getitem__)
+        if len(self.layers) == 1:
+            return sorted(found, key=self.order.__getitem__)
+        return sorted(found, key=self.stacking_key)
+
+    def find_enclosed(self, x1, y1, x2, y2, layer=None):
+        """Ids of committed items lying wholly inside the rectangle, bottom first."""
+        boxes = self.index.boxes
+        found = []
+        for item_id in self.find_overlapping(x1, y1, x2, y2, layer):
+            bx1, by1, bx2, by2 = boxes[item_id]
+            if bx1 >= x1 and by1 >= y1 and bx2 <= x2 and by2 <= y2:
+                found.append(item_id)
+        return found
+
+    def find_at(self, x, y, r, layer=None):
+        """The topmost committed item within r of (x, y), or None.
+
+        Strokes are hit along their path, the others anywhere in their box.
+        """
+        for item_id in reversed(self.find_overlapping(x - r, y - r, x + r, y + r, layer)):
+            record = self.items[item_id]
+            if not isinstance(record, Stroke):
+                return item_id
+            points = record.points.tolist()
+            if len(points) == 2:
+                points *= 2
+            if split_polyline(points, x, y, r + record.width / 2) is not None:
+                return item_id
+        return None
+
+    def move(self, ids, dx, dy):
+        """Moves the items by (dx, dy). Each is replaced by a moved copy under the same id."""
+        self.replace(ids, lambda record: translated(record, dx, dy))
+
+    def recolor(self, ids, color):
+        """Gives the items color; pictures and items that already have it are left alone."""
+        items = self.items
+        self.replace([item_id for item_id in ids if getattr(items[item_id], "color", color) != color],
+                     lambda record: recolored(record, color))
+
+    def replace(self, ids, change):
+        # remove and insert, so undo and the autosave journal see plain removals and additions;
+        # each copy keeps the original's place in the stacking order
+        for item_id in sorted(ids, key=self.stacking_key):
+            order = self.order[item_id]
+            self.insert(item_id, change(self.remove(item_id)), order)
+
+    def erase(self, x0, y0, x1, y1, r, candidates=None, layer=None):
+        """Erases along the segment (x0, y0)-(x1, y1) with an eraser of radius r.
+
+        Strokes are split around the eraser, the other items are removed whole.
+        candidates limits the search to the given ids (e.g. from a canvas
+        hit-test); by default the scene is searched itself, or only the given
+        layer.
+        """
+        if candidates is None:
+            candidates = self.find_overlapping(min(x0, x1) - r, min(y0, y1) - r,
+                                               max(x0, x1) + r, max(y0, y1) + r, layer)
+        steps = max(1, int(math.hypot(x1 - x0, y1 - y0) / r))
+        centers = [(x0 + (x1 - x0) * i / steps, y0 + (y1 - y0) * i / steps)
+                   for i in range(steps + 1)]
+
+        for item_id in candidates:
+            record = self.items.get(item_id)
+            if record is None:
+                continue
+            if not isinstance(record, Stroke):
+                self.remove(item_id)
+                continue
+            reach = r + record.width / 2
+            points = record.points.tolist()
+            if len(points) == 2:
+                points *= 2  # a single dot is a zero-length segment
+            pieces = [points]
+            touched = False
+            for cx, cy in centers:
+                next_pieces = []
+                for piece in pieces:
+                    cut = split_polyline(piece, cx, cy, reach)
+                    if cut is None:
+                        next_pieces.append(piece)
+                    else:
+                        touched = True
+                        next_pieces.extend(cut)
+                pieces = next_pieces
+            if touched:
+                # the pieces share the stroke's place in the stacking order
+                order = self.order[item_id]
+                self.remove(item_id)
+                for piece in pieces:
+                    self.insert(self.next_id, Stroke(piece, record.color, record.width, record.layer), order)
+
+
+def translated(record, dx, dy):
+    if isinstance(record, Picture):
+        return Picture(record.x + dx, record.y + dy, record.width, record.height, record.key, record.layer)
+    if isinstance(record, Fill):
+        return Fill(record.x + dx, record.y + dy, record.cell, record.spans, record.color, record.layer)
+    if isinstance(record, Text):
+        return Text(record.x + dx, record.y + dy, record.text, record.color, record.family, record.size,
+                    record.layer)
+    coords = array("f", record.points if isinstance(record, Stroke) else record.coords)
+    coords[0::2] = array("f", [x + dx for x in coords[0::2]])
+    coords[1::2] = array("f", [y + dy for y in coords[1::2]])
+    if isinstance(record, Stroke):
+        return Stroke(coords, record.color, record.width, record.layer)
+    return Shape(record.kind, coords, record.color, record.width, record.layer)
+
+
+def recolored(record, color):
+    if isinstance(record, Picture):
+        return Picture(record.x, record.y, record.width, record.height, record.key, record.layer)
+    if isinstance(record, Fill):
+        return Fill(record.x, record.y, record.cell, record.spans, color, record.layer)
+    if isinstance(record, Text):
+        return Text(record.x, record.y, record.text, color, record.family, record.size, record.layer)
+    if isinstance(record, Stroke):
+        return Stroke(record.points, color, record.width, record.layer)
+    return Shape(record.kind, record.coords, color, record.width, record.layer)
+
+
+def scaled(record, factor):
+    """A copy of the record with all its coordinates and sizes multiplied by factor."""
+    if isinstance(record, Picture):
+        return Picture(record.x * factor, record.y * factor, record.width * factor, record.height * factor,
+                       record.key, record.layer)
+    if isinstance(record, Fill):
+        return Fill(record.x * factor, record.y * factor, record.cell * factor, record.spans,
+                    record.color, record.layer)
+    if isinstance(record, Text):
+        return Text(record.x * factor, record.y * factor, record.text, record.color, record.family,
+                    record.size * factor, record.layer)
+    if isinstance(record, Stroke):
+        copy = Stroke((), record.color, record.width * factor, record.layer)
+        copy.points = array("f", [v * factor for v in record.points])
+        return copy
+    return Shape(record.kind, [v * factor for v in record.coords], record.color, record.width * factor,
+                 record.layer)
+
+
+def split_polyline(points, cx, cy, r):
+    """Cuts the circle (cx, cy, r) out of a flat x/y point list.
+
+    Returns the remaining pieces (each at least two points long), or None when
+    the circle does not touch the polyline at all.
+    """
+    pieces, piece = [], []
+    touched = False
+    r2 = r * r
+    for i in range(0, len(points) - 2, 2):
+        x0, y0, x1, y1 = points[i:i + 4]
+        dx, dy = x1 - x0, y1 - y0
+        fx, fy = x0 - cx, y0 - cy
+        a = dx * dx + dy * dy
+        c = fx * fx + fy * fy - r2
+        t0, t1 = 1.0, 0.0
+        if a:
+            b = 2 * (fx * dx + fy * dy)
+            disc = b * b - 4 * a * c
+            if disc > 0:
+                root_disc = math.sqrt(disc)
+                t0, t1 = (-b - root_disc) / (2 * a), (-b + root_disc) / (2 * a)
+        elif c <= 0:
+            t0, t1 = 0.0, 1.0
+
+        if t1 <= 0 or t0 >= 1:
+            piece = piece or [x0, y0]
+            piece += [x1, y1]
+            continue
+        touched = True
+        if t0 > 0:
+            piece = piece or [x0, y0]
+            piece += [x0 + dx * t0, y0 + dy * t0]
+        if len(piece) >= 4:
+            pieces.append(piece)
+        piece = [x0 + dx * t1, y0 + dy * t1, x1, y1] if t1 < 1 else []
+    if len(piece) >= 4:
+        pieces.append(piece)
+    return pieces if touched else None
+
+
+def numpy():
+    """NumPy or None, imported on first use: it takes longer than the rest of the app's startup."""
+    global np
+    if np is False:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        np = module
+    return np
+
+
+def simplify_polyline(points, tolerance):
+    """Ramer-Douglas-Peucker: drops points closer than tolerance to the simplified line.
+
+    Takes and returns a flat x/y sequence; the end points are always kept.
+    """
+    n = len(points) // 2
+    if n < 3 or tolerance <= 0:
+        return points
+    keep = bytearray(n)
+    keep[0] = keep[-1] = 1
+    np = numpy()
+    if np is not None:
+        xy = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        if np is not None:
+            chord = xy[last] - xy[first]
+            rel = xy[first + 1:last] - xy[first]
+            length = math.hypot(*chord)
+            if length:
+                dist = np.abs(rel[:, 0] * chord[1] - rel[:, 1] * chord[0]) / length
+            else:
+                dist = np.hypot(rel[:, 0], rel[:, 1])
+            index = int(np.argmax(dist))
+            farthest, distance = first + 1 + index, dist[index]
+        else:
+            x0, y0 = points[2 * first], points[2 * first + 1]
+            cx, cy = points[2 * last] - x0, points[2 * last + 1] - y0
+            length = math.hypot(cx, cy)
+            farthest, distance = first, -1.0
+            for i in range(first + 1, last):
+                rx, ry = points[2 * i] - x0, points[2 * i + 1] - y0
+                d = abs(rx * cy - ry * cx) / length if length else math.hypot(rx, ry)
+                if d > distance:
+                    farthest, distance = i, d
+        if distance > tolerance:
+            keep[farthest] = 1
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [v for i in range(n) if keep[i] for v in (points[2 * i], points[2 * i + 1])]
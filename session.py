@@ -0,0 +1,521 @@
+"""Live shared drawing sessions over asyncio, on one machine or a LAN.
+
+    python session.py serve [--host HOST] [--port PORT]
+    HUMMING_PAINT_SESSION=HOST:PORT python code.py
+    python session.py bench [--clients N] [--strokes N] [--points N]
+
+The server keeps the board (the last ADD of every item that is still there,
+and every image shared) and relays every committed operation of a client to
+all the others. A client that joins gets the board first, then shares what
+it has drawn itself.
+"bench" starts a server and many simulated clients in one process, has every
+client draw, and reports how fast the strokes reached everybody.
+
+A message is a u32 length and a payload: op, owner, item, then for ADD the
+record. owner is the client that created the item and item its id in that
+client's scene, so every client can map an item to its own ids; clients
+send owner 0 for their own items and the server fills in their client id.
+The server relays the bytes as they are. Coordinates go as zigzag varint
+deltas from the previous point in 1/QUANTUM px, so a pencil point a few
+pixels from the last one takes 2 bytes instead of 8; coordinates that are
+not exact in 1/QUANTUM (drawn at an odd zoom) go as float32 instead. An
+IMAGE message carries the encoded bytes of an image pictures refer to; it
+is sent once, before the first picture of it.
+
+Layers are not shared: items that arrive and are not in the scene go to a
+layer of their own, SHARED_LAYER, added on top of the local ones when the
+first of them arrives (and again should it be deleted). A new version of an
+item that is in the scene stays on its layer.
+"""
+import argparse
+import asyncio
+import math
+import queue
+import struct
+import sys
+import threading
+import time
+from array import array
+
+import storage
+from scene import Scene, Stroke, image_key
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HOST, PORT = "127.0.0.1", 8765
+QUANTUM = 16          # fixed-point steps per pixel of delta-encoded coordinates
+MAX_BACKLOG = 64 * 1024 * 1024  # bytes queued for a client before the server drops it
+CONNECT_TIMEOUT = 5.0
+SHARED_LAYER = "Shared"  # name of the layer other people's items go to
+
+WELCOME, ADD, REMOVE, CLEAR, IMAGE = range(5)
+DELTA, RAW = range(2)  # coordinate codings
+FRAME = struct.Struct("<I")        # payload length
+HEADER = struct.Struct("<BII")     # op, owner, item
+STYLE = struct.Struct("<BBHf")     # kind, coordinate coding, font size, width
+OWNER_OFFSET = FRAME.size + 1
+STRIDES = {storage.FILL: 3}        # coordinates per point, for the deltas; 2 by default
+
+
+def put_varint(out, value):
+    value = value * 2 if value >= 0 else -value * 2 - 1  # zigzag: small magnitudes, small codes
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def get_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (value >> 1) ^ -(value & 1), offset
+
+
+def pack_coords(coords, stride):
+    """(coding, bytes) of the coordinates."""
+    fixed = [round(value * QUANTUM) for value in coords]
+    if any(q != value * QUANTUM for q, value in zip(fixed, coords)):
+        raw = array("f", coords)
+        if sys.byteorder == "big":
+            raw.byteswap()
+        return RAW, raw.tobytes()
+    out = bytearray()
+    for i, q in enumerate(fixed):
+        put_varint(out, q - fixed[i - stride] if i >= stride else q)
+    return DELTA, out
+
+
+def unpack_coords(data, offset, count, coding, stride):
+    if coding == RAW:
+        coords = array("f", data[offset:offset + 4 * count])
+        if sys.byteorder == "big":
+            coords.byteswap()
+        return coords, offset + 4 * count
+    if np is not None and count:
+        return unpack_deltas(data, offset, count, stride)
+    fixed = []
+    for i in range(count):
+        q, offset = get_varint(data, offset)
+        fixed.append(q + fixed[i - stride] if i >= stride else q)
+    return array("f", [q / QUANTUM for q in fixed]), offset
+
+
+def unpack_deltas(data, offset, count, stride):
+    """unpack_coords for DELTA with NumPy: all the varints of a message at once."""
+    stream = np.frombuffer(data, np.uint8, offset=offset)
+    ends = np.flatnonzero(stream < 0x80)[:count]
+    stop = int(ends[-1]) + 1
+    starts = np.empty(count, np.intp)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # the varint each byte belongs to, and its place in it
+    owner = np.zeros(stop, np.intp)
+    owner[starts[1:]] = 1
+    np.cumsum(owner, out=owner)
+    shifts = 7 * (np.arange(stop) - starts[owner])
+    values = np.add.reduceat((stream[:stop] & 0x7F).astype(np.int64) << shifts, starts)
+    deltas = (values >> 1) ^ -(values & 1)
+    for first in range(stride):
+        np.cumsum(deltas[first::stride], out=deltas[first::stride])
+    return array("f", (deltas / QUANTUM).astype(np.float32).tobytes()), offset + stop
+
+
+def encode(op, owner=0, item=0, record=None):
+    """A framed message."""
+    out = bytearray(FRAME.size)
+    out += HEADER.pack(op, owner, item)
+    if op == ADD:
+        kind, size, color, text, family, width, coords = storage.record_fields(record)
+        coding, data = pack_coords(coords, STRIDES.get(kind, 2))
+        out += STYLE.pack(kind, coding, size, width)
+        put_varint(out, len(coords))
+        out += data
+        for value in (color, text, family):
+            data = value.encode("utf-8")
+            put_varint(out, len(data))
+            out += data
+    elif op == IMAGE:
+        out += record
+    FRAME.pack_into(out, 0, len(out) - FRAME.size)
+    return bytes(out)
+
+
+def decode(payload):
+    """(op, owner, item, record) of a message payload; record is None but for ADD and IMAGE.
+
+    Raises storage.FormatError for an ADD whose record is damaged.
+    """
+    op, owner, item = HEADER.unpack_from(payload)
+    if op == IMAGE:
+        return op, owner, item, bytes(payload[HEADER.size:])
+    if op != ADD:
+        return op, owner, item, None
+    offset = HEADER.size
+    kind, coding, size, width = STYLE.unpack_from(payload, offset)
+    count, offset = get_varint(payload, offset + STYLE.size)
+    if not storage.coords_fit(kind, count):
+        raise storage.FormatError(f"item {item} of client {owner} is damaged")
+    coords, offset = unpack_coords(payload, offset, count, coding, STRIDES.get(kind, 2))
+    strings = []
+    for _ in range(3):
+        length, offset = get_varint(payload, offset)
+        strings.append(bytes(payload[offset:offset + length]).decode("utf-8"))
+        offset += length
+    color, text, family = strings
+    return op, owner, item, storage.build_record(kind, size, color, text, family, width, coords)
+
+
+async def read_message(reader):
+    """The next payload from the stream, or None at its end."""
+    try:
+        header = await reader.readexactly(FRAME.size)
+        return await reader.readexactly(FRAME.unpack(header)[0])
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+class Board:
+    """Keeps a scene in step with a session: sends its changes, merges the others'.
+
+    send(op, owner, item, record) is called with every committed change made
+    to the scene other than by merge().
+    """
+
+    def __init__(self, scene, send):
+        self.scene = scene
+        self.send = send
+        self.me = None      # our client id, from the server's WELCOME
+        self.local = {}     # (owner, item) of other people's items -> our id
+        self.keys = {}      # our id -> (owner, item), for other people's items
+        self.merging = False
+        self.layer = None   # id of the layer other people's new items go to
+        scene.listeners.append(self.changed)
+
+    def detach(self):
+        self.scene.listeners.remove(self.changed)
+
+    def changed(self, op, item_id, record):
+        if self.merging:
+            return
+        if op == "commit":
+            self.send(ADD, *self.keys.get(item_id, (0, item_id)), record)
+        elif op == "remove":
+            self.send(REMOVE, *self.keys.get(item_id, (0, item_id)), None)
+        elif op == "clear":
+            self.send(CLEAR, 0, 0, None)
+        elif op == "image":
+            self.send(IMAGE, 0, 0, self.scene.images[record])
+
+    def publish(self):
+        """Shares everything already in the scene, e.g. after joining."""
+        for key in self.scene.images:
+            self.changed("image", None, key)
+        for item_id, record in self.scene:
+            if item_id in self.scene.index:  # committed
+                self.changed("commit", item_id, record)
+
+    def shared_layer(self):
+        """The id of the layer for other people's items, added when there is none."""
+        scene = self.scene
+        if self.layer not in scene.depth:
+            layer = scene.add_layer(SHARED_LAYER)
+            # with MAX_LAYERS already, the bottom one
+            self.layer = scene.layers[0].id if layer is None else layer.id
+        return self.layer
+
+    def local_id(self, owner, item):
+        return item if owner == self.me else self.local.get((owner, item))
+
+    def apply(self, op, owner, item, record):
+        """Merges one message from the server into the scene."""
+        scene = self.scene
+        self.merging = True
+        try:
+            if op == WELCOME:
+                self.me = owner
+            elif op == ADD:
+                item_id = self.local_id(owner, item)
+                order = None
+                if item_id in scene.items:
+                    # a new version (e.g. moved): it stays on its layer, in its place
+                    order = scene.order[item_id]
+                    record.layer = scene.remove(item_id).layer
+                else:
+                    record.layer = self.shared_layer()
+                if item_id is not None:
+                    scene.insert(item_id, record, order)
+                else:
+                    item_id = scene.add(record)
+                    self.local[owner, item] = item_id
+                    self.keys[item_id] = (owner, item)
+            elif op == REMOVE:
+                item_id = self.local_id(owner, item)
+                if item_id in scene.items:
+                    scene.remove(item_id)
+            elif op == IMAGE:
+                scene.add_image(record)
+            elif op == CLEAR:
+                if len(scene.index) == len(scene.items):
+                    scene.clear()
+                else:
+                    # keep a stroke that is being drawn right now
+                    for item_id in [item_id for item_id in scene.items if item_id in scene.index]:
+                        scene.remove(item_id)
+        finally:
+            self.merging = False
+
+    def merge(self, messages, budget):
+        """Applies queued messages for at most budget seconds; False once the session ended."""
+        deadline = time.perf_counter() + budget
+        while time.perf_counter() < deadline:
+            try:
+                message = messages.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:
+                return False
+            self.apply(*message)
+        return True
+
+
+class Server:
+
+    def __init__(self):
+        self.writers = {}   # client id -> StreamWriter
+        self.board = {}     # (owner, item) -> framed ADD, in the order they came
+        self.images = {}    # image key -> framed IMAGE
+        self.next_client = 1
+        self.relayed = 0
+
+    async def handle(self, reader, writer):
+        client = self.next_client
+        self.next_client += 1
+        writer.write(encode(WELCOME, client))
+        for message in self.images.values():
+            writer.write(message)
+        for message in self.board.values():
+            writer.write(message)
+        self.writers[client] = writer
+        try:
+            while True:
+                payload = await read_message(reader)
+                if payload is None:
+                    break
+                self.receive(client, payload)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.pop(client, None)
+            writer.close()
+
+    def receive(self, client, payload):
+        message = bytearray(FRAME.pack(len(payload)))
+        message += payload
+        op, owner, item = HEADER.unpack_from(message, FRAME.size)
+        if op in (ADD, REMOVE) and owner == 0:
+            owner = client
+            struct.pack_into("<I", message, OWNER_OFFSET, client)
+        message = bytes(message)
+        if op == ADD:
+            self.board[owner, item] = message  # a new version keeps the old one's place
+        elif op == REMOVE:
+            self.board.pop((owner, item), None)
+        elif op == CLEAR:
+            self.board.clear()
+        elif op == IMAGE:
+            key = image_key(message[FRAME.size + HEADER.size:])
+            if key in self.images:
+                return
+            self.images[key] = message
+        else:
+            return
+        for other, writer in list(self.writers.items()):
+            if other == client:
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+                # it stopped reading; it can join again for the whole board
+                print(f"Dropping client {other}: too far behind")
+                del self.writers[other]
+                writer.close()
+                continue
+            writer.write(message)
+            self.relayed += 1
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+class Client:
+    """A session connection on its own thread and asyncio loop.
+
+    The UI thread only calls send(), which hands the record to the loop to
+    be encoded and written, and takes decoded messages off incoming (None
+    when the connection is gone).
+    """
+
+    def __init__(self, host=HOST, port=PORT):
+        self.host, self.port = host, port
+        self.incoming = queue.Queue()
+        self.loop = self.writer = self.thread = None
+        self.connected = threading.Event()
+        self.error = None
+
+    def start(self):
+        """Connects; raises OSError when the server cannot be reached."""
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(),), name="session", daemon=True)
+        self.thread.start()
+        if not self.connected.wait(CONNECT_TIMEOUT):
+            raise OSError(f"no answer from {self.host}:{self.port}")
+        if self.error:
+            raise self.error
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        except OSError as e:
+            self.error = e
+            self.connected.set()
+            return
+        self.connected.set()
+        try:
+            while True:
+                payload = await read_message(reader)
+                if payload is None:
+                    break
+                try:
+                    message = decode(payload)
+                except storage.FormatError as e:
+                    print(f"Ignoring a message: {e}")
+                    continue
+                self.incoming.put(message)
+        finally:
+            self.incoming.put(None)
+            self.writer.close()
+
+    def send(self, op, owner, item, record):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.write, op, owner, item, record)
+
+    def write(self, op, owner, item, record):
+        if not self.writer.is_closing():
+            self.writer.write(encode(op, owner, item, record))
+
+    def close(self):
+        if self.thread is not None and self.writer is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.writer.close)
+            except RuntimeError:
+                pass  # the loop has ended already, e.g. the server dropped us
+            self.thread.join(CONNECT_TIMEOUT)
+        self.thread = None
+
+
+def wavy_stroke(client, stroke, points):
+    x0, y0 = (client * 97) % 900, (stroke * 41) % 700
+    coords = []
+    for i in range(points):
+        coords += (x0 + i * 2, y0 + round(30 * math.sin(i / 9 + client)))
+    return Stroke(coords, "#%06x" % (client * 2654435761 % 0xFFFFFF), 1 + client % 5)
+
+
+async def simulated_client(host, port, index, strokes, points, expected, start):
+    """Draws strokes while merging everyone else's; returns (scene, seconds until all arrived, bytes read)."""
+    reader, writer = await asyncio.open_connection(host, port)
+    scene = Scene()
+    board = Board(scene, lambda op, owner, item, record: writer.write(encode(op, owner, item, record)))
+    board.apply(*decode(await read_message(reader)))  # WELCOME
+    await start.wait()
+
+    async def draw():
+        for stroke in range(strokes):
+            scene.add(wavy_stroke(index, stroke, points))
+            await writer.drain()
+
+    drawing = asyncio.create_task(draw())
+    t0 = time.perf_counter()
+    received = read = 0
+    while received < expected:
+        payload = await read_message(reader)
+        if payload is None:
+            break
+        read += FRAME.size + len(payload)
+        message = decode(payload)
+        board.apply(*message)
+        received += message[0] == ADD
+    seconds = time.perf_counter() - t0
+    await drawing
+    writer.close()
+    return scene, seconds, read
+
+
+async def bench(clients, strokes, points, host=HOST):
+    server = Server()
+    listener = await asyncio.start_server(server.handle, host, 0)
+    port = listener.sockets[0].getsockname()[1]
+    start = asyncio.Event()
+    expected = (clients - 1) * strokes
+    tasks = [asyncio.create_task(simulated_client(host, port, index, strokes, points, expected, start))
+             for index in range(clients)]
+    while server.next_client <= clients:
+        await asyncio.sleep(0.01)
+    t0 = time.perf_counter()
+    start.set()
+    results = await asyncio.gather(*tasks)
+    total = time.perf_counter() - t0
+    listener.close()
+
+    scenes = [scene for scene, seconds, read in results]
+    boards = {frozenset((record.color, tuple(record.points)) for item_id, record in scene) for scene in scenes}
+    delivered = server.relayed
+    wire = sum(read for scene, seconds, read in results)
+    raw = 4 * 2 * points * expected * clients  # the same points as float32
+    latencies = sorted(seconds for scene, seconds, read in results)
+    print(f"{clients} clients x {strokes} strokes of {points} points: {delivered} messages delivered "
+          f"in {total:.2f} s ({delivered / total:.0f} msg/s, {wire / total / 1e6:.1f} MB/s)")
+    print(f"all strokes everywhere after: median {latencies[len(latencies) // 2]:.2f} s, "
+          f"last {latencies[-1]:.2f} s")
+    print(f"wire bytes per point {wire / (points * expected * clients):.2f} "
+          f"(float32 would be 8; {raw / wire:.1f}x smaller)")
+    converged = len(boards) == 1 and all(len(scene) == clients * strokes for scene in scenes)
+    print("boards converged" if converged else "BOARDS DIFFER")
+    return converged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared Humming Paint drawing sessions.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run a session server")
+    serve.add_argument("--host", default=HOST)
+    serve.add_argument("--port", type=int, default=PORT)
+    load = commands.add_parser("bench", help="measure throughput with simulated clients")
+    load.add_argument("--clients", type=int, default=20)
+    load.add_argument("--strokes", type=int, default=50, help="strokes drawn by every client")
+    load.add_argument("--points", type=int, default=100, help="points per stroke")
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        print(f"Serving drawing sessions on {args.host}:{args.port}")
+        try:
+            asyncio.run(Server().serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if args.clients < 2 or args.strokes < 1 or args.points < 1:
+        parser.error("need at least 2 clients, 1 stroke and 1 point")
+    return 0 if asyncio.run(bench(args.clients, args.strokes, args.points)) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""A uniform grid over item bounding boxes.
+
+Scene keeps one of these in sync with its committed items so that "what is
+near this rectangle" costs in proportion to the answer rather than to the
+size of the drawing.
+"""
+import math
+
+CELL = 256        # grid cell size in world pixels
+MAX_CELLS = 64    # items spanning more cells than this are kept in one list instead
+
+
+class GridIndex:
+
+    def __init__(self, cell=CELL):
+        self.cell = cell
+        self.cells = {}    # (column, row) -> set of ids
+        self.boxes = {}    # id -> (x1, y1, x2, y2)
+        self.large = set() # ids of items too big to register cell by cell
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __contains__(self, item_id):
+        return item_id in self.boxes
+
+    def span(self, x1, y1, x2, y2):
+        cell = self.cell
+        return (math.floor(x1 / cell), math.floor(y1 / cell),
+                math.floor(x2 / cell), math.floor(y2 / cell))
+
+    def insert(self, item_id, bbox):
+        """Adds an item, or moves it if it is already indexed."""
+        if item_id in self.boxes:
+            self.remove(item_id)
+        self.boxes[item_id] = bbox
+        c1, r1, c2, r2 = self.span(*bbox)
+        if (c2 - c1 + 1) * (r2 - r1 + 1) > MAX_CELLS:
+            self.large.add(item_id)
+            return
+        cells = self.cells
+        for column in range(c1, c2 + 1):
+            for row in range(r1, r2 + 1):
+                key = (column, row)
+                if key in cells:
+                    cells[key].add(item_id)
+                else:
+                    cells[key] = {item_id}
+
+    def remove(self, item_id):
+        bbox = self.boxes.pop(item_id, None)
+        if bbox is None:
+            return
+        if item_id in self.large:
+            self.large.discard(item_id)
+            return
+        c1, r1, c2, r2 = self.span(*bbox)
+        cells = self.cells
+        for column in range(c1, c2 + 1):
+            for row in range(r1, r2 + 1):
+                ids = cells[column, row]
+                ids.discard(item_id)
+                if not ids:
+                    del cells[column, row]
+
+    def clear(self):
+        self.cells.clear()
+        self.boxes.clear()
+        self.large.clear()
+
+    def query(self, x1, y1, x2, y2):
+        """Ids of the items whose bounding box touches the rectangle, in no particular order."""
+        c1, r1, c2, r2 = self.span(x1, y1, x2, y2)
+        cells = self.cells
+        if (c2 - c1 + 1) * (r2 - r1 + 1) > len(cells):
+            # zoomed far out: cheaper to walk the occupied cells
+            keys = [key for key in cells if c1 <= key[0] <= c2 and r1 <= key[1] <= r2]
+        else:
+            keys = [(column, row) for column in range(c1, c2 + 1) for row in range(r1, r2 + 1)
+                    if (column, row) in cells]
+        if len(keys) == 1 and not self.large:
+            candidates = cells[keys[0]]
+        else:
+            candidates = set(self.large)
+            for key in keys:
+                candidates.update(cells[key])
+        boxes = self.boxes
+        found = []
+        for item_id in candidates:
+            bx1, by1, bx2, by2 = boxes[item_id]
+            if bx1 <= x2 and bx2 >= x1 and by1 <= y2 and by2 >= y1:
+                found.append(item_id)
+        return found
@@ -0,0 +1,286 @@
+"""Binary .hpaint drawing files.
+
+Layout (little endian):
+
+    header   magic "HPNT", version, background string, and the counts and
+             offsets of the three sections below
+    strings  u16 length + UTF-8 bytes each: colors, font families and texts
+    items    one fixed ITEM record (with the scene id and the position of its
+             layer in the layers section) per item, in stacking order
+    coords   every item's coordinates as one packed float32 array
+    layers   u16 count, then one LAYER record per layer, bottom to top
+             (version 3; older files have a single layer)
+
+Version 4 adds fills, whose coords are x, y and cell size followed by their
+(row, first, last) spans.
+
+Version 5 adds pictures, whose coords are x, y, width and height and whose
+text is the key of their image, and after the layers:
+
+    images   u32 count, then per image its key (a string) and u32 length,
+             and the encoded image bytes
+
+Only the images that pictures refer to are written, unless all of them are
+asked for (the autosave snapshot keeps an image that is yet to be stamped).
+
+Loading maps the file into memory and yields the records one at a time, so a
+big drawing can be streamed into a scene in chunks without first building a
+second copy of it.
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from scene import Fill, Layer, Picture, Stroke, Shape, Text
+
+MAGIC = b"HPNT"
+VERSION = 5
+HEADER = struct.Struct("<4sHHIIIIII")  # magic, version, background, items, strings, coords, 3 offsets
+ITEM = struct.Struct("<IBBHIIIIIf")    # id, kind, layer, font size, color, text, family,
+                                       # coord offset, coord count, width
+ITEM_V2 = struct.Struct("<IBxHIIIIIf")  # version 2 had no layers
+ITEM_V1 = struct.Struct("<BxHIIIIIf")  # version 1 had no ids either
+STRING_LENGTH = struct.Struct("<H")
+LAYER_COUNT = struct.Struct("<H")
+LAYER = struct.Struct("<IIB")           # id, name, flags
+VISIBLE, LOCKED = 1, 2
+IMAGE_COUNT = struct.Struct("<I")
+IMAGE = struct.Struct("<II")            # key, byte length; the bytes follow
+
+STROKE, RECTANGLE, OVAL, TEXT, FILL, PICTURE = range(6)
+SHAPE_KINDS = {"rectangle": RECTANGLE, "oval": OVAL}
+# What build_record needs: at least MIN_COORDS, in whole steps of COORD_STEPS
+# (points of a stroke, spans of a fill), so every record has a bounding box.
+MIN_COORDS = {STROKE: 2, RECTANGLE: 4, OVAL: 4, TEXT: 2, FILL: 6, PICTURE: 4}
+COORD_STEPS = {STROKE: 2, FILL: 3}
+
+
+class FormatError(ValueError):
+    pass
+
+
+def record_fields(record):
+    """Splits a record into (kind, font size, color, text, family, width, coords)."""
+    if isinstance(record, Stroke):
+        return STROKE, 0, record.color, "", "", record.width, record.points
+    if isinstance(record, Shape):
+        return SHAPE_KINDS[record.kind], 0, record.color, "", "", record.width, record.coords
+    if isinstance(record, Fill):
+        return FILL, 0, record.color, "", "", 0, array("f", (record.x, record.y, record.cell)) + record.spans
+    if isinstance(record, Picture):
+        return PICTURE, 0, "", record.key, "", 0, array("f", (record.x, record.y, record.width, record.height))
+    return TEXT, record.size, record.color, record.text, record.family, 0, array("f", (record.x, record.y))
+
+
+def coords_fit(kind, count):
+    """Whether build_record can make a record of the kind from count coordinates."""
+    return kind in MIN_COORDS and count >= MIN_COORDS[kind] and count % COORD_STEPS.get(kind, 1) == 0
+
+
+def build_record(kind, size, color, text, family, width, coords, layer=0):
+    """The inverse of record_fields; coords is a float array that gets adopted."""
+    if kind == STROKE:
+        record = Stroke((), color, width, layer)
+        record.points = coords
+    elif kind == TEXT:
+        record = Text(coords[0], coords[1], text, color, family, size, layer)
+    elif kind == FILL:
+        record = Fill(coords[0], coords[1], coords[2], (), color, layer)
+        record.spans = coords[3:]
+    elif kind == PICTURE:
+        record = Picture(coords[0], coords[1], coords[2], coords[3], text, layer)
+    else:
+        record = Shape("rectangle" if kind == RECTANGLE else "oval", (), color, width, layer)
+        record.coords = coords
+    return record
+
+
+def layer_flags(layer):
+    return (VISIBLE if layer.visible else 0) | (LOCKED if layer.locked else 0)
+
+
+def save(path, scene, background="white", layers=None, images=None, all_images=False):
+    """Writes (id, record) pairs, e.g. a Scene, its layers and its images ({key: bytes}) to path.
+
+    The old file is only replaced once the new one is complete.
+    """
+    if layers is None:
+        layers = [Layer(0, "Layer 1")]
+    positions = {layer.id: position for position, layer in enumerate(layers)}
+    strings = {}
+
+    def string_index(value):
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    items = bytearray()
+    coords = array("f")
+    background_index = string_index(background)
+    keys = set()
+    for item_id, record in scene:
+        kind, size, color, text, family, width, points = record_fields(record)
+        if kind == PICTURE:
+            keys.add(text)
+        items += ITEM.pack(item_id, kind, positions.get(record.layer, 0), size, string_index(color),
+                           string_index(text), string_index(family), len(coords), len(points), width)
+        coords.extend(points)
+    if sys.byteorder == "big":
+        coords.byteswap()
+    layer_table = bytearray(LAYER_COUNT.pack(len(layers)))
+    for layer in layers:
+        layer_table += LAYER.pack(layer.id, string_index(layer.name), layer_flags(layer))
+    images = [(string_index(key), data) for key, data in (images or {}).items() if all_images or key in keys]
+
+    table = bytearray()
+    for value in strings:
+        data = value.encode("utf-8")
+        table += STRING_LENGTH.pack(len(data)) + data
+
+    strings_offset = HEADER.size
+    items_offset = strings_offset + len(table)
+    coords_offset = items_offset + len(items)
+    header = HEADER.pack(MAGIC, VERSION, background_index, len(items) // ITEM.size,
+                         len(strings), len(coords), strings_offset, items_offset, coords_offset)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(header)
+        f.write(table)
+        f.write(items)
+        f.write(coords.tobytes())
+        f.write(layer_table)
+        f.write(IMAGE_COUNT.pack(len(images)))
+        for key, data in images:
+            f.write(IMAGE.pack(key, len(data)))
+            f.write(data)
+    os.replace(temp_path, path)
+
+
+class Drawing:
+    """A memory-mapped .hpaint file. Iterate it to get the scene records."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise FormatError(f"{path}: not a drawing file")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, background, self.count, string_count, coord_count,
+         strings_offset, self.items_offset, self.coords_offset) = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise FormatError(f"{path}: not a drawing file")
+        if version > VERSION:
+            raise FormatError(f"{path}: made by a newer version (format {version})")
+        self.item_struct = ITEM if version >= 3 else ITEM_V2 if version == 2 else ITEM_V1
+        self.coord_count = coord_count
+        layers_offset = self.coords_offset + 4 * coord_count
+        if layers_offset > len(self.map) or self.items_offset + self.count * self.item_struct.size > len(self.map):
+            raise FormatError(f"{path}: file is truncated")
+
+        self.strings = []
+        offset = strings_offset
+        for _ in range(string_count):
+            if offset + STRING_LENGTH.size > len(self.map):
+                raise FormatError(f"{path}: file is truncated")
+            (length,) = STRING_LENGTH.unpack_from(self.map, offset)
+            offset += STRING_LENGTH.size
+            if offset + length > len(self.map):
+                raise FormatError(f"{path}: file is truncated")
+            try:
+                self.strings.append(self.map[offset:offset + length].decode("utf-8"))
+            except UnicodeDecodeError:
+                raise FormatError(f"{path}: string {len(self.strings)} is not UTF-8") from None
+            offset += length
+        self.background = self.string(background)
+
+        self.layers = [Layer(0, "Layer 1")]  # bottom to top
+        self.images = {}  # image key -> encoded bytes
+        if version >= 3:
+            if layers_offset + LAYER_COUNT.size > len(self.map):
+                raise FormatError(f"{path}: file is truncated")
+            (layer_count,) = LAYER_COUNT.unpack_from(self.map, layers_offset)
+            if layers_offset + LAYER_COUNT.size + layer_count * LAYER.size > len(self.map):
+                raise FormatError(f"{path}: file is truncated")
+            self.layers = []
+            for index in range(layer_count):
+                layer_id, name, flags = LAYER.unpack_from(
+                    self.map, layers_offset + LAYER_COUNT.size + index * LAYER.size)
+                self.layers.append(Layer(layer_id, self.string(name),
+                                         bool(flags & VISIBLE), bool(flags & LOCKED)))
+        if version >= 5:
+            offset = layers_offset + LAYER_COUNT.size + len(self.layers) * LAYER.size
+            if offset + IMAGE_COUNT.size > len(self.map):
+                raise FormatError(f"{path}: file is truncated")
+            (image_count,) = IMAGE_COUNT.unpack_from(self.map, offset)
+            offset += IMAGE_COUNT.size
+            for _ in range(image_count):
+                if offset + IMAGE.size > len(self.map):
+                    raise FormatError(f"{path}: file is truncated")
+                key, length = IMAGE.unpack_from(self.map, offset)
+                offset += IMAGE.size
+                if offset + length > len(self.map):
+                    raise FormatError(f"{path}: file is truncated")
+                self.images[self.string(key)] = self.map[offset:offset + length]
+                offset += length
+
+    def string(self, index):
+        if index >= len(self.strings):
+            raise FormatError(f"{self.path}: string {index} is missing")
+        return self.strings[index]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for item_id, record in self.items():
+            yield record
+
+    def items(self):
+        """Yields (id, record) pairs in stacking order.
+
+        Raises FormatError at the first item that refers to something the file does not have.
+        """
+        strings = self.strings
+        string_count = len(strings)
+        coord_count = self.coord_count
+        swap = sys.byteorder == "big"
+        item = self.item_struct
+        layer_ids = [layer.id for layer in self.layers]
+        for index in range(self.count):
+            fields = item.unpack_from(self.map, self.items_offset + index * item.size)
+            if item is ITEM_V1:
+                fields = (index + 1, fields[0], 0) + fields[1:]
+            elif item is ITEM_V2:
+                fields = fields[:2] + (0,) + fields[2:]
+            item_id, kind, layer, size, color, text, family, start, count, width = fields
+            if (not coords_fit(kind, count) or start + count > coord_count
+                    or layer >= len(layer_ids) or max(color, text, family) >= string_count):
+                raise FormatError(f"{self.path}: item {index} is damaged")
+            points = array("f", self.map[self.coords_offset + 4 * start:
+                                         self.coords_offset + 4 * (start + count)])
+            if swap:
+                points.byteswap()
+            yield item_id, build_record(kind, size, strings[color], strings[text],
+                                        strings[family], width, points, layer_ids[layer])
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load(path, scene):
+    """Reads a whole drawing into scene; returns its background color."""
+    with Drawing(path) as drawing:
+        scene.set_layers(drawing.layers)
+        for data in drawing.images.values():
+            scene.add_image(data)
+        for record in drawing:
+            scene.add(record)
+        return drawing.background
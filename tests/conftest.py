@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the modules live next to code.py; appended, not prepended, so the stdlib's
+# code module (which pdb imports) is not shadowed by the app's code.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,114 @@
+import random
+
+import pytest
+
+import bucket
+import raster
+from scene import Scene, Shape, Stroke
+
+VIEW = (0, 0, 200, 150)
+
+
+@pytest.fixture(params=["numpy", "plain"])
+def backend(request, monkeypatch):
+    """Runs a test with NumPy and again on the pure-Python paths."""
+    if request.param == "numpy":
+        if bucket.np is None:
+            pytest.skip("NumPy is not installed")
+    else:
+        monkeypatch.setattr(bucket, "np", None)
+        monkeypatch.setattr(raster, "np", None)
+    return request.param
+
+
+def busy_scene(seed, strokes=60, shapes=15):
+    rng = random.Random(seed)
+    scene = Scene()
+    for _ in range(shapes):
+        x, y = rng.uniform(0, 200), rng.uniform(0, 150)
+        scene.add(Shape(rng.choice(["rectangle", "oval"]),
+                        (x, y, x + rng.uniform(5, 60), y + rng.uniform(5, 40)), "black", 2))
+    for _ in range(strokes):
+        x, y = rng.uniform(0, 200), rng.uniform(0, 150)
+        points = []
+        for _ in range(10):
+            x, y = x + rng.uniform(-6, 6), y + rng.uniform(-6, 6)
+            points += (x, y)
+        scene.add(Stroke(points, rng.choice(["red", "blue", "#00ff00"]), rng.choice([1, 2, 3])))
+    return scene
+
+
+def full_spans(scene, x, y, zoom=1, tolerance=32):
+    drawn = bucket.rasterize(scene, VIEW, zoom)
+    ox, oy = drawn.origin
+    return bucket.flood_spans(drawn, round(x * zoom) - ox, round(y * zoom) - oy, tolerance)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("zoom", [1, 1.5])
+def test_fill_around_matches_a_fill_of_the_whole_view(backend, seed, zoom):
+    scene = busy_scene(seed, strokes=200, shapes=40)  # dense enough that most fills stay small
+    rng = random.Random(seed)
+    for _ in range(3):
+        x, y = rng.uniform(0, 199), rng.uniform(0, 149)
+        fill = bucket.fill_at(scene, x, y, VIEW, zoom, "yellow", tolerance=32)
+        assert sorted(zip(*[iter(fill.spans)] * 3)) == sorted(zip(*[iter(full_spans(scene, x, y, zoom))] * 3))
+
+
+def test_flood_spans_matches_scanline_fill(monkeypatch):
+    if bucket.np is None:
+        pytest.skip("NumPy is not installed")
+    drawn = bucket.rasterize(busy_scene(7, strokes=120), VIEW, 1)
+    fast = bucket.flood_spans(drawn, 100, 75)
+    monkeypatch.setattr(raster, "np", None)
+    flat = raster.Raster(drawn.width, drawn.height)
+    flat.pixels = bytearray(drawn.pixels.tobytes())
+    slow = bucket.scanline_fill(flat, 100, 75)
+    assert sorted(zip(*[iter(fast)] * 3)) == sorted(zip(*[iter(slow)] * 3))
+
+
+def test_warm_builds_the_view_a_chunk_at_a_time(backend, monkeypatch):
+    monkeypatch.setattr(bucket, "WARM_ITEMS", 10)
+    scene = busy_scene(3)
+    cache = bucket.ViewCache(scene)
+    calls = 1
+    while not cache.warm(VIEW, 1):
+        assert cache.get(VIEW, 1, draw=False) is None
+        calls += 1
+    assert calls == len(scene.items) // 10 + 1
+    assert bytes(cache.get(VIEW, 1, draw=False).pixels) == bytes(bucket.rasterize(scene, VIEW, 1).pixels)
+
+
+def test_cache_draws_fills_on_top_and_drops_other_changes(backend):
+    scene = busy_scene(5)
+    cache = bucket.ViewCache(scene)
+    while not cache.warm(VIEW, 1):
+        pass
+    scene.add(bucket.fill_at(scene, 100, 75, VIEW, 1, "yellow", tolerance=32, cache=cache))
+    assert bytes(cache.get(VIEW, 1, draw=False).pixels) == bytes(bucket.rasterize(scene, VIEW, 1).pixels)
+    scene.remove(next(iter(scene.items)))
+    assert cache.get(VIEW, 1, draw=False) is None
+
+
+def test_a_change_restarts_warming(backend, monkeypatch):
+    monkeypatch.setattr(bucket, "WARM_ITEMS", 10)
+    scene = busy_scene(6)
+    cache = bucket.ViewCache(scene)
+    cache.warm(VIEW, 1)
+    scene.remove(next(iter(scene.items)))
+    while not cache.warm(VIEW, 1):
+        pass
+    assert bytes(cache.get(VIEW, 1, draw=False).pixels) == bytes(bucket.rasterize(scene, VIEW, 1).pixels)
+
+
+def test_an_item_put_back_under_others_drops_the_cache(backend):
+    scene = busy_scene(8)
+    cache = bucket.ViewCache(scene)
+    cache.get(VIEW, 1)
+    item_id = next(iter(scene.items))
+    order = scene.order[item_id]
+    record = scene.remove(item_id)
+    cache.get(VIEW, 1)
+    scene.insert(item_id, record, order)  # as undo does
+    assert cache.get(VIEW, 1, draw=False) is None
+    assert bytes(cache.get(VIEW, 1).pixels) == bytes(bucket.rasterize(scene, VIEW, 1).pixels)
@@ -0,0 +1,44 @@
+from controller import Controller
+from scene import Scene, Shape, Stroke
+
+
+def test_stroke_keeps_spaced_points_and_commits():
+    scene = Scene()
+    committed = []
+    scene.listeners.append(lambda op, item_id, record: op == "commit" and committed.append(item_id))
+    controller = Controller(scene)
+    controller.start_stroke("pencil", 0, 0, "red", 2)
+    assert controller.drawing
+    assert not controller.move(1, 0)  # closer than the spacing
+    for x in range(2, 40, 2):
+        assert controller.move(x, x % 3)
+    controller.flush()
+    assert not controller.pending
+    stroke_id = controller.stop_stroke()
+    assert not controller.drawing
+    assert committed == [stroke_id]
+    assert isinstance(scene.items[stroke_id], Stroke)
+
+
+def test_spacing_is_in_screen_pixels():
+    controller = Controller(Scene())
+    controller.start_stroke("pencil", 0, 0, "red", 2, zoom=4)
+    assert controller.move(0.5, 0)  # two screen pixels at this zoom
+
+
+def test_eraser_removes_only_its_layer():
+    scene = Scene()
+    other = scene.add_layer("Other").id
+    kept = scene.add(Shape("rectangle", (0, 0, 20, 20), "black", 1, other))
+    gone = scene.add(Shape("rectangle", (0, 0, 20, 20), "black", 1))
+    controller = Controller(scene)
+    controller.start_stroke("eraser", -10, 0, "black", 4, layer=0)
+    controller.move(10, 0)
+    assert controller.stop_stroke() is None
+    assert gone not in scene.items and kept in scene.items
+
+
+def test_a_click_makes_a_shape_of_the_line_width():
+    scene = Scene()
+    shape_id = Controller(scene).add_shape("oval", 5, 5, 5, 5, "black", 3)
+    assert list(scene.items[shape_id].coords) == [5, 5, 8, 8]
@@ -0,0 +1,106 @@
+from history import History, record_size
+from scene import Fill, Picture, Scene, Shape, Stroke
+
+
+def stacking(scene):
+    return [item_id for item_id, record in scene]
+
+
+def test_undo_erase_keeps_the_stacking_order():
+    scene = Scene()
+    history = History(scene)
+    first = scene.add(Stroke((0, 0, 10, 10), "red", 2))
+    history.checkpoint()
+    second = scene.add(Stroke((0, 10, 10, 0), "blue", 2))
+    history.checkpoint()
+    scene.remove(first)
+    history.checkpoint()
+    history.undo()
+    assert stacking(scene) == [first, second]
+    history.redo()
+    history.undo()
+    assert stacking(scene) == [first, second]
+
+
+def test_erased_pieces_keep_the_stroke_place():
+    scene = Scene()
+    history = History(scene)
+    stroke = scene.add(Stroke((0, 5, 20, 5), "red", 2))
+    fill = scene.add(Fill(0, 0, 1, (0, 0, 20), "yellow"))
+    history.checkpoint()
+    scene.erase(10, 0, 10, 10, 2, candidates=[stroke])
+    history.checkpoint()
+    *pieces, top = stacking(scene)
+    assert len(pieces) == 2 and stroke not in pieces and top == fill
+    history.undo()
+    assert stacking(scene) == [stroke, fill]
+    history.redo()
+    assert stacking(scene) == pieces + [fill]
+
+
+def test_undo_clear_keeps_the_stacking_order():
+    scene = Scene()
+    history = History(scene)
+    ids = [scene.add(Shape("rectangle", (i, i, i + 5, i + 5), "black", 1)) for i in range(4)]
+    history.checkpoint()
+    scene.remove(ids[0])
+    readded = scene.add(scene.remove(ids[2]))  # goes on top
+    history.checkpoint()
+    scene.clear()
+    history.checkpoint()
+    history.undo()
+    assert stacking(scene) == [ids[1], ids[3], readded]
+    history.undo()
+    assert stacking(scene) == ids
+    assert scene.find_overlapping(0, 0, 20, 20) == ids
+
+
+def test_new_items_still_go_on_top_after_undo():
+    scene = Scene()
+    history = History(scene)
+    first = scene.add(Stroke((0, 0, 1, 1), "red", 1))
+    history.checkpoint()
+    scene.remove(first)
+    history.checkpoint()
+    history.undo()
+    later = scene.add(Stroke((0, 0, 1, 1), "red", 1))
+    assert stacking(scene) == [first, later]
+
+
+def test_move_and_undo_keep_the_stacking_order():
+    scene = Scene()
+    history = History(scene)
+    ids = [scene.add(Shape("rectangle", (i, i, i + 5, i + 5), "black", 1)) for i in range(4)]
+    history.checkpoint()
+    scene.move([ids[1]], 3, 3)
+    history.checkpoint()
+    assert stacking(scene) == ids
+    assert tuple(scene.items[ids[1]].coords) == (4, 4, 9, 9)
+    history.undo()
+    assert stacking(scene) == ids
+    assert tuple(scene.items[ids[1]].coords) == (1, 1, 6, 6)
+    assert scene.find_overlapping(0, 0, 20, 20) == ids
+
+
+def test_recolor_skips_items_that_keep_their_color():
+    scene = Scene()
+    history = History(scene)
+    red = scene.add(Stroke((0, 0, 1, 1), "red", 1))
+    picture = scene.add(Picture(0, 0, 4, 4, "key"))
+    history.checkpoint()
+    steps = len(history.undo_stack)
+    seen = []
+    scene.listeners.append(lambda op, item_id, record: seen.append(op))
+    scene.recolor([red, picture], "red")
+    history.checkpoint()
+    assert seen == [] and len(history.undo_stack) == steps
+    scene.recolor([red, picture], "blue")
+    assert scene.items[red].color == "blue"
+    assert seen == ["remove", "add", "commit"]
+    assert stacking(scene) == [red, picture]
+
+
+def test_fills_count_their_spans():
+    small = Fill(0, 0, 1, (0, 0, 10), "red")
+    large = Fill(0, 0, 1, [value for row in range(500) for value in (row, 0, 799)], "red")
+    assert record_size(large) - record_size(small) == 4 * 3 * 499
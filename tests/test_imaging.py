@@ -0,0 +1,122 @@
+import random
+import struct
+import zlib
+
+import pytest
+
+import imaging
+import raster
+
+
+@pytest.fixture(params=["numpy", "plain"])
+def backend(request, monkeypatch):
+    """Runs a test with NumPy and again on the pure-Python paths."""
+    if request.param == "numpy":
+        if imaging.np is None:
+            pytest.skip("NumPy is not installed")
+    else:
+        monkeypatch.setattr(imaging, "np", None)
+        monkeypatch.setattr(raster, "np", None)
+    return request.param
+
+
+def paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    return a if pa <= pb and pa <= pc else b if pb <= pc else c
+
+
+def filtered(rows, unit, kinds):
+    """PNG-filters each row of bytes with the filter type kinds[row]."""
+    out = bytearray()
+    previous = bytes(len(rows[0]))
+    for line, kind in zip(rows, kinds):
+        out.append(kind)
+        for i, x in enumerate(line):
+            a = line[i - unit] if i >= unit else 0
+            b = previous[i]
+            c = previous[i - unit] if i >= unit else 0
+            predicted = [0, a, b, (a + b) >> 1, paeth(a, b, c)][kind]
+            out.append((x - predicted) & 0xFF)
+        previous = line
+    return bytes(out)
+
+
+def png(width, height, depth, color_type, raw, extra=()):
+    def chunk(kind, body):
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+    header = struct.pack(">IIBBBBB", width, height, depth, color_type, 0, 0, 0)
+    return (imaging.PNG_SIGNATURE + chunk(b"IHDR", header) + b"".join(chunk(k, b) for k, b in extra)
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+
+def pixels(image):
+    return bytes(image.pixels.tobytes() if imaging.np is not None else image.pixels)
+
+
+@pytest.mark.parametrize("kinds", [[0] * 7, [1] * 7, [2] * 7, [3] * 7, [4] * 7, [0, 1, 2, 3, 4, 3, 2]])
+def test_png_filters_rgba(backend, kinds):
+    rng = random.Random(len(set(kinds)) * 10 + kinds[0])
+    width, height = 9, 7
+    rows = [bytes(rng.randrange(256) for _ in range(width * 4)) for _ in range(height)]
+    image = imaging.decode(png(width, height, 8, 6, filtered(rows, 4, kinds)))
+    assert (image.width, image.height) == (width, height)
+    assert pixels(image) == b"".join(rows)
+
+
+def test_png_filters_gray_and_rgb(backend):
+    rows = [bytes([10 * i + j for j in range(5)]) for i in range(4)]
+    image = imaging.decode(png(5, 4, 8, 0, filtered(rows, 1, [4, 3, 1, 2])))
+    assert pixels(image)[:8] == bytes([0, 0, 0, 255, 1, 1, 1, 255])
+    assert pixels(image)[-4:] == bytes([34, 34, 34, 255])
+    rgb = [bytes(range(i, i + 6)) for i in range(3)]
+    image = imaging.decode(png(2, 3, 8, 2, filtered(rgb, 3, [4, 4, 3])))
+    assert pixels(image)[-8:] == bytes([2, 3, 4, 255, 5, 6, 7, 255])
+
+
+def test_png_palette_with_transparency(backend):
+    palette = bytes([255, 0, 0, 0, 255, 0, 0, 0, 255])
+    raw = filtered([bytes([0b00011011])], 1, [0])  # 2-bit indices 0, 1, 2, 3
+    image = imaging.decode(png(3, 1, 2, 3, raw, [(b"PLTE", palette), (b"tRNS", b"\x80")]))
+    assert pixels(image) == bytes([255, 0, 0, 128, 0, 255, 0, 255, 0, 0, 255, 255])
+
+
+def test_png_16_bit_with_color_key(backend):
+    rows = [struct.pack(">6H", 0x1234, 0x5678, 0x9ABC, 1, 2, 3)]
+    key = (b"tRNS", struct.pack(">3H", 1, 2, 3))
+    image = imaging.decode(png(2, 1, 16, 2, filtered(rows, 6, [1]), [key]))
+    assert pixels(image) == bytes([0x12, 0x56, 0x9A, 255, 0, 0, 0, 0])
+
+
+def test_unfilter_matches_the_plain_version():
+    if imaging.np is None:
+        pytest.skip("NumPy is not installed")
+    np = imaging.np
+    rng = random.Random(7)
+    for unit in (1, 3, 4, 8):
+        height, stride = 13, unit * 11
+        raw = bytearray()
+        for row in range(height):
+            raw.append(rng.randrange(5))
+            raw += bytes(rng.randrange(256) for _ in range(stride))
+        rows = np.frombuffer(bytes(raw), np.uint8).reshape(height, stride + 1)
+        assert imaging.unfilter(rows, unit).tobytes() == bytes(imaging.unfilter_slow(raw, height, stride, unit))
+
+
+@pytest.mark.parametrize("data, message", [
+    (b"GIF89a", "unsupported"),
+    (imaging.PNG_SIGNATURE, "truncated"),
+    (png(2, 2, 8, 0, b"\x05\x00\x00\x00\x00\x00"), "filter"),
+    (png(2, 2, 8, 0, b"\x00\x00"), "truncated"),
+    (png(2, 2, 8, 1, b""), "unsupported"),
+])
+def test_bad_pngs_are_value_errors(backend, data, message):
+    with pytest.raises(ValueError, match=message):
+        imaging.decode(data)
+
+
+def test_ppm_and_pgm(backend):
+    image = imaging.decode(b"P6 2 1 255\n" + bytes([1, 2, 3, 4, 5, 6]))
+    assert pixels(image) == bytes([1, 2, 3, 255, 4, 5, 6, 255])
+    image = imaging.decode(b"P5\n# a comment\n1 2\n65535\n" + struct.pack(">2H", 65535, 0))
+    assert pixels(image) == bytes([255, 255, 255, 255, 0, 0, 0, 255])
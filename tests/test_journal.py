@@ -0,0 +1,78 @@
+import journal
+from history import History
+from scene import Fill, Scene, Shape, Stroke, Text
+
+
+def records(scene):
+    return [(type(record).__name__, tuple(getattr(record, "points", getattr(record, "coords", ())))) for item_id, record in scene]
+
+
+def build():
+    scene = Scene()
+    scene.add(Stroke((0, 0, 10, 10), "red", 2))
+    scene.add(Shape("oval", (5, 5, 20, 20), "blue", 3))
+    scene.add(Text(4, 4, "hi", "black", "Arial", 12))
+    return scene
+
+
+def test_journal_entries_round_trip(tmp_path):
+    scene = build()
+    with open(tmp_path / journal.JOURNAL_NAME, "wb") as f:
+        for item_id, record in scene:
+            f.write(journal.encode(journal.ADD, item_id, record, scene.order[item_id]))
+        f.write(journal.encode(journal.REMOVE, 2, None))
+        f.write(b"\x10\x00\x00\x00torn")  # killed mid-write
+    background, layers, items, images = journal.read_autosave(str(tmp_path))
+    assert background == "white" and layers is None and images == {}
+    assert list(items) == [1, 3]
+    assert items[3].text == "hi" and tuple(items[1].points) == (0, 0, 10, 10)
+
+
+def test_reading_stops_at_a_damaged_record(tmp_path):
+    with open(tmp_path / journal.JOURNAL_NAME, "wb") as f:
+        f.write(journal.encode(journal.ADD, 1, Stroke((0, 0, 10, 10), "red", 2), 1))
+        f.write(journal.encode(journal.ADD, 2, Fill(0, 0, 1, (), "blue"), 2))
+        f.write(journal.encode(journal.ADD, 3, Stroke((5, 5, 6, 6), "red", 2), 3))
+    background, layers, items, images = journal.read_autosave(str(tmp_path))
+    assert list(items) == [1]
+
+
+def test_an_unencodable_record_does_not_stop_the_writer(tmp_path):
+    scene = Scene()
+    writer = journal.Journal(scene, str(tmp_path))
+    writer.start()
+    scene.add(Text(0, 0, "huge", "black", "Arial", 70000))
+    stroke = scene.add(Stroke((0, 0, 10, 10), "red", 2))
+    scene.listeners.remove(writer.record)
+    writer.queue.put(None)
+    writer.thread.join()
+    background, layers, items, images = journal.read_autosave(str(tmp_path))
+    assert list(items) == [stroke]
+
+
+def test_recovery_keeps_the_stacking_order(tmp_path):
+    scene = Scene()
+    history = History(scene)
+    writer = journal.Journal(scene, str(tmp_path), background="ivory")
+    writer.start()
+    for item_id, record in build():
+        scene.add(record)
+        history.checkpoint()
+    scene.remove(1)
+    history.checkpoint()
+    history.undo()  # the stroke goes back under the others
+    writer.compact()
+    scene.add(Stroke((1, 1, 2, 2), "green", 1))
+    scene.remove(2)
+    history.checkpoint()
+    history.undo()
+    expected = records(scene)
+    # stop the writer without the snapshot close() takes, as if the app died
+    scene.listeners.remove(writer.record)
+    writer.queue.put(None)
+    writer.thread.join()
+
+    restored = Scene()
+    assert journal.recover(restored, str(tmp_path)) == "ivory"
+    assert records(restored) == expected
+    assert list(dict(restored)) == list(dict(scene))
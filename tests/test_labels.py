@@ -0,0 +1,47 @@
+import pytest
+
+import labels
+
+
+def write(tmp_path, text, name="labels.csv"):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_reads_csv_with_defaults_and_quoted_fields(tmp_path):
+    path = write(tmp_path, '# x, y, text\n\n1,2,plain\n3.5,4,"a, b\nc",20,red\n5,6,x,,blue\n')
+    records = labels.read_labels(path, size=12, color="black", family="Arial", layer=3)
+    assert [(r.x, r.y, r.text, r.size, r.color, r.layer) for r in records] == [
+        (1, 2, "plain", 12, "black", 3), (3.5, 4, "a, b\nc", 20, "red", 3), (5, 6, "x", 12, "blue", 3)]
+
+
+def test_reads_tab_separated(tmp_path):
+    path = write(tmp_path, "1\t2\thas, a comma\n", "labels.tsv")
+    assert labels.read_labels(path)[0].text == "has, a comma"
+
+
+@pytest.mark.parametrize("text, message", [
+    ("1,2\n", ":1: expected"),
+    ("1,2,ok\nx,2,bad\n", ":2: bad number"),
+    ("1,2,ok,x\n", ":1: bad number"),
+    ("1,2,ok,0\n", ":1: size 0 is not 6 to 120"),
+    ("1,2,ok\n3,4,big,70000\n", ":2: size 70000 is not 6 to 120"),
+])
+def test_bad_rows_name_their_line(tmp_path, text, message):
+    with pytest.raises(ValueError, match=message):
+        labels.read_labels(write(tmp_path, text))
+
+
+def test_unknown_colors_reject_the_file(tmp_path):
+    checked = []
+
+    def check_color(color):
+        checked.append(color)
+        if color != "red":
+            raise ValueError(color)
+
+    path = write(tmp_path, "1,2,a,12,red\n3,4,b\n5,6,c,12,rde\n")
+    with pytest.raises(ValueError, match=":3: unknown color 'rde'"):
+        labels.read_labels(path, color="black", check_color=check_color)
+    assert checked == ["red", "rde"]  # the default color is not checked
@@ -0,0 +1,65 @@
+import pytest
+
+import export
+import imaging
+import raster
+from scene import Fill, Shape, Stroke, Text
+
+
+@pytest.mark.parametrize("color, rgb", [
+    ("#f00", (255, 0, 0)),
+    ("#102030", (16, 32, 48)),
+    ("#ffff80800000", (255, 128, 0)),
+    ("red", (255, 0, 0)),
+    ("LightGray", (211, 211, 211)),
+    ("light grey", (211, 211, 211)),
+    ("gray50", (127, 127, 127)),
+    ("crimson", (220, 20, 60)),
+])
+def test_parse_color(color, rgb):
+    assert raster.parse_color(color) == rgb
+
+
+@pytest.mark.parametrize("color", ["lightgrey2", "#12g", "#1234", "", "not a color"])
+def test_parse_color_rejects_what_tk_would(color):
+    with pytest.raises(ValueError):
+        raster.parse_color(color)
+
+
+def pixel(image, x, y):
+    if raster.np is not None:
+        return tuple(int(v) for v in image.pixels[y, x])
+    start = (y * image.width + x) * image.channels
+    return tuple(image.pixels[start:start + image.channels])
+
+
+def test_background_and_transparency():
+    assert pixel(raster.Raster(4, 3, "lightgray"), 3, 2) == (211, 211, 211)
+    assert pixel(raster.Raster(4, 3, None), 0, 0) == (0, 0, 0, 0)
+
+
+def test_draws_records_in_their_colors():
+    image = raster.Raster(40, 40)
+    assert image.draw(Shape("rectangle", (5, 5, 15, 15), "blue", 1))
+    assert image.draw(Stroke((20, 30, 35, 30), "red", 4))
+    assert image.draw(Fill(30, 5, 1, (0, 0, 2), "green"))
+    assert pixel(image, 5, 10) == (0, 0, 255)
+    assert pixel(image, 10, 10) == (255, 255, 255)  # outlines only
+    assert pixel(image, 28, 30) == (255, 0, 0)
+    assert pixel(image, 32, 5) == (0, 255, 0)
+    assert pixel(image, 33, 5) == (255, 255, 255)
+
+
+def test_draws_text_in_the_bitmap_font():
+    image = raster.Raster(40, 20)
+    assert not image.draw(Text(0, 0, "H", "red", "Arial", 10))  # only on request
+    image.draw_text(Text(0, 0, "H", "red", "Arial", 10))
+    # H: the left and right columns (units 0 and 4) and the bar (row 3), from y = 4 units
+    assert pixel(image, 0, 4) == pixel(image, 4, 7) == pixel(image, 2, 7) == (255, 0, 0)
+    assert pixel(image, 2, 5) == pixel(image, 0, 3) == (255, 255, 255)
+
+
+def test_png_export_draws_text():
+    records = [Text(10, 10, "Hello", "black", "Arial", 12)]
+    image = imaging.decode(export.render_png(records, (0, 0, 60, 40), "white"))
+    assert any(pixel(image, x, y)[:3] == (0, 0, 0) for x in range(60) for y in range(40))
@@ -0,0 +1,155 @@
+import asyncio
+import queue
+import threading
+
+import pytest
+
+import session
+import storage
+from scene import Fill, Picture, Scene, Shape, Stroke, Text
+
+
+@pytest.fixture(params=["numpy", "plain"])
+def backend(request, monkeypatch):
+    """Runs a test with NumPy and again on the pure-Python paths."""
+    if request.param == "numpy":
+        if session.np is None:
+            pytest.skip("NumPy is not installed")
+    else:
+        monkeypatch.setattr(session, "np", None)
+    return request.param
+
+
+def round_trip(record, owner=3, item=7):
+    message = session.encode(session.ADD, owner, item, record)
+    (length,) = session.FRAME.unpack_from(message)
+    assert length == len(message) - session.FRAME.size
+    op, got_owner, got_item, decoded = session.decode(message[session.FRAME.size:])
+    assert (op, got_owner, got_item) == (session.ADD, owner, item)
+    return decoded
+
+
+@pytest.mark.parametrize("value", [0, 1, -1, 63, -64, 64, 300, -300, 2 ** 31, -(2 ** 40)])
+def test_varint_round_trip(value):
+    out = bytearray()
+    session.put_varint(out, value)
+    assert session.get_varint(out, 0) == (value, len(out))
+
+
+def test_a_point_a_few_pixels_on_takes_two_bytes():
+    first = session.pack_coords([100, 100], 2)[1]
+    assert len(session.pack_coords([100, 100, 103, 98], 2)[1]) == len(first) + 2
+
+
+def test_stroke_round_trip(backend):
+    points = [10, 20, 12.5, 21, 11, 19.0625, -4, 300]
+    record = round_trip(Stroke(points, "#123456", 3.5))
+    assert isinstance(record, Stroke)
+    assert list(record.points) == points
+    assert (record.color, record.width) == ("#123456", 3.5)
+
+
+def test_coordinates_off_the_grid_go_raw(backend):
+    points = [0.1, 0.2, 100.3, 7.77]
+    coding, data = session.pack_coords(points, 2)
+    assert coding == session.RAW
+    record = round_trip(Stroke(points, "red", 1))
+    assert list(record.points) == pytest.approx(points)
+
+
+def test_other_records_round_trip(backend):
+    text = round_trip(Text(5, 6, "héllo\nworld", "blue", "Courier", 14))
+    assert (text.x, text.y, text.text, text.family, text.size) == (5, 6, "héllo\nworld", "Courier", 14)
+    shape = round_trip(Shape("oval", (1, 2, 30, 40), "green", 2))
+    assert (shape.kind, list(shape.coords)) == ("oval", [1, 2, 30, 40])
+    fill = round_trip(Fill(0.5, 0.5, 1, (0, 2, 9, 1, 3, 8), "yellow"))
+    assert (fill.x, fill.cell, list(fill.spans)) == (0.5, 1, [0, 2, 9, 1, 3, 8])
+    picture = round_trip(Picture(1, 2, 64, 32, "abc123"))
+    assert (picture.width, picture.height, picture.key) == (64, 32, "abc123")
+
+
+def test_other_messages_round_trip():
+    payload = session.encode(session.REMOVE, 2, 9)[session.FRAME.size:]
+    assert session.decode(payload) == (session.REMOVE, 2, 9, None)
+    payload = session.encode(session.IMAGE, 0, 0, b"P6 1 1 255\n\0\0\0")[session.FRAME.size:]
+    assert session.decode(payload) == (session.IMAGE, 0, 0, b"P6 1 1 255\n\0\0\0")
+
+
+@pytest.mark.parametrize("record", [Stroke((), "red", 1), Fill(0, 0, 1, (), "red")])
+def test_records_without_coordinates_are_format_errors(record):
+    payload = session.encode(session.ADD, 1, 1, record)[session.FRAME.size:]
+    with pytest.raises(storage.FormatError):
+        session.decode(payload)
+
+
+def test_numpy_and_plain_deltas_agree(monkeypatch):
+    if session.np is None:
+        pytest.skip("NumPy is not installed")
+    coords = [(i * 37) % 500 - 250 + (i % 16) / 16 for i in range(3000)]
+    coding, data = session.pack_coords(coords, 2)
+    assert coding == session.DELTA
+    fast, end = session.unpack_coords(data, 0, len(coords), coding, 2)
+    monkeypatch.setattr(session, "np", None)
+    slow, slow_end = session.unpack_coords(data, 0, len(coords), coding, 2)
+    assert list(fast) == list(slow) == coords and end == slow_end == len(data)
+
+
+def remote_board():
+    scene = Scene()
+    board = session.Board(scene, lambda *message: None)
+    board.apply(session.WELCOME, 1, 0, None)
+    return scene, board
+
+
+def test_remote_items_go_to_the_shared_layer():
+    scene, board = remote_board()
+    scene.update_layer(scene.layers[0].id, locked=True, visible=False)
+    board.apply(session.ADD, 2, 5, Stroke([0, 0, 10, 10], "red", 1))
+    board.apply(session.ADD, 2, 6, Stroke([0, 5, 10, 5], "red", 1))
+    layer = scene.layers[-1]
+    assert layer.name == session.SHARED_LAYER and scene.editable(layer.id)
+    assert [record.layer for item_id, record in scene] == [layer.id, layer.id]
+    assert len(scene.layers) == 2
+
+
+def test_a_new_version_stays_on_its_layer():
+    scene, board = remote_board()
+    board.apply(session.ADD, 2, 5, Stroke([0, 0, 10, 10], "red", 1))
+    item_id = board.local_id(2, 5)
+    bottom = scene.layers[0].id
+    scene.replace([item_id], lambda record: Stroke(record.points, record.color, record.width, bottom))
+    board.apply(session.ADD, 2, 5, Stroke([1, 1, 11, 11], "blue", 1))
+    assert scene.items[item_id].layer == bottom and scene.items[item_id].color == "blue"
+
+
+def test_a_deleted_shared_layer_comes_back():
+    scene, board = remote_board()
+    board.apply(session.ADD, 2, 5, Stroke([0, 0, 10, 10], "red", 1))
+    scene.remove_layer(scene.layers[-1].id)
+    board.apply(session.ADD, 2, 6, Stroke([0, 0, 10, 10], "red", 1))
+    assert scene.layers[-1].name == session.SHARED_LAYER
+    assert scene.items[board.local_id(2, 6)].layer == scene.layers[-1].id
+
+
+def test_closing_after_the_server_dropped_the_connection():
+    async def drop(reader, writer):
+        writer.close()
+
+    async def serve(started, stop):
+        server = await asyncio.start_server(drop, session.HOST, 0)
+        started.put(server.sockets[0].getsockname()[1])
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        server.close()
+
+    started, stop = queue.Queue(), threading.Event()
+    thread = threading.Thread(target=asyncio.run, args=(serve(started, stop),))
+    thread.start()
+    try:
+        client = session.Client(port=started.get(timeout=5))
+        client.start()
+        assert client.incoming.get(timeout=5) is None
+        client.thread.join(5)
+        client.close()
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,125 @@
+import pytest
+
+import batch
+import storage
+from scene import Fill, Layer, Picture, Scene, Shape, Stroke, Text
+
+
+def drawing_scene():
+    scene = Scene()
+    scene.set_layers([Layer(0, "Back"), Layer(4, "Front", visible=False, locked=True)])
+    key = scene.add_image(b"not really a png")
+    scene.add(Stroke((0, 0, 10, 10, 20, 5), "red", 3))
+    scene.add(Shape("oval", (5, 5, 20, 20), "#123456", 2, layer=4))
+    scene.add(Text(4, 4, "héllo", "black", "Arial", 14))
+    scene.add(Fill(1, 2, 0.5, (0, 1, 3, 1, 0, 4), "blue", layer=4))
+    scene.add(Picture(10, 20, 30, 40, key))
+    return scene
+
+
+def fields(records):
+    return [storage.record_fields(record)[:6] + (list(storage.record_fields(record)[6]), record.layer)
+            for record in records]
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "a.hpaint")
+    scene = drawing_scene()
+    storage.save(path, scene, "ivory", scene.layers, scene.images)
+    loaded = Scene()
+    assert storage.load(path, loaded) == "ivory"
+    assert fields(record for item_id, record in loaded) == fields(record for item_id, record in scene)
+    assert [(layer.id, layer.name, layer.visible, layer.locked) for layer in loaded.layers] == \
+        [(0, "Back", True, False), (4, "Front", False, True)]
+    assert loaded.images == scene.images
+
+
+def test_unused_images_are_only_kept_when_asked(tmp_path):
+    path = str(tmp_path / "a.hpaint")
+    scene = Scene()
+    scene.add_image(b"unused")
+    storage.save(path, scene, images=scene.images)
+    with storage.Drawing(path) as drawing:
+        assert drawing.images == {}
+    storage.save(path, scene, images=scene.images, all_images=True)
+    with storage.Drawing(path) as drawing:
+        assert list(drawing.images.values()) == [b"unused"]
+
+
+def damaged(tmp_path, change):
+    path = str(tmp_path / "a.hpaint")
+    scene = drawing_scene()
+    storage.save(path, scene, "ivory", scene.layers, scene.images)
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    change(data)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def set_header(field, value):
+    def change(data):
+        header = list(storage.HEADER.unpack_from(data))
+        header[field] = value
+        storage.HEADER.pack_into(data, 0, *header)
+    return change
+
+
+def set_item(index, field, value):
+    def change(data):
+        offset = storage.HEADER.unpack_from(data)[7] + index * storage.ITEM.size
+        item = list(storage.ITEM.unpack_from(data, offset))
+        item[field] = value
+        storage.ITEM.pack_into(data, offset, *item)
+    return change
+
+
+@pytest.mark.parametrize("change", [
+    set_header(2, 999),         # background string
+    set_header(3, 10 ** 6),     # item count
+    set_header(4, 10 ** 6),     # string count
+    lambda data: data.__delitem__(slice(20, None)),
+])
+def test_damaged_headers_are_format_errors(tmp_path, change):
+    with pytest.raises(storage.FormatError):
+        storage.Drawing(damaged(tmp_path, change))
+
+
+@pytest.mark.parametrize("change", [
+    set_item(0, 4, 999),        # color string
+    set_item(1, 2, 7),          # layer
+    set_item(2, 8, 1),          # a text with one coordinate
+    set_item(0, 8, 0),          # a stroke without points
+    set_item(0, 8, 3),          # half a point
+    set_item(1, 8, 2),          # an oval with one corner
+    set_item(3, 8, 3),          # a fill without spans
+    set_item(0, 7, 10 ** 6),    # coords past the end
+    set_item(3, 1, 9),          # kind
+])
+def test_damaged_items_are_format_errors(tmp_path, change):
+    with storage.Drawing(damaged(tmp_path, change)) as drawing:
+        with pytest.raises(storage.FormatError):
+            list(drawing)
+
+
+def test_empty_file_is_a_format_error(tmp_path):
+    path = tmp_path / "empty.hpaint"
+    path.write_bytes(b"")
+    with pytest.raises(storage.FormatError):
+        storage.Drawing(str(path))
+
+
+def test_batch_reports_a_damaged_file_instead_of_failing(tmp_path):
+    path = damaged(tmp_path, set_item(0, 4, 999))
+    result = batch.render(path, str(tmp_path / "a.svg"))
+    assert "damaged" in result["error"] and "seconds" in result
+    assert result["error"].startswith(path) and result["error"].count(path) == 1
+
+
+def test_batch_errors_always_name_the_file(tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise ValueError("min() arg is an empty sequence")
+    monkeypatch.setattr(batch.export, "export", fail)
+    result = batch.render("a.hpaint", str(tmp_path / "a.svg"))
+    assert result["error"] == "a.hpaint: min() arg is an empty sequence"